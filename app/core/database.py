@@ -1,19 +1,150 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
 import os
+import sys
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 DB_SCHEMA = os.getenv('DB_SCHEMA', 'docucr')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+# A connection held longer than this is logged with the code that checked it out
+DB_SLOW_HOLD_SECONDS = float(os.getenv('DB_SLOW_HOLD_SECONDS', '10'))
+
+
+class PoolStats:
+    """How long callers wait for a pooled connection and how long they keep it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.hold_seconds = 0.0
+        self.max_hold_seconds = 0.0
+        self.slow_holds = 0
+
+    def waited(self, seconds: float):
+        with self._lock:
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def checked_out_one(self):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def checked_in_one(self, seconds: float):
+        with self._lock:
+            self.checked_out -= 1
+            self.hold_seconds += seconds
+            self.max_hold_seconds = max(self.max_hold_seconds, seconds)
+            if seconds >= DB_SLOW_HOLD_SECONDS:
+                self.slow_holds += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            checkouts = self.checkouts or 1
+            return {
+                "pool_size": DB_POOL_SIZE,
+                "max_overflow": DB_MAX_OVERFLOW,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.wait_seconds / checkouts * 1000, 2),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+                "avg_hold_ms": round(self.hold_seconds / checkouts * 1000, 2),
+                "max_hold_ms": round(self.max_hold_seconds * 1000, 1),
+                "slow_holds": self.slow_holds,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long a checkout waited for a free connection."""
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.waited(time.monotonic() - started)
+
+
+engine = create_engine(
+    DATABASE_URL, pool_pre_ping=True, pool_recycle=3600,
+    pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, poolclass=InstrumentedQueuePool
+)
+
+
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _app_caller(depth: int = 3) -> str:
+    """The innermost application frames on the stack (cheap: no source lines are read)."""
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < depth:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_DIR) and filename != __file__:
+            frames.append(f"{os.path.relpath(filename, _APP_DIR)}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return " <- ".join(frames) or "unknown"
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out_at"] = time.monotonic()
+    connection_record.info["checked_out_by"] = _app_caller()
+    pool_stats.checked_out_one()
+
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    started = connection_record.info.pop("checked_out_at", None)
+    caller = connection_record.info.pop("checked_out_by", None)
+    if started is None:
+        return
+    held = time.monotonic() - started
+    pool_stats.checked_in_one(held)
+    if held >= DB_SLOW_HOLD_SECONDS:
+        print(f"[database] connection held {held:.1f}s, checked out by {caller}")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=3600, pool_size=10, max_overflow=20)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+
+@contextmanager
+def session_scope():
+    """
+    One short unit of work: commit on success, roll back on error, always close.
+
+    Keep these around DB touchpoints only — never across an AI call or other
+    long await — so a connection goes back to the pool as soon as the work is done.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,4 +1,4 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.routers import printers_router, organisations_router
@@ -6,6 +6,13 @@ from .routers import auth_router, modules_router, roles_router, privileges_route
 # Import all models to ensure they are registered with Base metadata
 from .models import user, role, privilege, status, module, document, template, extracted_document, unverified_document, document_list_config, document_share, webhook, external_share, printer,provider,client_location
 
+from .worker import start_embedded as start_embedded_worker, stop_embedded as stop_embedded_worker
+from .services.ai_usage_service import ai_usage
+from .services.websocket_manager import websocket_manager
+from .core.database import pool_stats
+from .core.security import get_current_user
+from .models.user import User
+
 app = FastAPI(title="docucr API", version="1.0.0")
 
 # CORS middleware
@@ -43,6 +50,20 @@ app.include_router(sop_router.router, prefix="/api/sops", tags=["sops"])
 app.include_router(printers_router.router, prefix="/api/printers", tags=["printers"])
 
 
+@app.on_event("startup")
+async def on_startup():
+    # Set EMBEDDED_WORKER=false when running a dedicated fleet (python -m app.worker);
+    # its status and finding messages reach our websockets through the relay
+    websocket_manager.start_listener()
+    start_embedded_worker()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_embedded_worker()
+    websocket_manager.stop_listener()
+    ai_usage.flush()
+
+
 @app.get("/")
 async def root():
     return {"message": "docucr API is running"}
@@ -55,6 +76,11 @@ async def health_simple():
 async def health():
     return {"status": "ok"}
 
+@app.get("/api/health/db")
+async def health_db(current_user: User = Depends(get_current_user)):
+    # Pool sizes and checkout timings are operational detail — signed-in users only
+    return {"status": "ok", "pool": pool_stats.snapshot()}
+
 if __name__ == "__main__":
     import uvicorn
 
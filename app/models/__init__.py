@@ -33,6 +33,11 @@ from .user_role_module import UserRoleModule
 from .organisation import Organisation
 from .provider_client_mapping import ProviderClientMapping
 from .sop_provider_mapping import SopProviderMapping
+from .processing_job import ProcessingJob
+from .ai_result_cache import AIResultCache
+from .layout_fingerprint import LayoutFingerprint
+from .ai_usage import AIUsage
+from .document_processing_span import DocumentProcessingSpan
 
 __all__ = [
     'Base', 'Module', 'Client', 'Privilege', 'Role', 'RoleModule', 'Submodule', 'RoleSubmodule', 'User', 'UserRole', 
@@ -40,5 +45,6 @@ __all__ = [
     'DocumentFormData', 'ExtractedDocument', 'UnverifiedDocument', 'Form', 'FormField', 'Status',
     'DocumentListConfig', 'Printer', 'ActivityLog', 'SOP', 'OTP', 'Webhook',
     'DocumentShare', 'ExternalShare', 'UserClient', 'UserRole', 'UserRoleModule', 'Organisation',
-    'ProviderClientMapping', 'SopProviderMapping'
+    'ProviderClientMapping', 'SopProviderMapping', 'ProcessingJob', 'AIResultCache', 'LayoutFingerprint',
+    'AIUsage', 'DocumentProcessingSpan'
 ]
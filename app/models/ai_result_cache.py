@@ -0,0 +1,27 @@
+from sqlalchemy import Column, String, Integer, DateTime, JSON, ForeignKey
+from sqlalchemy.sql import func
+from .module import Base
+
+
+class AIResultCache(Base):
+    """
+    Cached model output for one page, keyed by content rather than document.
+
+    cache_key = sha256(kind, organisation, normalized page hash, prompt/schema hash),
+    so a re-uploaded or duplicated page is answered from here, and any change to
+    the org's document types or template fields produces a new key.
+    """
+    __tablename__ = "ai_result_cache"
+    __table_args__ = {"schema": "docucr"}
+
+    cache_key = Column(String(64), primary_key=True)
+    kind = Column(String(20), nullable=False)  # classify, extract
+    organisation_id = Column(String, ForeignKey("docucr.organisation.id", ondelete="CASCADE"), nullable=True, index=True)
+    result = Column(JSON, nullable=False)
+    hit_count = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_hit_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<AIResultCache {self.kind} {self.cache_key[:12]} hits={self.hit_count}>"
@@ -0,0 +1,47 @@
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, Float, DateTime, Text, Index
+from sqlalchemy.sql import func
+from .module import Base
+
+
+class AIUsage(Base):
+    """
+    One model call (or one cache hit that replaced a call) — append-only.
+
+    Written in batches by ai_usage_service. There are no foreign keys on purpose:
+    usage is a ledger, so deleting a document or SOP must not delete what it cost.
+    document_id / sop_id come from the job that made the call and may be empty
+    for direct API calls.
+    """
+    __tablename__ = "ai_usage"
+    __table_args__ = (
+        Index("ix_ai_usage_org_created", "organisation_id", "created_at"),
+        Index("ix_ai_usage_document", "document_id"),
+        Index("ix_ai_usage_sop", "sop_id"),
+        {"schema": "docucr"}
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    organisation_id = Column(String, nullable=True)
+    document_id = Column(Integer, nullable=True)
+    sop_id = Column(String, nullable=True)
+
+    endpoint = Column(String(20), nullable=False)  # chat, responses, cache
+    purpose = Column(String(100), nullable=True)  # response schema name, or the cache kind
+    model = Column(String(100), nullable=True)
+
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    cached_prompt_tokens = Column(Integer, nullable=False, default=0)  # provider prompt caching
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    images = Column(Integer, nullable=False, default=0)
+    image_bytes = Column(BigInteger, nullable=False, default=0)
+    latency_ms = Column(Integer, nullable=False, default=0)  # including retries and backoff
+    retries = Column(Integer, nullable=False, default=0)
+    cached = Column(Boolean, nullable=False, default=False)  # answered by ai_result_cache
+    status = Column(String(20), nullable=False, default="ok")  # ok, error
+    error = Column(Text, nullable=True)
+    cost_usd = Column(Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<AIUsage {self.endpoint} {self.model} doc={self.document_id} ${self.cost_usd:.5f}>"
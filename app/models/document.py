@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, func
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, JSON, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -22,6 +22,8 @@ class Document(Base):
     analysis_report_s3_key = Column(String(500), nullable=True)
     is_archived = Column(Boolean, default=False, nullable=False)
     total_pages = Column(Integer, default=0)
+    file_sha256 = Column(String(64), nullable=True, index=True)
+    analysis_metadata = Column(JSON, nullable=True)  # per-run page stats from AIService (blank/cached/model pages)
     created_at = Column(
     DateTime(timezone=True),
     server_default=func.now(),
@@ -0,0 +1,34 @@
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, JSON, ForeignKey, Index
+from sqlalchemy.sql import func
+from .module import Base
+
+
+class DocumentProcessingSpan(Base):
+    """
+    Time one stage of one processing pass took (see processing_trace).
+
+    A pass is the upload (phase "upload") or one analysis attempt (phase
+    "analysis", attempt = job attempt). Every pass also writes a "total" span.
+    """
+    __tablename__ = "document_processing_spans"
+    __table_args__ = (
+        Index("ix_document_processing_spans_org_created", "organisation_id", "created_at"),
+        {"schema": "docucr"}
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    document_id = Column(Integer, ForeignKey("docucr.documents.id", ondelete="CASCADE"), nullable=False, index=True)
+    organisation_id = Column(String, nullable=True)
+
+    phase = Column(String(20), nullable=False)  # upload, analysis
+    attempt = Column(Integer, nullable=False, default=1)
+    stage = Column(String(50), nullable=False)  # s3_upload, queue_wait, rasterize, classify, extract, ...
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    duration_ms = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default="ok")  # ok, error
+    attrs = Column(JSON, nullable=True)  # pages, bytes, pieces of an accumulated span, ...
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<DocumentProcessingSpan doc={self.document_id} {self.phase}.{self.stage} {self.duration_ms}ms>"
@@ -17,6 +17,7 @@ class ExtractedDocument(Base):
     page_range = Column(String(50), nullable=True) # e.g., "1-3"
     extracted_data = Column(JSON, nullable=True)
     confidence = Column(Float, nullable=True)
+    ai_metadata = Column(JSON, nullable=True) # e.g. {"routing": {...}} — which models produced this
     
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,38 @@
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, LargeBinary, Text, ForeignKey, UniqueConstraint, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from .module import Base
+import uuid
+
+
+class LayoutFingerprint(Base):
+    """
+    Layout vector of one analysed page (see rasterizer.layout_vector).
+
+    Rows are written for every page during analysis with no label. When staff
+    confirm a document's classification, document_type / header_restart are
+    filled in from its instances and confirmed_at is set; only confirmed rows
+    are loaded into the per-organisation layout index.
+    """
+    __tablename__ = "layout_fingerprints"
+    __table_args__ = (
+        UniqueConstraint("document_id", "page_number", name="uq_layout_fingerprints_document_page"),
+        Index("ix_layout_fingerprints_org_confirmed", "organisation_id", "confirmed_at"),
+        {"schema": "docucr"}
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    organisation_id = Column(String, ForeignKey("docucr.organisation.id", ondelete="CASCADE"), nullable=False)
+    document_id = Column(Integer, ForeignKey("docucr.documents.id", ondelete="CASCADE"), nullable=False)
+    page_number = Column(Integer, nullable=False)
+
+    vector = Column(LargeBinary, nullable=False)  # float32, rasterizer.LAYOUT_DIM values
+    document_type = Column(String(100), nullable=True)  # classifier type name, set on confirmation
+    header_restart = Column(Boolean, nullable=True)
+    header_text = Column(Text, nullable=True)  # OCR / text-layer header, see ocr_classifier
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    confirmed_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<LayoutFingerprint doc={self.document_id} p{self.page_number} {self.document_type}>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer, JSON
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
@@ -12,6 +12,7 @@ class Organisation(Base):
     name = Column(String, nullable=False)
     status_id = Column(Integer, ForeignKey('docucr.status.id'))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    ai_settings = Column(JSON, nullable=True)  # e.g. {"model_cascade": {...}}, see model_cascade_service
 
     users = relationship("User", back_populates="organisation")
 
@@ -0,0 +1,46 @@
+from sqlalchemy import Column, String, Integer, DateTime, Text, JSON, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+from .module import Base
+import uuid
+
+
+class ProcessingJob(Base):
+    """
+    Durable background job claimed by workers with SELECT ... FOR UPDATE SKIP LOCKED.
+
+    Lifecycle: PENDING -> RUNNING -> SUCCEEDED
+                                  -> PENDING (retry, after backoff)
+                                  -> DEAD    (attempts exhausted — dead letter)
+    A RUNNING job whose locked_until has passed is treated as abandoned
+    (worker crashed / deploy) and is claimed again by the next worker.
+    """
+    __tablename__ = "processing_jobs"
+    __table_args__ = (
+        Index("ix_processing_jobs_claim", "status", "priority", "run_after"),
+        {"schema": "docucr"}
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    job_type = Column(String(50), nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+
+    status = Column(String(20), nullable=False, default="PENDING")  # PENDING, RUNNING, SUCCEEDED, DEAD
+    priority = Column(Integer, nullable=False, default=0)  # higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    last_error = Column(Text, nullable=True)
+
+    run_after = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    locked_by = Column(String(100), nullable=True)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+
+    organisation_id = Column(String, ForeignKey("docucr.organisation.id"), nullable=True, index=True)
+    document_id = Column(Integer, ForeignKey("docucr.documents.id", ondelete="CASCADE"), nullable=True, index=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<ProcessingJob {self.job_type} {self.status} attempts={self.attempts}>"
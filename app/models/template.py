@@ -32,6 +32,8 @@ class Template(Base):
         nullable=False,
         server_default=text("'[]'::json")
     )
+    # Normalized boxes of fields that always sit in the same place (see field_regions)
+    field_regions = Column(JSON, nullable=True)
     created_by = Column(
         String,
         ForeignKey("docucr.user.id"),
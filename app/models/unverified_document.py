@@ -15,6 +15,7 @@ class UnverifiedDocument(Base):
     suspected_type = Column(String(100), nullable=True) # Type name returned by AI
     page_range = Column(String(50), nullable=True)
     extracted_data = Column(JSON, nullable=True) # Preview data
+    ai_metadata = Column(JSON, nullable=True) # e.g. {"routing": {...}} — which models produced this
     status = Column(String(20), default="PENDING") # PENDING, VERIFIED, REJECTED
     
     created_at = Column(DateTime, default=datetime.utcnow)
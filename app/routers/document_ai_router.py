@@ -1,19 +1,40 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Request
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Request, Query
 from sqlalchemy.orm import Session
 from ..core.database import get_db
 from ..core.permissions import Permission
 from ..services.openai_document_ai import OpenAIDocumentAI
 from ..services.ai_client import openai_client
+from ..services.ai_cache_service import ai_cache
+from ..services.ai_scheduler import ai_request_context
+from ..services.ai_usage_service import ai_usage
+from ..services.processing_trace import document_spans, stage_percentiles
+from ..services.model_cascade_service import model_cascade_service
 from ..models.template import Template
 from ..models.document_type import DocumentType
 from ..services.activity_service import ActivityService
 from ..models.user import User
 from ..core.security import get_current_user
+from pydantic import BaseModel
+from typing import Any, Dict, Optional
 import os
 
 router = APIRouter( tags=["AI"])
 
 
+class ModelCascadeUpdate(BaseModel):
+    model_cascade: Optional[Dict[str, Any]] = None  # None resets the organisation to the defaults
+
+
+def _organisation_id(current_user) -> str:
+    org_id = getattr(current_user, "context_organisation_id", None) or getattr(current_user, "organisation_id", None)
+    if not org_id and hasattr(current_user, "id") and not hasattr(current_user, "organisation_id"):
+        # Organisation login — the org is the user
+        org_id = current_user.id
+    if not org_id:
+        raise HTTPException(status_code=400, detail="No organisation context")
+    return str(org_id)
+
+
 @router.post("/classify-and-extract")
 async def classify_and_extract_document(
     file: UploadFile = File(...),
@@ -54,11 +75,133 @@ async def classify_and_extract_document(
         model=os.getenv("OPEN_AI_MODEL", "gpt-4o-mini")
     )
 
+    org_id = getattr(current_user, "context_organisation_id", None) or getattr(current_user, "organisation_id", None)
     try:
-        return await ai.analyze(
-            file_bytes=file_bytes,
-            filename=file.filename,
-            schemas=schemas
-        )
+        with ai_request_context(org_id):
+            return await ai.analyze(
+                file_bytes=file_bytes,
+                filename=file.filename,
+                schemas=schemas
+            )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/cache-stats")
+async def get_cache_stats(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """Page result cache hit/miss counters for the caller's organisation."""
+    org_id = _organisation_id(current_user)
+
+    process = ai_cache.stats(str(org_id))
+    return {
+        "organisation_id": str(org_id),
+        "enabled": process["enabled"],
+        "process": process["organisations"].get(str(org_id), {}),
+        "stored": ai_cache.stored_stats(db, str(org_id)),
+    }
+
+
+@router.get("/usage")
+async def get_usage(
+    days: int = Query(30, ge=1, le=366),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """Model calls, tokens, images and cost of the caller's organisation, per day and per model."""
+    org_id = _organisation_id(current_user)
+    return ai_usage.daily_usage(db, org_id, days)
+
+
+@router.get("/usage/documents/{document_id}")
+async def get_document_usage(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """Everything the AI pipeline spent on one document, including reanalysis."""
+    org_id = _organisation_id(current_user)
+    return ai_usage.document_usage(db, org_id, document_id)
+
+
+@router.get("/usage/sops/{sop_id}")
+async def get_sop_usage(
+    sop_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """Everything SOP extraction spent on one SOP and its documents."""
+    org_id = _organisation_id(current_user)
+    return ai_usage.sop_usage(db, org_id, sop_id)
+
+
+@router.get("/processing-latency")
+async def get_processing_latency(
+    days: int = Query(7, ge=1, le=90),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """p50/p95/p99 time per processing stage (queue wait, upload, rasterize, classify, ...), overall and per day."""
+    org_id = _organisation_id(current_user)
+    return stage_percentiles(db, org_id, days)
+
+
+@router.get("/processing-latency/documents/{document_id}")
+async def get_document_trace(
+    document_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """Every recorded stage of one document's upload and analysis attempts."""
+    org_id = _organisation_id(current_user)
+    return {"document_id": document_id, "spans": document_spans(db, org_id, document_id)}
+
+
+@router.get("/model-cascade")
+async def get_model_cascade(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("documents", "READ"))
+):
+    """The caller's organisation's model cascade overrides and the effective cascade."""
+    org_id = _organisation_id(current_user)
+    return {"organisation_id": org_id, **model_cascade_service.get_settings(db, org_id)}
+
+
+@router.put("/model-cascade")
+async def update_model_cascade(
+    payload: ModelCascadeUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    permission: bool = Depends(Permission("users", "UPDATE")),
+    req: Request = None,
+    background_tasks: BackgroundTasks = None
+):
+    """Set which models each AI stage tries, cheapest first, and when to escalate."""
+    org_id = _organisation_id(current_user)
+    try:
+        result = model_cascade_service.update_settings(db, org_id, payload.model_cascade)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Organisation not found")
+
+    ActivityService.log(
+        db,
+        action="UPDATE",
+        entity_type="organisation",
+        entity_id=org_id,
+        current_user=current_user,
+        details={"model_cascade": payload.model_cascade},
+        request=req,
+        background_tasks=background_tasks
+    )
+    return {"organisation_id": org_id, **result}
@@ -679,6 +679,7 @@ async def get_document_detail(
         "created_at": document.created_at.isoformat(),
         "updated_at": document.updated_at.isoformat(),
         "analysis_report_s3_key": document.analysis_report_s3_key,
+        "analysis_metadata": document.analysis_metadata,
         "is_archived": document.is_archived,
         "extracted_documents": [
             {
@@ -686,7 +687,8 @@ async def get_document_detail(
                 "document_type": ed.document_type.name.upper() if ed.document_type else None,
                 "page_range": ed.page_range,
                 "confidence": ed.confidence,
-                "extracted_data": ed.extracted_data
+                "extracted_data": ed.extracted_data,
+                "ai_metadata": ed.ai_metadata
             } for ed in document.extracted_documents
         ],
         "unverified_documents": [
@@ -694,7 +696,8 @@ async def get_document_detail(
                 "id": str(ud.id),
                 "suspected_type": ud.suspected_type,
                 "page_range": ud.page_range,
-                "status": ud.status
+                "status": ud.status,
+                "ai_metadata": ud.ai_metadata
             } for ud in document.unverified_documents
         ]
     }
@@ -967,6 +970,37 @@ async def reanalyze_document(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/{document_id}/confirm-classification")
+async def confirm_document_classification(
+    document_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    permission: bool = Depends(Permission("documents", "UPDATE")),
+    background_tasks: BackgroundTasks = None,
+    request: Request = None
+):
+    """Confirm the page classification of an analysed document"""
+    pages = await document_service.confirm_classification(
+        db,
+        document_id,
+        current_user
+    )
+
+    if pages is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    ActivityService.log(
+        db,
+        action="UPDATE",
+        entity_type="document",
+        entity_id=str(document_id),
+        current_user=current_user,
+        details={"sub_action": "CONFIRM_CLASSIFICATION", "pages": pages},
+        request=request,
+        background_tasks=background_tasks
+    )
+    return {"message": "Classification confirmed", "pages_learned": pages}
+
 @router.post("/{document_id}/archive")
 async def archive_document(
     document_id: int,
@@ -21,6 +21,7 @@ from app.models.client import Client
 from app.services.ai_sop_service import AISOPService
 from app.services.sop_service import SOPService
 from app.services.s3_service import s3_service
+from app.services.job_queue_service import JobQueueService, PRIORITY_INTERACTIVE
 from app.core.security import get_current_user
 from app.core.permissions import Permission
 
@@ -223,14 +224,15 @@ async def process_extra_documents(
     if not unprocessed:
         return {"message": "No unprocessed documents found", "queued": 0}
 
-    # Run extraction for each doc independently in background
-    # so one failure doesn't block others
+    # One job per doc so one failure doesn't block others
     for doc in unprocessed:
-        background_tasks.add_task(
-            SOPService.extract_and_apply_document,
-            doc_id=str(doc.id),
-            sop_id=str(sop_id),
+        JobQueueService.enqueue(
+            db, "sop.document_extract",
+            {"doc_id": str(doc.id), "sop_id": str(sop_id)},
+            organisation_id=sop.organisation_id,
+            commit=False
         )
+    db.commit()
 
     return {
         "message": f"Extraction queued for {len(unprocessed)} document(s)",
@@ -535,16 +537,12 @@ async def ai_extract_sop_background(
             ))
         db.commit()
 
-    file_ext = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-        temp_file_path = tmp.name
-        tmp.write(file_content)
-
-    background_tasks.add_task(
-        AISOPService.process_sop_extraction,
-        new_sop.id,
-        temp_file_path,
-        file.content_type
+    # The worker pulls the source file back from S3, so extraction survives a restart
+    JobQueueService.enqueue(
+        db, "sop.extract",
+        {"sop_id": str(new_sop.id), "s3_key": s3_key, "content_type": file.content_type},
+        organisation_id=org_id,
+        priority=PRIORITY_INTERACTIVE
     )
 
     return {"sop_id": str(new_sop.id)}
@@ -589,13 +587,11 @@ async def reanalyse_sop(
     elif s3_key.endswith((".png", ".jpg", ".jpeg")):
         content_type = "image/png" if s3_key.endswith(".png") else "image/jpeg"
 
-    # Background task will need to handle downloading from S3
-    background_tasks.add_task(
-        AISOPService.process_sop_extraction,
-        sop.id,
-        None, # No local file path yet
-        content_type,
-        s3_key=s3_key
+    JobQueueService.enqueue(
+        db, "sop.extract",
+        {"sop_id": str(sop.id), "s3_key": s3_key, "content_type": content_type},
+        organisation_id=sop.organisation_id,
+        priority=PRIORITY_INTERACTIVE
     )
 
     return {"message": "Reanalysis started", "sop_id": str(sop.id)}
@@ -20,6 +20,7 @@ class TemplateCreate(BaseModel):
     document_type_id: str
     status_id: Optional[str] = None
     extraction_fields: List[Dict[str, Any]] = []
+    field_regions: Optional[List[Dict[str, Any]]] = None
 
 class TemplateUpdate(BaseModel):
     template_name: Optional[str] = None
@@ -27,6 +28,7 @@ class TemplateUpdate(BaseModel):
     document_type_id: Optional[str] = None
     status_id: Optional[str] = None
     extraction_fields: Optional[List[Dict[str, Any]]] = None
+    field_regions: Optional[List[Dict[str, Any]]] = None  # [] clears them
 
 class DocumentTypeInfo(BaseModel):
     id: UUID
@@ -45,6 +47,7 @@ class TemplateResponse(BaseModel):
     status_id: int
     statusCode: Optional[str] = None
     extraction_fields: List[Dict[str, Any]]
+    field_regions: Optional[List[Dict[str, Any]]] = None
     created_at: datetime
     updated_at: datetime
     document_type: Optional[DocumentTypeInfo] = None
@@ -101,7 +104,8 @@ def create_template(
         template_data.description,
         template_data.extraction_fields,
         template_data.status_id,
-        user_id=current_user.id
+        user_id=current_user.id,
+        field_regions=template_data.field_regions
     )
     
     ActivityService.log(
@@ -146,6 +150,7 @@ def update_template(
         "description": template_data.description,
         "document_type_id": template_data.document_type_id,
         "extraction_fields": template_data.extraction_fields,
+        "field_regions": template_data.field_regions,
         "status_id": template_data.status_id
     }
     changes = {}
@@ -175,7 +180,8 @@ def update_template(
         template_data.description,
         template_data.document_type_id,
         template_data.extraction_fields,
-        template_data.status_id
+        template_data.status_id,
+        field_regions=template_data.field_regions
     )
     
     if template:
@@ -0,0 +1,82 @@
+"""
+AI backends.
+
+Everything that talks to a model — AIService, OpenAIDocumentAI, the SOP
+service — goes through ``ai_client.openai_client``, a ResilientAIClient around
+one backend. A backend is anything with the two OpenAI SDK calls the services
+make:
+
+    await backend.chat.completions.create(model=..., messages=..., response_format=..., ...)
+    await backend.responses.create(model=..., input=..., text=..., ...)
+
+returning objects shaped like the SDK's (``choices[0].message.content``,
+``output[].content[].text``, ``usage``). AI_BACKEND picks the one used:
+
+- openai — the real API (default)
+- fake   — deterministic, schema-valid answers with configurable latency and
+           error rates, for load tests and CI (see fake_ai_backend)
+- record — AI_CASSETTE_INNER, with every response saved to a cassette
+- replay — answers from the cassette only, no network (see ai_cassette)
+"""
+import os
+from typing import Any, Callable, Dict, Protocol
+
+AI_BACKEND = os.getenv("AI_BACKEND", "openai").strip().lower()
+
+
+class CreateAPI(Protocol):
+    async def create(self, **kwargs) -> Any: ...
+
+
+class ChatAPI(Protocol):
+    completions: CreateAPI
+
+
+class AIBackend(Protocol):
+    chat: ChatAPI
+    responses: CreateAPI
+
+
+def _openai() -> AIBackend:
+    from openai import AsyncOpenAI
+
+    # SDK retries are disabled: ResilientAIClient owns retry/backoff so a 429 storm
+    # isn't multiplied by a second, uncoordinated retry loop underneath it.
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY", "missing-key-for-test-init"),
+        max_retries=0
+    )
+
+
+def _fake() -> AIBackend:
+    from app.services.fake_ai_backend import FakeBackend
+    return FakeBackend()
+
+
+def _cassette(mode: str) -> Callable[[], AIBackend]:
+    def factory() -> AIBackend:
+        from app.services.ai_cassette import AI_CASSETTE_INNER, CassetteBackend, MODE_RECORD
+        if mode != MODE_RECORD:
+            return CassetteBackend(mode)
+        if AI_CASSETTE_INNER not in ("openai", "fake"):
+            raise ValueError(f"AI_CASSETTE_INNER must be openai or fake, not '{AI_CASSETTE_INNER}'")
+        return CassetteBackend(mode, inner=BACKENDS[AI_CASSETTE_INNER]())
+    return factory
+
+
+BACKENDS: Dict[str, Callable[[], AIBackend]] = {
+    "openai": _openai,
+    "fake": _fake,
+    "record": _cassette("record"),
+    "replay": _cassette("replay"),
+}
+
+
+def create_backend(name: str = None) -> AIBackend:
+    name = (name or AI_BACKEND).strip().lower()
+    factory = BACKENDS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown AI_BACKEND '{name}' (expected one of {sorted(BACKENDS)})")
+    if name != "openai":
+        print(f"[ai_backend] using the '{name}' backend — no requests go to OpenAI")
+    return factory()
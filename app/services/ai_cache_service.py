@@ -0,0 +1,279 @@
+"""
+Content-addressed cache for page classification and field extraction.
+
+Batches are full of repeated pages — the same consent form, the same blank
+back page, the same document re-uploaded for reanalysis. Each model call is
+keyed by:
+
+    sha256(kind, organisation, normalized page hash, prompt hash)
+
+- The page hash comes from the rasterizer (``DocumentPages.fingerprint``) and is
+  taken over a grayscale, downscaled, quantized copy of the page, so JPEG
+  re-encoding noise does not change it.
+- The prompt hash covers everything the model sees besides the image: the
+  org's document types and descriptions for classification, the template's
+  fields for extraction, the model name and the prompt wording itself. Editing a
+  document type or template therefore changes the key and old entries are simply
+  never read again (they age out after AI_CACHE_TTL_DAYS).
+
+Lookups go through a per-process LRU first and then docucr.ai_result_cache.
+``get_or_compute`` also coalesces identical pages that are in flight at the
+same time (a PDF with the same form 40 times sends one request, not 40).
+Entries are always scoped to an organisation — one tenant's pages never answer
+another tenant's request. A failing cache never fails the analysis.
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.database import SessionLocal
+from app.models.ai_result_cache import AIResultCache
+from app.services.ai_scheduler import current_ai_context
+from app.services.ai_usage_service import ai_usage
+
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_LRU_SIZE = int(os.getenv("AI_CACHE_LRU_SIZE", "4096"))  # entries per process
+AI_CACHE_TTL_DAYS = int(os.getenv("AI_CACHE_TTL_DAYS", "30"))
+
+KIND_CLASSIFY = "classify"
+KIND_EXTRACT = "extract"
+
+_NO_ORG = "_none"
+
+
+def prompt_hash(*parts: Any) -> str:
+    """Stable hash of everything (besides the image) that determines the model's answer."""
+    blob = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _load(cache_key: str, cutoff: datetime) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            update(AIResultCache)
+            .where(AIResultCache.cache_key == cache_key, AIResultCache.created_at >= cutoff)
+            .values(hit_count=AIResultCache.hit_count + 1, last_hit_at=func.now())
+            .returning(AIResultCache.result)
+        ).scalar()
+        db.commit()
+        return result
+    finally:
+        db.close()
+
+
+def _store(cache_key: str, kind: str, organisation_id: Optional[str], result: dict):
+    db = SessionLocal()
+    try:
+        stmt = insert(AIResultCache).values(
+            cache_key=cache_key,
+            kind=kind,
+            organisation_id=organisation_id,
+            result=result,
+            hit_count=0,
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[AIResultCache.cache_key],
+            set_={"result": stmt.excluded.result, "created_at": func.now(), "hit_count": 0},
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+class _Flight:
+    """The request being made for one key, and how many other callers wait on it."""
+    __slots__ = ("task", "waiters", "abandoned")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.abandoned = False  # the caller that started it was cancelled
+
+
+class AICacheService:
+    def __init__(self, lru_size: int = AI_CACHE_LRU_SIZE, ttl_days: int = AI_CACHE_TTL_DAYS,
+                 enabled: bool = AI_CACHE_ENABLED):
+        self.enabled = enabled
+        self.lru_size = max(0, lru_size)
+        self.ttl = timedelta(days=ttl_days)
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, result)
+        self._stats = defaultdict(lambda: defaultdict(lambda: {"hits": 0, "memory_hits": 0, "coalesced": 0, "misses": 0, "stores": 0}))
+        self._inflight = {}  # (loop id, key) -> _Flight of the request being made for that key
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _org() -> Optional[str]:
+        return current_ai_context()["organisation_id"]
+
+    @staticmethod
+    def make_key(kind: str, organisation_id: Optional[str], page_hash: str, schema_hash: str) -> str:
+        raw = f"{kind}|{organisation_id or _NO_ORG}|{page_hash}|{schema_hash}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, org: Optional[str], kind: str, counter: str):
+        with self._lock:
+            self._stats[org or _NO_ORG][kind][counter] += 1
+
+    def _remember(self, key: str, result: dict):
+        if not self.lru_size:
+            return
+        with self._lock:
+            self._lru[key] = (datetime.now(timezone.utc), result)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    async def get(self, kind: str, page_hash: Optional[str], schema_hash: str) -> Optional[dict]:
+        """Cached result for this page + prompt, or None. Returned dicts are copies."""
+        if not self.enabled or not page_hash:
+            return None
+        org = self._org()
+        key = self.make_key(kind, org, page_hash, schema_hash)
+        now = datetime.now(timezone.utc)
+
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._lru.move_to_end(key)
+                self._stats[org or _NO_ORG][kind]["hits"] += 1
+                self._stats[org or _NO_ORG][kind]["memory_hits"] += 1
+                return copy.deepcopy(entry[1])
+
+        try:
+            result = await asyncio.to_thread(_load, key, now - self.ttl)
+        except Exception as e:
+            print(f"[ai_cache] lookup failed: {e}")
+            result = None
+
+        if result is None:
+            self._count(org, kind, "misses")
+            return None
+        self._remember(key, result)
+        self._count(org, kind, "hits")
+        return copy.deepcopy(result)
+
+    async def put(self, kind: str, page_hash: Optional[str], schema_hash: str, result: dict):
+        if not self.enabled or not page_hash or result is None:
+            return
+        org = self._org()
+        key = self.make_key(kind, org, page_hash, schema_hash)
+        result = copy.deepcopy(result)
+        self._remember(key, result)
+        try:
+            await asyncio.to_thread(_store, key, kind, org, result)
+            self._count(org, kind, "stores")
+        except Exception as e:
+            print(f"[ai_cache] store failed: {e}")
+
+    async def get_or_compute(self, kind: str, page_hash: Optional[str], schema_hash: str,
+                             compute: Callable[[], Awaitable[dict]],
+                             cacheable: Callable[[dict], bool] = None) -> Tuple[dict, bool]:
+        """
+        Return ``(result, from_cache)``. On a miss ``compute()`` is awaited once per
+        key — concurrent callers with the same page wait for that request instead of
+        sending their own — and its result is stored when ``cacheable(result)`` allows.
+
+        The request runs as its own task, so cancelling the caller that started it
+        (see analysis_cancellation) leaves it running for the callers still waiting
+        on it; it is cancelled only once nobody is left to use the answer.
+        """
+        cached = await self.get(kind, page_hash, schema_hash)
+        if cached is not None:
+            ai_usage.record_cache_hit(kind)
+            return cached, True
+        if not self.enabled or not page_hash:
+            return await compute(), False
+
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), self.make_key(kind, self._org(), page_hash, schema_hash))
+        flight = self._inflight.get(flight_key)
+        if flight is not None:
+            flight.waiters += 1
+            try:
+                _, shared = await asyncio.shield(flight.task)
+            except Exception:
+                shared = None
+            finally:
+                flight.waiters -= 1
+                if flight.abandoned and not flight.waiters:
+                    self._abandon(flight_key, flight)
+            if shared is not None:
+                self._count(self._org(), kind, "coalesced")
+                ai_usage.record_cache_hit(kind)
+                return copy.deepcopy(shared), True
+            return await compute(), False  # the leading request failed; try on our own
+
+        flight = _Flight()
+        flight.task = loop.create_task(self._lead(flight_key, flight, kind, page_hash, schema_hash,
+                                                  compute, cacheable))
+        self._inflight[flight_key] = flight
+        try:
+            result, _ = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.abandoned = True
+            if not flight.waiters:
+                self._abandon(flight_key, flight)
+            raise
+        return result, False
+
+    async def _lead(self, flight_key, flight: _Flight, kind: str, page_hash: str, schema_hash: str,
+                    compute: Callable[[], Awaitable[dict]], cacheable: Optional[Callable[[dict], bool]]):
+        """Make the request for a flight. Returns (result, copy for the waiters or None)."""
+        try:
+            result = await compute()
+            if cacheable is not None and not cacheable(result):
+                return result, None
+            await self.put(kind, page_hash, schema_hash, result)
+            return result, copy.deepcopy(result)
+        finally:
+            if self._inflight.get(flight_key) is flight:
+                del self._inflight[flight_key]
+
+    def _abandon(self, flight_key, flight: _Flight):
+        """Nobody is waiting for this flight any more: stop its request."""
+        if self._inflight.get(flight_key) is flight:
+            del self._inflight[flight_key]  # later callers start a request of their own
+        flight.task.cancel()
+
+    def stats(self, organisation_id: Optional[str] = None) -> dict:
+        """Hit/miss counters since this process started, per organisation and kind."""
+        with self._lock:
+            snapshot = {
+                org: {kind: dict(counts) for kind, counts in kinds.items()}
+                for org, kinds in self._stats.items()
+            }
+            lru_entries = len(self._lru)
+        if organisation_id is not None:
+            snapshot = {str(organisation_id): snapshot.get(str(organisation_id), {})}
+        for kinds in snapshot.values():
+            for counts in kinds.values():
+                lookups = counts["hits"] + counts["misses"]
+                # a coalesced page missed the cache but still cost no request of its own
+                served = counts["hits"] + counts["coalesced"]
+                counts["hit_rate"] = round(served / lookups, 4) if lookups else None
+        return {"enabled": self.enabled, "lru_entries": lru_entries, "organisations": snapshot}
+
+    @staticmethod
+    def stored_stats(db, organisation_id: Optional[str]) -> dict:
+        """Entries and lifetime hits in docucr.ai_result_cache for one organisation, by kind."""
+        rows = db.query(
+            AIResultCache.kind,
+            func.count(AIResultCache.cache_key),
+            func.coalesce(func.sum(AIResultCache.hit_count), 0),
+        ).filter(
+            AIResultCache.organisation_id == organisation_id
+        ).group_by(AIResultCache.kind).all()
+        return {kind: {"entries": entries, "hits": int(hits)} for kind, entries, hits in rows}
+
+
+ai_cache = AICacheService()
@@ -0,0 +1,170 @@
+"""
+Record / replay store for AI responses.
+
+Changes to post-processing (instance grouping, code filtering, sequential-run
+removal) are judged by re-running documents — which used to mean paying for
+and waiting on the same model calls again. Two more backends (see ai_backend)
+make that free:
+
+- AI_BACKEND=record — calls go to AI_CASSETTE_INNER (the real API by default)
+  and every successful request/response pair is written to the cassette;
+- AI_BACKEND=replay — answers come from the cassette only; a request that was
+  never recorded raises ``CassetteMiss``. Replay is not rate limited.
+
+Requests are keyed by a hash of everything sent with each image replaced by its
+own hash, so a re-run of the same documents with the same prompts and models
+hits. The cassette is one SQLite file (AI_CASSETTE_PATH) of zlib-compressed
+JSON, safe to share between the API process and the job workers.
+
+Record with AI_CACHE_ENABLED=false (ai_cache hits never reach the backend) and
+AI_BATCH_CLASSIFICATION=false (batches depend on timing); replay the same way.
+
+    python -m app.services.ai_cassette [--path ai_cassette.sqlite3]   # what is recorded
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Any, Optional
+
+from app.services.ai_cache_service import prompt_hash
+
+AI_CASSETTE_PATH = os.getenv("AI_CASSETTE_PATH", "ai_cassette.sqlite3")
+AI_CASSETTE_INNER = os.getenv("AI_CASSETTE_INNER", "openai")  # backend a recording is taken from
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+ENDPOINT_CHAT = "chat"
+ENDPOINT_RESPONSES = "responses"
+
+
+class CassetteMiss(LookupError):
+    """Replay of a request that was never recorded."""
+
+
+def _without_images(node):
+    if isinstance(node, list):
+        return [_without_images(item) for item in node]
+    if isinstance(node, dict):
+        if node.get("type") in ("image_url", "input_image"):
+            digest = hashlib.sha256(json.dumps(node, sort_keys=True).encode("utf-8")).hexdigest()
+            return {"type": node["type"], "sha256": digest}
+        return {k: _without_images(v) for k, v in node.items()}
+    return node
+
+
+def request_key(endpoint: str, kwargs: dict) -> str:
+    """Prompt hash of the request, with each image standing in as its own hash."""
+    return prompt_hash(endpoint, _without_images(kwargs))
+
+
+def to_plain(obj) -> Any:
+    """SDK response (pydantic model or namespace) -> JSON-able data."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, SimpleNamespace):
+        return {k: to_plain(v) for k, v in vars(obj).items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: to_plain(v) for k, v in obj.items()}
+    return obj
+
+
+def to_namespace(data) -> Any:
+    """Recorded data -> object with the attribute access the services use."""
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [to_namespace(v) for v in data]
+    return data
+
+
+class CassetteStore:
+    def __init__(self, path: str = AI_CASSETTE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cassette ("
+                " key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, model TEXT,"
+                " recorded_at REAL NOT NULL, response BLOB NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM cassette WHERE key = ?", (key,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def put(self, key: str, endpoint: str, model: Optional[str], response: dict):
+        blob = zlib.compress(json.dumps(response, separators=(",", ":")).encode("utf-8"), 6)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cassette (key, endpoint, model, recorded_at, response) VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, model, time.time(), blob),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT endpoint, model, COUNT(*), SUM(LENGTH(response)) FROM cassette GROUP BY endpoint, model"
+            ).fetchall()
+        return {
+            "entries": sum(r[2] for r in rows),
+            "bytes": sum(r[3] or 0 for r in rows),
+            "by_model": {f"{endpoint}:{model}": count for endpoint, model, count, _ in rows},
+        }
+
+
+class CassetteBackend:
+    def __init__(self, mode: str, store: CassetteStore = None, inner=None):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"Unknown cassette mode '{mode}'")
+        if mode == MODE_RECORD and inner is None:
+            raise ValueError("Recording needs a backend to record from")
+        self.mode = mode
+        self.store = store or CassetteStore()
+        self.inner = inner
+        self.rate_limited = mode == MODE_RECORD  # replay answers locally, see ResilientAIClient
+        self.hits = self.misses = self.recorded = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(
+            create=lambda **kwargs: self._call(ENDPOINT_CHAT, kwargs)
+        ))
+        self.responses = SimpleNamespace(create=lambda **kwargs: self._call(ENDPOINT_RESPONSES, kwargs))
+
+    async def _call(self, endpoint: str, kwargs: dict):
+        key = request_key(endpoint, kwargs)
+        if self.mode == MODE_REPLAY:
+            data = await asyncio.to_thread(self.store.get, key)
+            if data is None:
+                self.misses += 1
+                raise CassetteMiss(f"no recorded {endpoint} response for {kwargs.get('model')} (key {key[:12]})")
+            self.hits += 1
+            return to_namespace(data)
+
+        api = self.inner.chat.completions if endpoint == ENDPOINT_CHAT else self.inner.responses
+        response = await api.create(**kwargs)
+        await asyncio.to_thread(self.store.put, key, endpoint, kwargs.get("model"), to_plain(response))
+        self.recorded += 1
+        return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise an AI response cassette")
+    parser.add_argument("--path", default=AI_CASSETTE_PATH)
+    args = parser.parse_args()
+    stats = CassetteStore(args.path).stats()
+    print(f"{args.path}: {stats['entries']} responses, {stats['bytes'] / 1024:.0f} KB compressed")
+    for name, count in sorted(stats["by_model"].items()):
+        print(f"  {name:40s} {count}")
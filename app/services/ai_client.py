@@ -1,6 +1,6 @@
-from openai import AsyncOpenAI
-import os
+from app.services.ai_backend import create_backend
+from app.services.ai_resilience import ResilientAIClient
 
-openai_client = AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY", "missing-key-for-test-init")
-)
+# AI_BACKEND selects the backend (OpenAI, or the local fake for load tests);
+# rate limits, retries and the circuit breaker wrap whichever it is
+openai_client = ResilientAIClient(create_backend())
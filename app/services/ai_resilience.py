@@ -0,0 +1,355 @@
+"""
+Rate limiting, retries and circuit breaking for the shared OpenAI client.
+
+``ResilientAIClient`` wraps an AI backend (AsyncOpenAI, or another
+ai_backend.AIBackend) and exposes the same ``chat.completions.create`` /
+``responses.create`` calls. Each call:
+
+1. waits while the circuit breaker is open (provider outage),
+2. takes one request and its estimated tokens from the model's RPM/TPM buckets,
+3. takes an ai_scheduler slot for the attempt itself only — the breaker and
+   bucket waits and the retry backoff happen outside it, so a 429 storm or an
+   open breaker doesn't pin slots other organisations and lanes could use,
+4. retries only this call on 429 / 5xx / connection errors with jittered
+   exponential backoff, honouring Retry-After when the API sends it,
+5. records its tokens, images, latency and retries (see ai_usage_service).
+
+Limits per model come from AI_MODEL_LIMITS, e.g.
+    {"gpt-4o": {"rpm": 5000, "tpm": 800000}, "gpt-4o-mini": {"rpm": 5000, "tpm": 4000000}}
+Like ai_scheduler, the state is shared by every event loop in the process.
+"""
+import asyncio
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from datetime import timezone
+from typing import Optional, Tuple
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from app.services.ai_scheduler import ai_scheduler
+from app.services.ai_usage_service import AIUsageRecorder, ai_usage
+
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "5"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1"))  # seconds
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "60"))  # seconds
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))  # consecutive failures
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))  # seconds
+
+DEFAULT_MODEL_LIMITS = {
+    "gpt-4o": {"rpm": 5000, "tpm": 800000},
+    "gpt-4o-mini": {"rpm": 5000, "tpm": 4000000},
+}
+AI_MODEL_LIMITS = {**DEFAULT_MODEL_LIMITS, **json.loads(os.getenv("AI_MODEL_LIMITS") or "{}")}
+
+# Vision token cost per image (OpenAI tile pricing for a letter-size page)
+IMAGE_TOKENS_HIGH = 1105
+IMAGE_TOKENS_LOW = 85
+
+
+def estimate_tokens(kwargs: dict) -> int:
+    """Rough token estimate for a request: ~4 chars/token for text, tile cost for images, plus the output cap."""
+    chars = 0
+    images = 0
+
+    def walk(node, detail="high"):
+        nonlocal chars, images
+        if isinstance(node, str):
+            chars += len(node)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            kind = node.get("type")
+            if kind in ("image_url", "input_image"):
+                url = node.get("image_url")
+                level = (url.get("detail") if isinstance(url, dict) else None) or node.get("detail") or "high"
+                images += IMAGE_TOKENS_LOW if level == "low" else IMAGE_TOKENS_HIGH
+                return
+            for key in ("content", "text", "input"):
+                if key in node:
+                    walk(node[key])
+
+    walk(kwargs.get("messages") or kwargs.get("input") or [])
+    output_cap = kwargs.get("max_tokens") or kwargs.get("max_output_tokens") or 1000
+    return chars // 4 + images + output_cap
+
+
+class TokenBucket:
+    """Continuously refilling bucket of ``per_minute`` units; thread-safe."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` (may go negative) and return how long the caller must wait before using it."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def adjust(self, delta: float):
+        """Correct an earlier estimate once the real usage is known (positive = refund)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + delta)
+
+    def block_for(self, seconds: float):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class ModelRateLimiter:
+    def __init__(self, limits: dict):
+        self.limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, model: str):
+        with self._lock:
+            if model not in self._buckets:
+                limit = self.limits.get(model) or self.limits.get(model.split("-20")[0]) or {}
+                rpm = TokenBucket(limit["rpm"]) if limit.get("rpm") else None
+                tpm = TokenBucket(limit["tpm"]) if limit.get("tpm") else None
+                self._buckets[model] = (rpm, tpm)
+            return self._buckets[model]
+
+    async def acquire(self, model: str, tokens: int):
+        rpm, tpm = self._buckets_for(model)
+        wait = max(
+            rpm.reserve(1) if rpm else 0.0,
+            tpm.reserve(tokens) if tpm else 0.0,
+        )
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, model: str, estimated: int, actual: Optional[int]):
+        _, tpm = self._buckets_for(model)
+        if tpm and actual is not None:
+            tpm.adjust(estimated - actual)
+
+    def back_off(self, model: str, seconds: float):
+        """Stop every caller of ``model`` for ``seconds`` (the API told us we're over quota)."""
+        for bucket in self._buckets_for(model):
+            if bucket:
+                bucket.block_for(seconds)
+
+
+class CircuitBreaker:
+    """
+    Opens after AI_BREAKER_THRESHOLD consecutive provider failures. While open,
+    callers wait instead of sending requests; after the cooldown a single probe
+    request is let through and its result closes or re-opens the circuit.
+    """
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, threshold: int = AI_BREAKER_THRESHOLD, cooldown: float = AI_BREAKER_COOLDOWN):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state != self.CLOSED
+
+    def _try_pass(self) -> Tuple[float, bool]:
+        """
+        (0, is_probe) if the caller may proceed, else (seconds to wait before
+        asking again, False).
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0, False
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.cooldown - now
+                if remaining > 0:
+                    return remaining, False
+                self.state = self.HALF_OPEN
+            if not self._probe_in_flight:
+                self._probe_in_flight = True
+                return 0.0, True
+            return 1.0, False
+
+    async def wait_until_closed(self) -> bool:
+        """Wait until a request may be sent; True if it is the half-open probe, which
+        the caller must settle with record_success / record_failure / release_probe."""
+        while True:
+            wait, probe = self._try_pass()
+            if wait <= 0:
+                return probe
+            await asyncio.sleep(min(wait, 5.0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("[AI] circuit closed — provider recovered")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._probe_in_flight = False
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                print(f"[AI] circuit opened after {self.failures} consecutive failures — pausing for {self.cooldown}s")
+
+    def release_probe(self):
+        """The probe ended without telling us anything about provider health (e.g. a 400)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None  # unparseable header: fall back to our own backoff
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return max(parsed.timestamp() - time.time(), 0.0)
+
+
+def _is_provider_failure(exc: Exception) -> bool:
+    """Errors that say the provider is unhealthy (count towards the breaker)."""
+    if isinstance(exc, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, RateLimitError):
+        return True
+    if isinstance(exc, APIStatusError) and exc.status_code in (408, 409):
+        return True
+    return _is_provider_failure(exc)
+
+
+def _usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    total = getattr(usage, "total_tokens", None)
+    if total is not None:
+        return total
+    return (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+
+
+class _Endpoint:
+    def __init__(self, owner: "ResilientAIClient", resolve, name: str):
+        self._owner = owner
+        self._resolve = resolve
+        self._name = name
+
+    async def create(self, **kwargs):
+        return await self._owner.call(self._resolve(), endpoint=self._name, **kwargs)
+
+
+class _Chat:
+    def __init__(self, owner):
+        self.completions = _Endpoint(owner, lambda: owner.client.chat.completions.create, "chat")
+
+
+class ResilientAIClient:
+    def __init__(self, client, limits: dict = None, max_retries: int = AI_MAX_RETRIES,
+                 usage: AIUsageRecorder = None):
+        self.client = client
+        self.usage = usage or ai_usage
+        # Backends that answer locally (cassette replay) skip the RPM/TPM buckets
+        self.rate_limited = getattr(client, "rate_limited", True)
+        self.max_retries = max_retries
+        self.limiter = ModelRateLimiter(limits or AI_MODEL_LIMITS)
+        self.breaker = CircuitBreaker()
+        self.chat = _Chat(self)
+        self.responses = _Endpoint(self, lambda: client.responses.create, "responses")
+
+    def __getattr__(self, name):
+        # Anything not wrapped (files, embeddings, ...) goes straight to the client
+        return getattr(self.client, name)
+
+    async def call(self, method, endpoint: str = "chat", **kwargs):
+        model = kwargs.get("model", "")
+        estimated = estimate_tokens(kwargs)
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            probe = await self.breaker.wait_until_closed()
+            try:
+                if self.rate_limited:
+                    await self.limiter.acquire(model, estimated)
+                async with ai_scheduler.slot():
+                    response = await method(**kwargs)
+            except Exception as e:
+                if _is_provider_failure(e):
+                    self.breaker.record_failure()
+                elif probe:
+                    self.breaker.release_probe()
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    self.usage.record_call(endpoint, kwargs, latency=time.monotonic() - started,
+                                           retries=attempt, error=e)
+                    raise
+                delay = _retry_after(e)
+                if delay is not None and isinstance(e, RateLimitError):
+                    self.limiter.back_off(model, delay)
+                if delay is None:
+                    delay = min(AI_RETRY_MAX_DELAY, AI_RETRY_BASE_DELAY * (2 ** attempt))
+                    delay = random.uniform(delay / 2, delay)
+                attempt += 1
+                print(f"[AI] {model} {type(e).__name__} — retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled mid-attempt: no verdict on the provider, but a probe left
+                # in flight would keep the circuit half-open and block every caller
+                if probe:
+                    self.breaker.release_probe()
+                raise
+
+            self.breaker.record_success()
+            if self.rate_limited:
+                self.limiter.settle(model, estimated, _usage_tokens(response))
+            self.usage.record_call(endpoint, kwargs, response, latency=time.monotonic() - started, retries=attempt)
+            return response
@@ -0,0 +1,168 @@
+"""
+Process-wide scheduler for outbound OpenAI requests.
+
+Every model call goes through ``ai_scheduler.slot()`` — ResilientAIClient takes
+one around each attempt, after its breaker and rate-limit waits. The scheduler keeps the
+number of in-flight requests under AI_MAX_CONCURRENCY and, once that ceiling is
+reached, decides who goes next:
+
+- Interactive work (single uploads, reanalysis, SOP uploads) is always served
+  before bulk batches.
+- Within a lane, organisations are served by weighted fair queuing, so one
+  tenant's 500-file batch gets its share but cannot starve everyone else.
+  Weights come from AI_ORG_WEIGHTS, e.g. {"<organisation_id>": 2}; default 1.
+
+The organisation and lane are taken from ``ai_request_context`` (a contextvar),
+which the job worker sets around each job — call sites don't pass them through.
+
+The scheduler is shared by every event loop in the process (the API loop, the
+worker loop and the asyncio.run loops used by SOP extraction threads), so its
+state is guarded by a threading lock and waiters are woken through their own
+loop with call_soon_threadsafe.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "24"))  # per API/worker process
+AI_ORG_WEIGHTS = json.loads(os.getenv("AI_ORG_WEIGHTS") or "{}")
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+_LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+_DEFAULT_ORG = "_default"
+
+_ai_request_context = contextvars.ContextVar("ai_request_context", default=None)
+
+
+@contextmanager
+def ai_request_context(organisation_id: Optional[str] = None, lane: str = LANE_INTERACTIVE,
+                       document_id=None, sop_id=None):
+    """Tag every AI call made inside this block with an organisation and lane
+    (and, for usage accounting, the document / SOP being processed)."""
+    token = _ai_request_context.set({
+        "organisation_id": str(organisation_id) if organisation_id else None,
+        "lane": lane if lane in _LANES else LANE_INTERACTIVE,
+        "document_id": document_id,
+        "sop_id": sop_id,
+    })
+    try:
+        yield
+    finally:
+        _ai_request_context.reset(token)
+
+
+def current_ai_context() -> dict:
+    return _ai_request_context.get() or {
+        "organisation_id": None, "lane": LANE_INTERACTIVE, "document_id": None, "sop_id": None,
+    }
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop, future):
+        self.loop = loop
+        self.future = future
+        self.granted = False
+
+
+class AIRequestScheduler:
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY, org_weights: dict = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.org_weights = {str(k): float(v) for k, v in (org_weights or {}).items()}
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._queues = {lane: [] for lane in _LANES}  # heap of (tag, seq, waiter)
+        self._org_finish = {}  # org -> virtual finish tag of its last queued request
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+    def _weight(self, org: str) -> float:
+        return max(self.org_weights.get(org, 1.0), 0.01)
+
+    def _has_waiters(self) -> bool:
+        return any(self._queues[lane] for lane in _LANES)
+
+    async def acquire(self, organisation_id: Optional[str] = None, lane: Optional[str] = None):
+        ctx = current_ai_context()
+        org = str(organisation_id or ctx["organisation_id"] or _DEFAULT_ORG)
+        lane = lane or ctx["lane"]
+
+        with self._lock:
+            if self._in_use < self.max_concurrency and not self._has_waiters():
+                self._in_use += 1
+                return
+
+            loop = asyncio.get_running_loop()
+            waiter = _Waiter(loop, loop.create_future())
+            tag = max(self._vtime, self._org_finish.get(org, 0.0)) + 1.0 / self._weight(org)
+            self._org_finish[org] = tag
+            entry = (tag, next(self._seq), waiter)
+            heapq.heappush(self._queues[lane], entry)
+
+        try:
+            await waiter.future
+        except BaseException:
+            with self._lock:
+                if waiter.granted:
+                    # Slot was handed to us while we were being cancelled — pass it on
+                    self._release_locked()
+                else:
+                    queue = self._queues[lane]
+                    queue.remove(entry)
+                    heapq.heapify(queue)
+            raise
+
+    def release(self):
+        with self._lock:
+            self._release_locked()
+
+    def _release_locked(self):
+        for lane in _LANES:
+            queue = self._queues[lane]
+            while queue:
+                tag, _, waiter = heapq.heappop(queue)
+                self._vtime = max(self._vtime, tag)
+                try:
+                    waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+                except RuntimeError:
+                    continue  # waiter's loop is already closed
+                waiter.granted = True
+                return  # slot handed over; _in_use unchanged
+        self._in_use -= 1
+        if self._in_use == 0:
+            # Idle — forget accumulated virtual time so it can't grow without bound
+            self._vtime = 0.0
+            self._org_finish.clear()
+
+    @asynccontextmanager
+    async def slot(self, organisation_id: Optional[str] = None, lane: Optional[str] = None):
+        await self.acquire(organisation_id, lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_use,
+                "waiting": {lane: len(self._queues[lane]) for lane in _LANES},
+            }
+
+
+ai_scheduler = AIRequestScheduler()
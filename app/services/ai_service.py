@@ -1,48 +1,133 @@
 from collections import Counter
-import os
-import io
 import json
-import base64
 import asyncio
-from sqlalchemy.orm import Session
+import time
 from typing import List, Dict, Any
-from openai import AsyncOpenAI
-from pdf2image import convert_from_bytes
-from PIL import Image
 
+from app.core.database import session_scope
 from app.models.unverified_document import UnverifiedDocument
+from app.services.ai_scheduler import current_ai_context
+from app.services.analysis_cancellation import cancel_and_wait
+from app.services.ai_cache_service import ai_cache, prompt_hash, KIND_CLASSIFY, KIND_EXTRACT
+from app.services.ai_client import openai_client
+from app.services.classification_batcher import classification_batcher
+from app.services.rasterizer import DocumentPages
+from app.services.text_layer import TEXT_LAYER_ROUTING, TextLayer
+from app.services.ocr_classifier import KeywordSignatures, header_of_text, ocr_classifier
+from app.services.field_regions import AI_FIELD_REGIONS, crop_region, region_page
+from app.services.processing_trace import trace_add, trace_span
+from app.services.layout_index_service import layout_index_service
+from app.services.model_cascade_service import (
+    LEGACY_CASCADE, REASON_EMPTY, REASON_INVALID_CODES, REASON_LOW_CONFIDENCE, REASON_MISSING_REQUIRED,
+    STAGE_AUTO_EXTRACT, STAGE_CLASSIFY, STAGE_EXTRACT, STAGES,
+    model_cascade_service, routing_record, summarize_routing,
+)
+from app.services.schema_compiler import (
+    AUTO_EXTRACT_SCHEMA, CLASSIFY_BATCH_SCHEMA, CLASSIFY_PAGE_SCHEMA,
+    extraction_schema, field_name, from_auto_extract, is_list_field, response_format,
+)
+from app.services.image_preprocess import (
+    FULL_FRAME, IMAGE_PROFILES, PROFILE_CLASSIFY, PROFILE_EXTRACT, analysis_profiles, profile_name
+)
+
+BLANK_PAGE = "BLANK_PAGE"
+
+
+class InstanceAssembler:
+    """
+    Incremental version of AIService.build_document_instances.
+
+    Classified pages may arrive in any order. Pages are consumed strictly in
+    page order, and an instance is released as soon as the next page with
+    header_restart=True closes it — so extraction for pages 1-2 can start while
+    page 300 is still being classified.
+
+    Blank pages are continuations: they join the instance before them, and
+    blank pages before the first real page belong to no instance at all.
+    header_restart=None means undecided (a degraded header-keyword guess): the
+    page continues the instance before it if the type matches, else starts one.
+    """
+
+    def __init__(self, total_pages: int = None):
+        self.total_pages = total_pages
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._next_page = 1
+        self._current = None
+
+    def _emit(self, instance: dict) -> Dict[str, str]:
+        return {"type": instance["type"], "page_range": f"{instance['start']}-{instance['end']}"}
+
+    def add(self, page: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Feed one classified page; returns the instances it closed (possibly none)."""
+        self._pending[page["page"]] = page
+        return self._drain()
+
+    def _drain(self) -> List[Dict[str, str]]:
+        closed = []
+        while self._next_page in self._pending:
+            page = self._pending.pop(self._next_page)
+            self._next_page += 1
+
+            if self._current is None:
+                if page.get("signals", {}).get("blank"):
+                    continue
+                self._current = {"type": page["type"], "start": page["page"], "end": page["page"]}
+                continue
+
+            header_restart = page.get("signals", {}).get("header_restart", True)
+            if header_restart is None:
+                header_restart = page["type"] != self._current["type"]
+            is_continuation = not header_restart
+
+            if is_continuation:
+                # Always merge with previous — ignore type name differences.
+                # The page type stays as the FIRST page's type (authoritative).
+                self._current["end"] = page["page"]
+            else:
+                # New patient header or new form → start a new instance
+                closed.append(self._emit(self._current))
+                self._current = {"type": page["type"], "start": page["page"], "end": page["page"]}
+        return closed
+
+    def finish(self) -> List[Dict[str, str]]:
+        """No more pages: pad any gaps with UNKNOWN and release the remaining instances."""
+        closed = []
+        if self.total_pages:
+            missing = [
+                pg for pg in range(self._next_page, self.total_pages + 1)
+                if pg not in self._pending
+            ]
+            if missing:
+                print(f"[ai_service] WARNING: missing pages {missing} — padding UNKNOWN")
+            for pg in missing:
+                self._pending[pg] = {"page": pg, "type": "UNKNOWN", "signals": {"header_restart": True}}
+            closed = self._drain()
+        if self._current:
+            closed.append(self._emit(self._current))
+            self._current = None
+        return closed
 
 
 class AIService:
-    def __init__(self):
-        self.client = AsyncOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
+    def __init__(self, client=None):
+        # Shared client: rate limits, retries and the circuit breaker are process-wide
+        self.client = client or openai_client
 
     # ------------------------------------------------------------------
     # Utilities
     # ------------------------------------------------------------------
-    def _encode_image(self, image: Image.Image) -> str:
-        buf = io.BytesIO()
-        if image.mode in ("RGBA", "LA", "P"):
-            image = image.convert("RGB")
-        image.save(buf, format="JPEG", quality=85)
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
-
-    async def _convert_to_images(self, file_content: bytes, filename: str) -> List[str]:
-        if filename.lower().endswith(".pdf"):
-            loop = asyncio.get_event_loop()
-            pages = await loop.run_in_executor(
-                None,
-                lambda: convert_from_bytes(file_content, dpi=200)
-            )
-            encoded = await loop.run_in_executor(
-                None,
-                lambda: [self._encode_image(p) for p in pages]
-            )
-            return encoded
-        image = Image.open(io.BytesIO(file_content))
-        return [self._encode_image(image)]
+    async def _open_pages(self, file_content: bytes, filename: str, file_path: str = None,
+                          profiles: Dict[str, dict] = None) -> DocumentPages:
+        # Pages are rendered lazily in small batches — never the whole PDF at once
+        if file_path:
+            return await DocumentPages.open(file_path, filename, dpi=200, profiles=profiles)
+        return await DocumentPages.from_bytes(file_content, filename, dpi=200, profiles=profiles)
+
+    @staticmethod
+    def _content_pages(pages: DocumentPages, start: int, end: int) -> List[int]:
+        """Page numbers in start..end that are not blank (all of them if every page is)."""
+        numbers = list(range(start, end + 1))
+        return [p for p in numbers if not pages.is_blank(p)] or numbers
 
     def _safe_parse_json(self, raw: str) -> dict:
         raw = raw.strip()
@@ -65,6 +150,17 @@ class AIService:
                 pass
         raise ValueError(f"Cannot parse JSON:\n{raw[:400]}")
 
+    def _parse_reply(self, response) -> dict:
+        """
+        JSON body of a chat completion. Schema-constrained replies parse directly;
+        _safe_parse_json's repairs only matter for templates in plain JSON mode.
+        """
+        message = response.choices[0].message
+        refusal = getattr(message, "refusal", None)
+        if refusal:
+            raise ValueError(f"Model refused: {refusal}")
+        return self._safe_parse_json(message.content or "")
+
     def build_document_instances(self, pages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
         """
         Group consecutive pages into document instances.
@@ -77,58 +173,25 @@ class AIService:
 
         A new instance starts ONLY when:
           - header_restart=True (new patient header / new form start detected), OR
-          - header_restart=True (default) and type changed
+          - header_restart=None (undecided) and type changed
         """
+        assembler = InstanceAssembler()
         documents = []
-        current = None
-
         for page in pages:
-            if current is None:
-                current = {
-                    "type": page["type"],
-                    "start": page["page"],
-                    "end": page["page"],
-                }
-                continue
-
-            is_continuation = not page.get("signals", {}).get("header_restart", True)
-
-            if is_continuation:
-                # Always merge with previous — ignore type name differences.
-                # The page type stays as the FIRST page's type (authoritative).
-                current["end"] = page["page"]
-            else:
-                # New patient header or new form → start a new instance
-                documents.append(current)
-                current = {
-                    "type": page["type"],
-                    "start": page["page"],
-                    "end": page["page"],
-                }
-
-        if current:
-            documents.append(current)
-
-        return [
-            {"type": d["type"], "page_range": f"{d['start']}-{d['end']}"}
-            for d in documents
-        ]
+            documents.extend(assembler.add(page))
+        documents.extend(assembler.finish())
+        return documents
 
     # ------------------------------------------------------------------
     # Phase 1 — Classify all pages in parallel (fully dynamic)
     # ------------------------------------------------------------------
 
-    async def _classify_all_pages(
-        self,
-        images: List[str],
-        document_types: List[Dict[str, str]],  # [{name, description}, ...]
-        max_concurrent: int = 15,
-    ) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _classification_prompts(document_types: List[Dict[str, str]]) -> Dict[str, Any]:
         """
-        Classify each page against the org's document types.
-        All type names and descriptions come from the DB — nothing hardcoded here.
+        Classifier prompts for a set of document types. Pure function of
+        ``document_types`` — memoized per schema_registry snapshot by callers.
         """
-
         # Build type listing from DB data only
         type_lines = []
         for dt in document_types:
@@ -150,9 +213,7 @@ class AIService:
             "Respond with valid JSON only. No markdown, no explanation."
         )
 
-        user_prompt_template = f"""Classify this medical document page image.
-
-AVAILABLE DOCUMENT TYPES:
+        classification_rules = f"""AVAILABLE DOCUMENT TYPES:
 {document_type_block}
 
 CLASSIFICATION RULES:
@@ -187,87 +248,337 @@ ALWAYS false (continuation) for these page types:
 
 ALWAYS true (new instance) for:
   • A page with a patient name handwritten at the top (even if same doc type as previous)
-  • First page of any form that has the practice letterhead and patient info fields
+  • First page of any form that has the practice letterhead and patient info fields"""
 
-Return ONLY this JSON:
-{{
-  "type": "<one of: {type_list_str}>",
+        result_fields = f"""  "type": "<one of: {type_list_str}>",
   "confidence": "<HIGH | MEDIUM | LOW>",
   "key_signal": "<the most distinctive visual element that determined your choice>",
-  "header_restart": <true or false>
+  "header_restart": <true or false>"""
+
+        user_prompt_template = f"""Classify this medical document page image.
+
+{classification_rules}
+
+Return ONLY this JSON:
+{{
+{result_fields}
 }}"""
 
-        sem = asyncio.Semaphore(max_concurrent)
+        # Several pages in one request (classification_batcher) — the type listing
+        # and rules are sent once instead of once per page
+        batch_prompt_template = f"""Classify each of the medical document page images below.
+Each image is preceded by its label "Page <index>". The pages may come from different
+documents: judge every page, including header_restart, from that page's own content only.
 
-        async def classify_one(img: str, page_no: int) -> dict:
-            async with sem:
+{classification_rules}
+
+Return ONLY this JSON, with exactly one entry per page image:
+{{
+  "pages": [
+    {{
+      "index": <the page label number>,
+{result_fields}
+    }}
+  ]
+}}"""
+
+        # Born-digital pages are classified from their text layer (see text_layer)
+        text_prompt_template = f"""Classify this medical document page from its embedded text, given below in
+reading order (the first lines are the top of the page).
+
+{classification_rules}
+
+Return ONLY this JSON:
+{{
+{result_fields}
+}}"""
+
+        return {
+            "valid_names": valid_names,
+            "system_prompt": system_prompt,
+            "user_prompt_template": user_prompt_template,
+            "batch_prompt_template": batch_prompt_template,
+            "text_prompt_template": text_prompt_template,
+        }
+
+    async def _classify_all_pages(
+        self,
+        pages: DocumentPages,
+        document_types: List[Dict[str, str]],  # [{name, description}, ...]
+        on_page=None,
+        layout_index=None,
+        cascade: Dict[str, Any] = None,
+        routing: List[dict] = None,
+        prompts: Dict[str, Any] = None,
+        text_layer: TextLayer = None,
+        ocr: KeywordSignatures = None,
+        headers: Dict[int, str] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Classify each page against the org's document types.
+        All type names and descriptions come from the DB — nothing hardcoded here.
+        ``on_page`` (if given) receives each page result as soon as it is classified.
+        Pages that match a staff-confirmed layout in ``layout_index`` skip the model.
+        LOW-confidence answers escalate along ``cascade`` (see model_cascade_service);
+        every model call is appended to ``routing``. ``prompts`` is a prebuilt
+        ``_classification_prompts(document_types)``. Pages with a trusted
+        ``text_layer`` are classified from their text instead of their image.
+        With ``ocr`` signatures, pages whose header keywords are conclusive are
+        settled locally (see ocr_classifier); header texts are collected in ``headers``.
+        """
+        cascade = cascade or LEGACY_CASCADE
+        classify_models = cascade["models"][STAGE_CLASSIFY]
+
+        prompts = prompts or self._classification_prompts(document_types)
+        valid_names = prompts["valid_names"]
+        system_prompt = prompts["system_prompt"]
+        user_prompt_template = prompts["user_prompt_template"]
+        batch_prompt_template = prompts["batch_prompt_template"]
+        text_prompt_template = prompts["text_prompt_template"]
+
+        image_profile = IMAGE_PROFILES[PROFILE_CLASSIFY]
+        page_format = response_format("page_classification", CLASSIFY_PAGE_SCHEMA)
+        batch_format = response_format("page_classification_batch", CLASSIFY_BATCH_SCHEMA)
+
+        # Identical pages (same form, re-uploads) are answered from ai_cache under this version
+        def classify_version(model: str) -> str:
+            return prompt_hash(model, system_prompt, user_prompt_template, image_profile, page_format)
+
+        async def request_classification(img: str, model: str = None) -> dict:
+            # Concurrency is bounded process-wide by ai_scheduler (inside the client), not per document
+            response = await self.client.chat.completions.create(
+                model=model or classify_models[0],
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": [
+                        {"type": "text", "text": user_prompt_template},
+                        {"type": "image_url", "image_url": {
+                            "url": f"data:image/jpeg;base64,{img}",
+                            "detail": image_profile["detail"]
+                        }}
+                    ]}
+                ],
+                max_tokens=200,
+                response_format=page_format,
+                temperature=0,
+            )
+            return self._parse_reply(response)
+
+        def classify_text_version(model: str) -> str:
+            return prompt_hash(model, system_prompt, text_prompt_template, page_format)
+
+        async def request_text_classification(page_text: str, model: str = None) -> dict:
+            response = await self.client.chat.completions.create(
+                model=model or classify_models[0],
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"{text_prompt_template}\n\nPAGE TEXT:\n{page_text}"}
+                ],
+                max_tokens=200,
+                response_format=page_format,
+                temperature=0,
+            )
+            return self._parse_reply(response)
+
+        async def request_classification_batch(imgs: List[str]) -> List[Dict[str, Any]]:
+            content = [{"type": "text", "text": batch_prompt_template}]
+            for index, img in enumerate(imgs, 1):
+                content.append({"type": "text", "text": f"Page {index}:"})
+                content.append({"type": "image_url", "image_url": {
+                    "url": f"data:image/jpeg;base64,{img}",
+                    "detail": image_profile["detail"]
+                }})
+            response = await self.client.chat.completions.create(
+                model=classify_models[0],
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": content}
+                ],
+                max_tokens=60 + 140 * len(imgs),
+                response_format=batch_format,
+                temperature=0,
+            )
+            raw = self._parse_reply(response)
+            by_index = {}
+            for entry in raw.get("pages") or []:
                 try:
-                    response = await self.client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": [
-                                {"type": "text", "text": user_prompt_template},
-                                {"type": "image_url", "image_url": {
-                                    "url": f"data:image/jpeg;base64,{img}",
-                                    "detail": "high"
-                                }}
-                            ]}
-                        ],
-                        max_tokens=200,
-                        response_format={"type": "json_object"},
-                        temperature=0,
-                    )
-                    raw = self._safe_parse_json(response.choices[0].message.content)
-                    doc_type      = raw.get("type", "UNKNOWN").strip().upper()
-                    confidence    = raw.get("confidence", "MEDIUM")
-                    key_signal    = raw.get("key_signal", "")
-                    header_restart = raw.get("header_restart", True)
-
-                    # Allow invented type names — AI may return a name not in DB
-                    # for pages that don't match any configured document type.
-                    # These will be saved as UnverifiedDocument for staff review.
-                    # Sanitize: uppercase, replace spaces with underscores
-                    if doc_type not in valid_names:
-                        doc_type = doc_type.upper().replace(" ", "_").replace("-", "_")
-                        # Strip any non-alphanumeric/underscore chars
-                        import re as _re
-                        doc_type = _re.sub(r"[^A-Z0-9_]", "", doc_type) or "UNCLASSIFIED"
+                    index = int(entry.get("index"))
+                except (AttributeError, TypeError, ValueError):
+                    continue
+                if entry.get("type") and index not in by_index:
+                    by_index[index] = entry
+            # Pages the model skipped or garbled come back as None and are retried alone
+            return [by_index.get(index) for index in range(1, len(imgs) + 1)]
+
+        batch_key = (current_ai_context()["organisation_id"], classify_version(classify_models[0]))
 
+        async def classify_page_image(img: str) -> dict:
+            return await classification_batcher.classify(
+                batch_key, img, request_classification, request_classification_batch
+            )
+
+        async def classify_one(img: str, page_no: int) -> dict:
+            if pages.is_blank(page_no):
+                # Blank back / separator sheet — never worth a model call
+                print(f"[ai_service] page {page_no}: blank — continuation")
+                return {
+                    "page": page_no,
+                    "type": BLANK_PAGE,
+                    "signals": {"header_restart": False, "blank": True, "source": "blank"}
+                }
+            try:
+                known = None
+                layout = pages.layout(page_no)
+                if layout_index and layout is not None and len(layout_index):
+                    # A mat-vec over every confirmed page of the org: keep it off the loop
+                    known = await asyncio.to_thread(layout_index.match, layout, valid_names)
+                if known:
                     print(
-                        f"[ai_service] page {page_no}: {doc_type} "
-                        f"restart={header_restart} ({confidence}) — {key_signal[:60]}"
+                        f"[ai_service] page {page_no}: {known['type']} "
+                        f"restart={known['header_restart']} (layout d={known['distance']:.3f}, n={known['support']})"
                     )
                     return {
                         "page": page_no,
-                        "type": doc_type,
+                        "type": known["type"],
                         "signals": {
-                            "confidence": confidence,
-                            "key_signal": key_signal,
-                            "header_restart": bool(header_restart),
+                            "confidence": "HIGH",
+                            "key_signal": f"matches {known['support']} confirmed page(s) of this layout",
+                            "header_restart": known["header_restart"],
+                            "source": "layout",
                         }
                     }
-                except Exception as e:
-                    print(f"[ai_service] page {page_no} classify error → UNCLASSIFIED: {e}")
+
+                page_text = await text_layer.page_text(page_no) if text_layer else None
+
+                # Header keywords settle clear pages locally — and, while the
+                # provider's circuit is open, stand in for the model entirely
+                guess = None
+                if ocr is not None:
+                    try:
+                        header = header_of_text(page_text) if page_text is not None \
+                            else await ocr_classifier.header_text(img)
+                        if headers is not None:
+                            headers[page_no] = header
+                        guess = ocr.match(header)
+                    except Exception as e:
+                        print(f"[ai_service] page {page_no}: header OCR failed: {e}")
+                degraded = bool(guess and guess["type"] and not guess["settled"] and self.client.breaker.is_open)
+                if guess and (guess["settled"] or degraded):
+                    header_restart = guess["header_restart"]
+                    print(
+                        f"[ai_service] page {page_no}: {guess['type']} restart={header_restart} "
+                        f"(header keywords{', degraded' if degraded else ''}: score {guess['score']} "
+                        f"vs {guess['runner_up']})"
+                    )
                     return {
                         "page": page_no,
-                        "type": "UNCLASSIFIED",
-                        "signals": {"header_restart": True}
+                        "type": guess["type"],
+                        "signals": {
+                            "confidence": "LOW" if degraded else "HIGH",
+                            "key_signal": f"header keywords: {', '.join(guess['hits'])}",
+                            # None only when degraded: the assembler decides by type
+                            "header_restart": header_restart,
+                            "source": "ocr_degraded" if degraded else "ocr",
+                        }
                     }
 
-        results = await asyncio.gather(
-            *[classify_one(images[i], i + 1) for i in range(len(images))],
-            return_exceptions=True,
-        )
+                if page_text is not None:
+                    page_input, page_hash, version = "text", prompt_hash(page_text), classify_text_version
+                    first_request = lambda: request_text_classification(page_text)
+                    request = lambda model: request_text_classification(page_text, model)
+                else:
+                    page_input, page_hash, version = "image", pages.fingerprint(page_no), classify_version
+                    first_request = lambda: classify_page_image(img)  # batched with other pages
+                    request = lambda model: request_classification(img, model)
+
+                # Cheapest model first; LOW confidence climbs the cascade one model at a time
+                for step, model in enumerate(classify_models):
+                    raw, cached = await ai_cache.get_or_compute(
+                        KIND_CLASSIFY, page_hash, version(model),
+                        first_request if step == 0 else (lambda model=model: request(model)),
+                        cacheable=lambda r: bool(r.get("type")),
+                    )
+                    reasons = [REASON_LOW_CONFIDENCE] if (
+                        REASON_LOW_CONFIDENCE in cascade["escalate_on"]
+                        and str(raw.get("confidence", "")).strip().upper() == "LOW"
+                    ) else []
+                    escalate_to = classify_models[step + 1] if reasons and step + 1 < len(classify_models) else None
+                    if routing is not None:
+                        routing.append(routing_record(STAGE_CLASSIFY, model, cached, reasons, escalate_to))
+                    if not escalate_to:
+                        break
+                    print(f"[ai_service] page {page_no}: LOW confidence on {model} → {escalate_to}")
+
+                doc_type      = raw.get("type", "UNKNOWN").strip().upper()
+                confidence    = raw.get("confidence", "MEDIUM")
+                key_signal    = raw.get("key_signal", "")
+                header_restart = raw.get("header_restart", True)
+
+                # Allow invented type names — AI may return a name not in DB
+                # for pages that don't match any configured document type.
+                # These will be saved as UnverifiedDocument for staff review.
+                # Sanitize: uppercase, replace spaces with underscores
+                if doc_type not in valid_names:
+                    doc_type = doc_type.upper().replace(" ", "_").replace("-", "_")
+                    # Strip any non-alphanumeric/underscore chars
+                    import re as _re
+                    doc_type = _re.sub(r"[^A-Z0-9_]", "", doc_type) or "UNCLASSIFIED"
+
+                print(
+                    f"[ai_service] page {page_no}: {doc_type} "
+                    f"restart={header_restart} ({confidence}){' [cached]' if cached else ''} — {key_signal[:60]}"
+                )
+                return {
+                    "page": page_no,
+                    "type": doc_type,
+                    "signals": {
+                        "confidence": confidence,
+                        "key_signal": key_signal,
+                        "header_restart": bool(header_restart),
+                        "source": "cache" if cached else "model",
+                        "model": model,
+                        "input": page_input,
+                    }
+                }
+            except Exception as e:
+                print(f"[ai_service] page {page_no} classify error → UNCLASSIFIED: {e}")
+                return {
+                    "page": page_no,
+                    "type": "UNCLASSIFIED",
+                    "signals": {"header_restart": True, "source": "error"}
+                }
+
+        # Pages stream in from the rasterizer; at most one window of them is alive at a time
+        window = pages.hold()
 
-        pages = []
+        async def classify_windowed(img: str, page_no: int) -> dict:
+            try:
+                result = await classify_one(img, page_no)
+            finally:
+                window.release()
+            if on_page:
+                on_page(result)
+            return result
+
+        tasks = []
+        try:
+            async for page_no, img in pages:
+                await window.acquire()
+                tasks.append(asyncio.create_task(classify_windowed(img, page_no)))
+
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            # Cancelled mid-document: stop the pages still being classified before returning
+            await cancel_and_wait(tasks)
+
+        classified = []
         for i, r in enumerate(results):
             if isinstance(r, Exception):
                 print(f"[ai_service] page {i+1} gather error → UNCLASSIFIED: {r}")
-                pages.append({"page": i + 1, "type": "UNCLASSIFIED", "signals": {"header_restart": True}})
+                classified.append({"page": i + 1, "type": "UNCLASSIFIED", "signals": {"header_restart": True}})
             else:
-                pages.append(r)
-        return pages
+                classified.append(r)
+        return classified
 
     # ------------------------------------------------------------------
     # Phase 2 — Extract fields from a document instance (fully dynamic)
@@ -379,6 +690,39 @@ Return ONLY this JSON:
             print(f"[ai_service] removed sequential run: {removed}")
         return result
 
+    def _code_validator(self, field_name: str):
+        """The code format validator for a field, or None for non-code fields."""
+        fn = field_name.lower()
+        if any(kw in fn for kw in ("cpt", "procedure", "billing", "service", "hcpcs")):
+            return self._is_valid_cpt
+        if any(kw in fn for kw in ("icd", "diagnos", "condition", " dx")):
+            return self._is_valid_icd
+        return None
+
+    def _extraction_escalation_reasons(self, result: dict, fields_list: List[Dict], confidence: str,
+                                       check_required: bool = True, optional_fields=()) -> List[str]:
+        """Why a cheaper model's extraction should be re-run on a stronger one (empty = accept)."""
+        reasons = []
+        if confidence == "LOW":
+            reasons.append(REASON_LOW_CONFIDENCE)
+        invalid, missing = False, False
+        for f in fields_list:
+            fn = f.get("fieldName") or f.get("name") or ""
+            if not fn:
+                continue
+            val = result.get(fn)
+            validator = self._code_validator(fn)
+            if validator and val is not None:
+                codes = self._deduplicate_codes(val if isinstance(val, (list, str)) else str(val)) or []
+                invalid = invalid or any(not validator(c) for c in codes)
+            if check_required and f.get("required") and fn not in optional_fields and val in (None, "", []):
+                missing = True
+        if invalid:
+            reasons.append(REASON_INVALID_CODES)
+        if missing:
+            reasons.append(REASON_MISSING_REQUIRED)
+        return reasons
+
     def _filter_codes_by_type(self, codes: list, field_name: str) -> list:
         """
         Filter a list of codes to only include values matching the expected
@@ -387,18 +731,15 @@ Return ONLY this JSON:
         """
         if not codes:
             return codes
-        fn = field_name.lower()
-        is_cpt = any(kw in fn for kw in ("cpt", "procedure", "billing", "service", "hcpcs"))
-        is_icd = any(kw in fn for kw in ("icd", "diagnos", "condition", " dx"))
-
-        if is_cpt:
-            filtered = [c for c in codes if self._is_valid_cpt(c)]
-        elif is_icd:
-            filtered = [c for c in codes if self._is_valid_icd(c)]
-            # Remove sequential hallucinations (e.g. M25.561, M25.562, M25.569...)
-            filtered = self._remove_sequential_runs(filtered, max_per_prefix=2)
-        else:
+        validator = self._code_validator(field_name)
+
+        if validator is None:
             filtered = codes
+        else:
+            filtered = [c for c in codes if validator(c)]
+            if validator == self._is_valid_icd:
+                # Remove sequential hallucinations (e.g. M25.561, M25.562, M25.569...)
+                filtered = self._remove_sequential_runs(filtered, max_per_prefix=2)
 
         removed_format = [c for c in codes if c not in filtered]
         if removed_format:
@@ -432,8 +773,26 @@ Return ONLY this JSON:
         doc_type: str,
         type_context: str,
         page_role: str = "",
+        page_hash: str = None,
+        image_profile: Dict[str, Any] = None,
+        cascade: Dict[str, Any] = None,
+        routing: List[dict] = None,
+        check_required: bool = True,
+        page_text: str = None,
+        optional_fields=(),
     ) -> Dict[str, Any]:
-        """Extract the given fields from one page image."""
+        """
+        Extract the given fields from one page image.
+        ``page_hash`` (the rasterizer fingerprint) lets a repeated page be answered from ai_cache.
+        ``image_profile`` is the image_preprocess profile ``page_img`` was rendered with.
+        The page runs on the cheapest model of ``cascade`` and escalates while the answer
+        has LOW confidence, invalid codes or (with ``check_required``) missing required
+        fields other than ``optional_fields``; every call is appended to ``routing``.
+        With ``page_text`` (a trusted text layer, see text_layer) the page is read from
+        its text instead and ``page_img`` is not used.
+        """
+        image_profile = image_profile or IMAGE_PROFILES[PROFILE_EXTRACT]
+        cascade = cascade or LEGACY_CASCADE
         if not fields_list:
             return {}
 
@@ -452,8 +811,9 @@ Return ONLY this JSON:
 
         fields_block = "\n".join(field_lines)
         empty_json = json.dumps(
-            {(f.get("fieldName") or f.get("name", "")): None
-             for f in fields_list if f.get("fieldName") or f.get("name")},
+            {**{(f.get("fieldName") or f.get("name", "")): None
+                for f in fields_list if f.get("fieldName") or f.get("name")},
+             "_confidence": None},
             indent=2
         )
         role_hint = f" This is the {page_role}." if page_role else ""
@@ -497,34 +857,112 @@ IMPORTANT:
 - Maximum {{}}: 5 for CPT/procedure fields, 8 for ICD/diagnosis fields, 8 for others
 - Each code appears at most once
 - For text fields (name, date of birth): extract the handwritten value exactly
+- Set "_confidence" to HIGH, MEDIUM or LOW — LOW when marks are faint, ambiguous or hard to read
+
+Return ONLY:
+{empty_json}"""
+
+        if page_text is not None:
+            # Born-digital page: values are typed text, there are no pen marks to find
+            system_prompt = (
+                "You extract field values from the text layer of an electronically "
+                "generated medical document page. Return valid JSON only. No markdown."
+            )
+            user_prompt = f"""Below is the text of one page of a {doc_type} document, in reading order.{role_hint}
+{context_line}
+
+FIELDS TO FILL:
+{fields_block}
+
+RULES:
+- Use only values that appear in the text — never guess or infer
+- A checked box appears as ☑, ☒, [X] or X next to an item; ☐ or [ ] is unchecked — include only checked items
+- Codes (CPT, ICD) exactly as printed; each code at most once
+- null for any field that is not on this page
+- Set "_confidence" to HIGH, MEDIUM or LOW — LOW when the text is garbled or the fields are ambiguous
 
 Return ONLY:
 {empty_json}"""
+            page_content = [{"type": "text", "text": f"{user_prompt}\n\nPAGE TEXT:\n{page_text}"}]
+            page_hash = prompt_hash(page_text)
+            image_profile = None
+        else:
+            page_content = [
+                {"type": "text", "text": user_prompt},
+                {"type": "image_url", "image_url": {
+                    "url": f"data:image/jpeg;base64,{page_img}",
+                    "detail": image_profile["detail"]
+                }}
+            ]
+
+        reply_format = response_format("field_extraction", extraction_schema(fields_list))
+
+        async def request_extraction(model: str) -> dict:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": page_content}
+                ],
+                max_tokens=max(400, 60 * len(field_lines)),
+                response_format=reply_format,
+                temperature=0,
+            )
+            return self._parse_reply(response)
 
-        response = await self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": [
-                    {"type": "text", "text": user_prompt},
-                    {"type": "image_url", "image_url": {
-                        "url": f"data:image/jpeg;base64,{page_img}",
-                        "detail": "high"
-                    }}
-                ]}
-            ],
-            max_tokens=400,
-            response_format={"type": "json_object"},
-            temperature=0,
+        models = cascade["models"][STAGE_EXTRACT]
+        for step, model in enumerate(models):
+            extract_version = prompt_hash(model, system_prompt, user_prompt, image_profile, reply_format)
+            result, cached = await ai_cache.get_or_compute(
+                KIND_EXTRACT, page_hash, extract_version, lambda model=model: request_extraction(model)
+            )
+            result = dict(result)
+            confidence = str(result.pop("_confidence", "") or "").strip().upper()
+            reasons = [
+                r for r in self._extraction_escalation_reasons(
+                    result, fields_list, confidence, check_required, optional_fields
+                )
+                if r in cascade["escalate_on"]
+            ]
+            escalate_to = models[step + 1] if reasons and step + 1 < len(models) else None
+            if routing is not None:
+                routing.append(routing_record(STAGE_EXTRACT, model, cached, reasons, escalate_to, page_role))
+            if not escalate_to:
+                return result
+            print(f"[ai_service] {doc_type} {page_role or 'page'}: {', '.join(reasons)} on {model} → {escalate_to}")
+
+    async def _extract_region(
+        self,
+        page_img: str,
+        region: Dict[str, Any],
+        fields_list: List[Dict],
+        doc_type: str,
+        type_context: str,
+        page_hash: str = None,
+        frame: tuple = None,
+        **extract_kwargs,
+    ) -> Dict[str, Any]:
+        """
+        Extract a template region's fields from a crop of its box (see field_regions).
+        ``frame`` is the part of the page ``page_img`` shows (DocumentPages.frame).
+        """
+        quality = int((extract_kwargs.get("image_profile") or IMAGE_PROFILES[PROFILE_EXTRACT]).get("quality", 85))
+        crop = await asyncio.to_thread(crop_region, page_img, region["box"], quality, frame=frame or FULL_FRAME)
+        return await self._extract_page(
+            crop, fields_list, doc_type, type_context, f"{region['name']} region",
+            page_hash=prompt_hash(page_hash, region["box"]) if page_hash else None,
+            **extract_kwargs
         )
-        return self._safe_parse_json(response.choices[0].message.content)
 
     async def _extract_fields(
         self,
         doc_type: str,
         page_range: str,
-        images: List[str],
+        pages: DocumentPages,
         schema: Dict[str, Any],
+        cascade: Dict[str, Any] = None,
+        routing: List[dict] = None,
+        text_layer: TextLayer = None,
     ) -> Dict[str, Any]:
         """
         Extract fields with smart field-to-page routing.
@@ -536,9 +974,22 @@ Return ONLY:
         - Unknown fields      → all pages, first non-null wins
 
         This prevents J-codes appearing in ICD fields and ICD codes in CPT fields.
+        All fields bound for the same page go out in one request (one image upload).
+        Fields inside one of the template's ``regions`` are read from a crop of
+        that region instead (see field_regions).
+        Pages with a trusted ``text_layer`` are read from their text, not their image.
         """
         start, end = map(int, page_range.split("-"))
-        selected_images = images[start - 1: end]
+        # Blank pages inside an instance carry nothing and must not take the
+        # first/last page role (e.g. a blank back after the ICD list)
+        page_numbers = self._content_pages(pages, start, end)
+        image_profile = profile_name(doc_type)
+        page_texts = [await text_layer.page_text(p) if text_layer else None for p in page_numbers]
+        selected_images = [
+            await pages.get(p, image_profile) if text is None else None
+            for p, text in zip(page_numbers, page_texts)
+        ]
+        page_hashes = [pages.fingerprint(p) for p in page_numbers]
         fields_list = schema.get("fields", [])
         type_context = (schema.get("description") or "").strip()
 
@@ -547,14 +998,29 @@ Return ONLY:
 
         num_pages = len(selected_images)
 
-        if num_pages == 1:
+        extract_kwargs = {"image_profile": IMAGE_PROFILES[image_profile], "cascade": cascade, "routing": routing}
+
+        # Fields with a known place on the page are read from a crop of it
+        region_plan, in_region = [], set()
+        for region in (schema.get("regions") or []) if AI_FIELD_REGIONS else []:
+            i = region_page(region, num_pages)
+            if i is None or page_texts[i] is not None:
+                continue
+            region_fields = [f for f in fields_list if field_name(f) in region["fields"]]
+            if region_fields:
+                region_plan.append((region, i, region_fields))
+                in_region.update(field_name(f) for f in region_fields)
+        routed_fields = [f for f in fields_list if field_name(f) not in in_region]
+
+        if num_pages == 1 and not region_plan:
             return await self._extract_page(
-                selected_images[0], fields_list, doc_type, type_context
+                selected_images[0], fields_list, doc_type, type_context,
+                page_hash=page_hashes[0], page_text=page_texts[0], **extract_kwargs
             )
 
         # Route fields to their correct page
         first_fields, last_fields, any_fields = [], [], []
-        for f in fields_list:
+        for f in routed_fields:
             fn = f.get("fieldName") or f.get("name") or ""
             if not fn:
                 continue
@@ -574,24 +1040,31 @@ Return ONLY:
 
         # Build parallel tasks
         tasks, task_keys = [], []
-        if first_fields:
-            tasks.append(self._extract_page(
-                selected_images[0], first_fields, doc_type, type_context, page_roles[0]
+        for region, i, region_fields in region_plan:
+            tasks.append(self._extract_region(
+                selected_images[i], region, region_fields, doc_type, type_context,
+                page_hash=page_hashes[i], frame=pages.frame(page_numbers[i]), **extract_kwargs
             ))
-            task_keys.append(("targeted", first_fields))
-
-        if last_fields:
+            task_keys.append(("targeted", region_fields))
+
+        # One request per page: every field group routed to the same page is
+        # merged into one prompt and schema, and the reply is split back by field
+        page_fields: List[List[Dict]] = [[] for _ in range(num_pages)]
+        page_fields[0] += first_fields
+        page_fields[-1] += last_fields
+        for fields in page_fields:
+            fields += any_fields
+        # A field sent to every page is legitimately null on most of them
+        any_names = frozenset(field_name(f) for f in any_fields) if num_pages > 1 else frozenset()
+
+        for i, fields in enumerate(page_fields):
+            if not fields:
+                continue
             tasks.append(self._extract_page(
-                selected_images[-1], last_fields, doc_type, type_context, page_roles[-1]
+                selected_images[i], fields, doc_type, type_context, page_roles[i],
+                page_hash=page_hashes[i], page_text=page_texts[i], optional_fields=any_names, **extract_kwargs
             ))
-            task_keys.append(("targeted", last_fields))
-
-        if any_fields:
-            for i, img in enumerate(selected_images):
-                tasks.append(self._extract_page(
-                    img, any_fields, doc_type, type_context, page_roles[i]
-                ))
-                task_keys.append(("any", any_fields))
+            task_keys.append(("page", fields))
 
         all_results = await asyncio.gather(*tasks, return_exceptions=True)
 
@@ -608,12 +1081,8 @@ Return ONLY:
                 fn = f.get("fieldName") or f.get("name") or ""
                 if not fn:
                     continue
-                ft = (f.get("type") or f.get("fieldType") or "text").lower()
-                is_list = ft in ("array", "list") or any(
-                    kw in fn.lower() for kw in ("codes", "diagnos", "medication", "procedure")
-                )
                 val = task_result.get(fn)
-                if is_list:
+                if is_list_field(f):
                     existing = result.get(fn)
                     if isinstance(existing, list) and isinstance(val, list):
                         result[fn] = existing + val
@@ -645,24 +1114,65 @@ Return ONLY:
         file_content: bytes,
         filename: str,
         schemas: List[Dict],
-        db: Session,
         document_id: int,
         progress_callback=None,
         check_cancelled_callback=None,
+        file_path: str = None,
+        finding_callback=None,
+        schema_snapshot=None,
     ) -> Dict[str, Any]:
+        """
+        ``schema_snapshot`` (a schema_registry snapshot that ``schemas`` came from)
+        lets prompts compiled for this organisation be reused across documents.
+
+        No database session is taken in: the run is mostly model calls, so each
+        write below opens its own short session_scope instead of pinning a pooled
+        connection for the whole analysis.
+        """
 
         # ── 0. HARD RESET ──────────────────────────────────────────────────
-        db.query(UnverifiedDocument).filter(
-            UnverifiedDocument.document_id == document_id
-        ).delete()
-        db.commit()
+        with session_scope() as db:
+            db.query(UnverifiedDocument).filter(
+                UnverifiedDocument.document_id == document_id
+            ).delete()
 
-        # ── 1. CONVERT TO IMAGES ───────────────────────────────────────────
+        # ── 1. OPEN PAGES (rendered on demand) ─────────────────────────────
         if progress_callback:
             await progress_callback("Converting to images...", 10)
 
-        images = await self._convert_to_images(file_content, filename)
-        total_pages = len(images)
+        profiles = analysis_profiles([s["type_name"] for s in schemas if s.get("type_name")])
+        pages = await self._open_pages(file_content, filename, file_path, profiles)
+        # Born-digital pages are read from their text layer instead of their image
+        text_layer = TextLayer(pages.path, len(pages)) if TEXT_LAYER_ROUTING and pages.is_pdf else None
+        try:
+            return await self._analyze_pages(
+                pages, schemas, document_id,
+                progress_callback, check_cancelled_callback, finding_callback, schema_snapshot, text_layer
+            )
+        finally:
+            # Pages render on demand, interleaved with classification — report the summed render time
+            trace_add("rasterize", pages.render_seconds, pages=pages.pages_rendered)
+            if text_layer:
+                text_layer.close()
+            pages.close()
+
+    async def _analyze_pages(
+        self,
+        pages: DocumentPages,
+        schemas: List[Dict],
+        document_id: int,
+        progress_callback=None,
+        check_cancelled_callback=None,
+        finding_callback=None,
+        schema_snapshot=None,
+        text_layer: TextLayer = None,
+    ) -> Dict[str, Any]:
+        """
+        Classification and extraction are pipelined: each document instance is
+        dispatched for extraction as soon as a later page closes it, and every
+        finding is handed to ``finding_callback`` the moment it is ready.
+        """
+        total_pages = len(pages)
 
         # ── 2. SCHEMA PREP ─────────────────────────────────────────────────
         # schema_map: types WITH extraction fields → full field extraction
@@ -695,47 +1205,39 @@ Return ONLY:
             f"extractable={sorted(schema_map.keys())}"
         )
 
-        # ── 3. CLASSIFY ALL PAGES IN PARALLEL ──────────────────────────────
-        if progress_callback:
-            await progress_callback("Classifying pages...", 20)
-
-        pages = await self._classify_all_pages(images, classifier_types)
-
-        # ── 4. NORMALISE (fill any gaps with UNKNOWN) ───────────────────────
-        normalized = {p["page"]: p for p in pages}
-        if len(normalized) != total_pages:
-            missing = [i for i in range(1, total_pages + 1) if i not in normalized]
-            print(f"[ai_service] WARNING: missing pages {missing} — padding UNKNOWN")
-            for pg in missing:
-                normalized[pg] = {"page": pg, "type": "UNKNOWN", "signals": {"header_restart": True}}
-
-        ordered_pages = [normalized[i] for i in range(1, total_pages + 1)]
-
-        # ── 5. GROUP INTO DOCUMENT INSTANCES ───────────────────────────────
-        structure = self.build_document_instances(ordered_pages)
+        if schema_snapshot is not None:
+            classifier_prompts = schema_snapshot.derive(
+                "classifier_prompts", lambda: self._classification_prompts(classifier_types)
+            )
+        else:
+            classifier_prompts = self._classification_prompts(classifier_types)
 
-        type_summary = Counter(d["type"] for d in structure)
-        print(f"[ai_service] {len(structure)} instances: {dict(type_summary)}")
+        organisation_id = current_ai_context()["organisation_id"]
+        layout_index = await layout_index_service.for_organisation(organisation_id)
+        ocr_signatures = await ocr_classifier.for_organisation(organisation_id, classifier_types)
+        page_headers: Dict[int, str] = {}
+        cascade = await model_cascade_service.for_organisation(organisation_id)
+        routing_log: List[dict] = []  # every model call of this document, see model_cascade_service
 
-        # ── 6. SPLIT: extractable vs unverified ────────────────────────────
-        verified_docs   = [(i, d) for i, d in enumerate(structure, 1) if schema_map.get(d["type"])]
-        unverified_docs = [(i, d) for i, d in enumerate(structure, 1) if not schema_map.get(d["type"])]
+        findings: List[Dict[str, Any]] = []
+        structure: List[Dict[str, str]] = []
+        instance_tasks: List[asyncio.Task] = []
+        extract_started = None
 
         # For unverified/invented types: run auto-extraction to capture marked items
         # even though there's no predefined template for them.
-        if unverified_docs:
-            unverified_sem = asyncio.Semaphore(8)
-
-            async def _auto_extract(doc_item: dict) -> dict:
-                """Extract marked/checked items from a page with no predefined schema."""
-                doc_type   = doc_item["type"]
-                page_range = doc_item["page_range"]
-                start, end = map(int, page_range.split("-"))
-                page_images = images[start - 1: end]
+        async def _auto_extract(doc_item: dict, routing: List[dict]) -> dict:
+            """Extract marked/checked items from a page with no predefined schema."""
+            doc_type   = doc_item["type"]
+            page_range = doc_item["page_range"]
+            start, end = map(int, page_range.split("-"))
 
-                async with unverified_sem:
-                    try:
-                        user_content = [{"type": "text", "text": f"""Examine this medical document page ({doc_type}).
+            async with pages.hold():
+                try:
+                    page_numbers = self._content_pages(pages, start, end)
+                    # Always the image: marks (ticks, circles, handwriting) are what this stage
+                    # looks for, and none of them are in a text layer
+                    user_content = [{"type": "text", "text": f"""Examine this medical document page ({doc_type}).
 
 Extract ALL items that are visually MARKED: checked ☑, circled, underlined,
 crossed out, or have handwriting directly adjacent to them.
@@ -747,114 +1249,208 @@ Return JSON with descriptive keys inferred from the form labels:
 {{
   "marked_items": ["code or item 1", "code or item 2", ...],
   "handwritten_fields": {{"field_label": "value", ...}},
-  "document_summary": "one sentence describing what this page is"
+  "document_summary": "one sentence describing what this page is",
+  "_confidence": "<HIGH | MEDIUM | LOW — LOW when marks are faint, ambiguous or hard to read>"
 }}"""}]
-                        for img in page_images:
-                            user_content.append({
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{img}", "detail": "high"}
-                            })
-
+                    for p in page_numbers:
+                        img = await pages.get(p, PROFILE_EXTRACT)
+                        user_content.append({
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{img}",
+                                "detail": IMAGE_PROFILES[PROFILE_EXTRACT]["detail"]
+                            }
+                        })
+
+                    models = cascade["models"][STAGE_AUTO_EXTRACT]
+                    for step, model in enumerate(models):
                         response = await self.client.chat.completions.create(
-                            model="gpt-4o",
+                            model=model,
                             messages=[
                                 {"role": "system", "content": "You are a medical document data extractor. Extract only visually marked items. Return valid JSON only."},
                                 {"role": "user", "content": user_content}
                             ],
                             max_tokens=1024,
-                            response_format={"type": "json_object"},
+                            response_format=response_format("auto_extraction", AUTO_EXTRACT_SCHEMA),
                             temperature=0,
                         )
-                        return self._safe_parse_json(response.choices[0].message.content)
-                    except Exception as e:
-                        print(f"[ai_service] auto-extract error {doc_type} p{page_range}: {e}")
-                        return {}
-
-            auto_results = await asyncio.gather(
-                *[_auto_extract(doc) for _, doc in unverified_docs],
-                return_exceptions=True,
-            )
-
-            for (_, doc), result in zip(unverified_docs, auto_results):
-                extracted = result if isinstance(result, dict) else {}
+                        result = from_auto_extract(self._parse_reply(response))
+                        confidence = str(result.pop("_confidence", "") or "").strip().upper()
+                        reasons = []
+                        if confidence == "LOW":
+                            reasons.append(REASON_LOW_CONFIDENCE)
+                        if not result.get("marked_items") and not result.get("handwritten_fields"):
+                            reasons.append(REASON_EMPTY)
+                        reasons = [r for r in reasons if r in cascade["escalate_on"]]
+                        escalate_to = models[step + 1] if reasons and step + 1 < len(models) else None
+                        routing.append(routing_record(STAGE_AUTO_EXTRACT, model, False, reasons, escalate_to))
+                        if not escalate_to:
+                            return result
+                        print(f"[ai_service] auto-extract {doc_type} p{page_range}: {', '.join(reasons)} on {model} → {escalate_to}")
+                except Exception as e:
+                    print(f"[ai_service] auto-extract error {doc_type} p{page_range}: {e}")
+                    return {}
+
+        async def _save_unverified(doc_item: dict):
+            routing: List[dict] = []
+            extracted = await _auto_extract(doc_item, routing)
+            routing_log.extend(routing)
+            with session_scope() as db:
                 db.add(UnverifiedDocument(
                     document_id=document_id,
-                    suspected_type=doc["type"],
-                    page_range=doc["page_range"],
-                    extracted_data=extracted,
+                    suspected_type=doc_item["type"],
+                    page_range=doc_item["page_range"],
+                    extracted_data=extracted if isinstance(extracted, dict) else {},
                     status="PENDING",
+                    ai_metadata={"routing": summarize_routing(routing)},
                 ))
-        else:
-            pass  # no unverified docs
 
-        db.commit()
+        async def _extract_one(doc_item: dict, schema: dict) -> dict:
+            doc_type   = doc_item["type"]
+            page_range = doc_item["page_range"]
+            routing: List[dict] = []
+            try:
+                async with pages.hold():
+                    raw_data = await self._extract_fields(
+                        doc_type, page_range, pages, schema, cascade=cascade, routing=routing,
+                        text_layer=text_layer
+                    )
+                # Wrap in {"fields": ...} — document_service reads finding["data"]["fields"]
+                finding = {
+                    "type": doc_type,
+                    "page_range": page_range,
+                    "data": {"fields": raw_data},
+                    "confidence": 1.0,
+                }
+            except Exception as exc:
+                print(f"[ai_service] extraction error {doc_type} p{page_range}: {exc}")
+                finding = {
+                    "type": doc_type,
+                    "page_range": page_range,
+                    "data": {"_error": str(exc), "fields": {}},
+                    "confidence": 0.0,
+                }
+            routing_log.extend(routing)
+            finding["routing"] = summarize_routing(routing)
+            findings.append(finding)
+            if finding_callback:
+                try:
+                    await finding_callback(finding)
+                except Exception as exc:
+                    print(f"[ai_service] finding callback failed {doc_type} p{page_range}: {exc}")
+            return finding
+
+        def dispatch(instance: Dict[str, str]):
+            nonlocal extract_started
+            extract_started = extract_started or time.monotonic()
+            structure.append(instance)
+            schema = schema_map.get(instance["type"])
+            if schema:
+                instance_tasks.append(asyncio.create_task(_extract_one(instance, schema)))
+            else:
+                instance_tasks.append(asyncio.create_task(_save_unverified(instance)))
 
-        # ── 7. EXTRACT FIELDS — all in parallel ────────────────────────────
-        findings: List[Dict[str, Any]] = []
+        assembler = InstanceAssembler(total_pages)
 
-        if verified_docs:
-            if progress_callback:
-                await progress_callback(f"Extracting {len(verified_docs)} document(s)...", 50)
+        page_sources = Counter()
+        page_inputs = Counter()
 
-            if check_cancelled_callback and await check_cancelled_callback():
-                raise Exception("Analysis Cancelled")
+        def on_page(page: Dict[str, Any]):
+            page_sources[page.get("signals", {}).get("source", "model")] += 1
+            if page.get("signals", {}).get("input"):
+                page_inputs[page["signals"]["input"]] += 1
+            for instance in assembler.add(page):
+                dispatch(instance)
 
-            extract_sem = asyncio.Semaphore(8)
+        # ── 3. CLASSIFY PAGES → 4. GROUP → 5. DISPATCH, PIPELINED ──────────
+        if progress_callback:
+            await progress_callback("Classifying pages...", 20)
 
-            async def _extract_one(doc_item: dict, schema: dict) -> dict:
-                doc_type   = doc_item["type"]
-                page_range = doc_item["page_range"]
-                async with extract_sem:
-                    try:
-                        raw_data = await self._extract_fields(
-                            doc_type, page_range, images, schema
-                        )
-                        # Wrap in {"fields": ...} — document_service reads finding["data"]["fields"]
-                        return {
-                            "type": doc_type,
-                            "page_range": page_range,
-                            "data": {"fields": raw_data},
-                            "confidence": 1.0,
-                        }
-                    except Exception as exc:
-                        print(f"[ai_service] extraction error {doc_type} p{page_range}: {exc}")
-                        return {
-                            "type": doc_type,
-                            "page_range": page_range,
-                            "data": {"_error": str(exc), "fields": {}},
-                            "confidence": 0.0,
-                        }
+        try:
+            with trace_span("classify", pages=total_pages):
+                await self._classify_all_pages(
+                    pages, classifier_types, on_page=on_page, layout_index=layout_index,
+                    cascade=cascade, routing=routing_log, prompts=classifier_prompts,
+                    text_layer=text_layer, ocr=ocr_signatures, headers=page_headers
+                )
+            for instance in assembler.finish():
+                dispatch(instance)
+            # Labelled later if staff confirm this document (see layout_index_service)
+            await layout_index_service.record_pages(organisation_id, document_id, {
+                p: v for p, v in pages.layouts().items() if not pages.is_blank(p)
+            }, headers=page_headers)
 
-            all_results = await asyncio.gather(
-                *[_extract_one(doc, schema_map[doc["type"]]) for _, doc in verified_docs],
-                return_exceptions=True,
-            )
-            for r in all_results:
+            type_summary = Counter(d["type"] for d in structure)
+            print(f"[ai_service] {len(structure)} instances: {dict(type_summary)}")
+
+            # ── 6. WAIT FOR EXTRACTIONS STILL IN FLIGHT ─────────────────────
+            verified_count = sum(1 for d in structure if schema_map.get(d["type"]))
+            if verified_count and progress_callback:
+                await progress_callback(f"Extracting {verified_count} document(s)...", 50)
+
+            if check_cancelled_callback and await check_cancelled_callback():
+                raise Exception("Analysis Cancelled")
+
+            results = await asyncio.gather(*instance_tasks, return_exceptions=True)
+            for r in results:
                 if isinstance(r, Exception):
                     print(f"[ai_service] unexpected gather error: {r}")
-                else:
-                    findings.append(r)
+            if extract_started is not None:
+                # From the first instance dispatched (mid-classification) until the last one finished
+                trace_add("extract", time.monotonic() - extract_started, instances=len(instance_tasks))
+        finally:
+            await cancel_and_wait(instance_tasks)
+
+        # ── 7. ORDER FINDINGS BY PAGE ───────────────────────────────────────
+        findings.sort(key=lambda f: int(f["page_range"].split("-")[0]))
 
         # ── 8. FINALIZE ─────────────────────────────────────────────────────
-        derived = Counter(
-            r.suspected_type
-            for r in db.query(UnverifiedDocument)
-                        .filter(UnverifiedDocument.document_id == document_id)
-                        .all()
-        )
-        db.commit()
+        with session_scope() as db:
+            derived = Counter(
+                suspected_type
+                for (suspected_type,) in db.query(UnverifiedDocument.suspected_type)
+                                           .filter(UnverifiedDocument.document_id == document_id)
+                                           .all()
+            )
 
         if progress_callback:
             await progress_callback("Finalizing...", 95)
 
+        blank_pages = pages.blank_pages()
+        analysis_metadata = {
+            "total_pages": total_pages,
+            "instances": len(structure),
+            # how each page was classified: model, cache, layout, ocr, ocr_degraded, blank, error
+            "page_classification": dict(page_sources),
+            "model_calls_skipped": total_pages - page_sources["model"] - page_sources["error"],
+            "blank_pages": blank_pages,
+            "schema_version": schema_snapshot.version if schema_snapshot is not None else None,
+            # pages sent to a model as text (trusted text layer) vs as an image
+            "page_routing": {
+                "text": page_inputs["text"],
+                "image": page_inputs["image"],
+                "text_layer": text_layer.summary() if text_layer else None,
+            },
+            # model calls per stage and why cheaper answers were escalated
+            "model_routing": {
+                "cascade_enabled": cascade["enabled"],
+                "stages": {
+                    stage: summarize_routing([r for r in routing_log if r["stage"] == stage])
+                    for stage in STAGES
+                },
+            },
+        }
+
         print(
             f"[ai_service] DONE document_id={document_id} | "
-            f"extracted={len(findings)} | unverified={dict(derived)}"
+            f"extracted={len(findings)} | unverified={dict(derived)} | "
+            f"pages={dict(page_sources)}"
         )
 
         return {
             "derived_documents": dict(derived),
             "findings": findings,
+            "analysis_metadata": analysis_metadata,
         }
 
 
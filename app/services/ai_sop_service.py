@@ -12,6 +12,7 @@ import pandas as pd
 from app.models.sop import SOP
 from app.models.status import Status
 from app.services.ai_client import openai_client
+from app.services.rasterizer import DocumentPages, RASTER_WINDOW_PAGES
 from openpyxl import load_workbook
 from pdfminer.high_level import extract_text as pdf_extract
 
@@ -41,13 +42,18 @@ PASS2_SCHEMA = """
 
 # ── Shared call helper ────────────────────────────────────────────────────────
 
+async def _chat_completion(**kwargs):
+    """All SOP model calls go through the shared client, which schedules each attempt (ai_scheduler)."""
+    return await openai_client.chat.completions.create(**kwargs)
+
+
 async def _call_ai(prompt: str, max_tokens: int = 8000) -> dict:
     """
     Single shared AI caller.
     - Focused prompts need far fewer tokens than the old monolith
     - 3-tier JSON repair fallback
     """
-    response = await openai_client.chat.completions.create(
+    response = await _chat_completion(
         # model="gpt-4o-mini",
         model="gpt-4o",  # gpt-4o-mini drops quality significantly on structured extraction tasks
         messages=[
@@ -165,7 +171,7 @@ async def _vision_text_from_images(
             "image_url": {"url": f"data:image/jpeg;base64,{b64}", "detail": "high"},
         })
 
-    response = await openai_client.chat.completions.create(
+    response = await _chat_completion(
         model="gpt-4o",          # must be gpt-4o for vision; gpt-4o-mini drops quality
         messages=[{"role": "user", "content": content}],
         temperature=0,
@@ -179,44 +185,43 @@ async def _pdf_to_vision_text(path: str, dpi: int = 120, batch_size: int = 4) ->
     Convert every page of a PDF to an image and extract text via GPT-4o vision.
 
     Strategy:
-      - Convert pages at 120 dpi (≈164 KB/page as JPEG)
+      - Render pages at 120 dpi (≈164 KB/page as JPEG) in the shared raster pool
       - Process in batches of `batch_size` pages per API call
-      - Run all batches concurrently (semaphore limits to 10 in-flight at once)
+      - Run batches concurrently as pages stream in (ai_scheduler bounds in-flight
+        requests; the raster window bounds pages held in memory)
       - Concatenate results in page order
     """
-    from pdf2image import convert_from_path
-
-    loop = asyncio.get_event_loop()
-    pages: list[Image.Image] = await loop.run_in_executor(
-        None,
-        lambda: convert_from_path(path, dpi=dpi),
-    )
-
-    if not pages:
-        raise ValueError(f"pdf2image returned 0 pages for {path}")
-
-    print(f"[vision-pdf] {len(pages)} pages → batches of {batch_size}")
-
-    # encode all pages (CPU-bound, run in executor)
-    encoded: list[str] = await loop.run_in_executor(
-        None,
-        lambda: [_encode_pil(p, dpi) for p in pages],
-    )
-
-    # build batches
-    batches: list[list[str]] = [
-        encoded[i : i + batch_size] for i in range(0, len(encoded), batch_size)
-    ]
-
-    sem = asyncio.Semaphore(10)
-
-    async def _process_batch(batch_imgs: list[str], batch_no: int) -> tuple[int, str]:
-        async with sem:
-            text = await _vision_text_from_images(batch_imgs)
-            return batch_no, text
-
-    tasks = [_process_batch(batch, i) for i, batch in enumerate(batches)]
-    results: list[tuple[int, str]] = await asyncio.gather(*tasks)
+    # Window units are taken per page but released per batch, so the window must
+    # hold at least one whole batch or a small RASTER_WINDOW_PAGES deadlocks.
+    window_pages = max(batch_size, RASTER_WINDOW_PAGES)
+    async with await DocumentPages.open(path, path, dpi=dpi, quality=82, window_pages=window_pages) as pages:
+        if not len(pages):
+            raise ValueError(f"pdf2image returned 0 pages for {path}")
+
+        print(f"[vision-pdf] {len(pages)} pages → batches of {batch_size}")
+
+        window = pages.hold()
+
+        async def _process_batch(batch_imgs: list[str], batch_no: int) -> tuple[int, str]:
+            try:
+                text = await _vision_text_from_images(batch_imgs)
+                return batch_no, text
+            finally:
+                for _ in batch_imgs:
+                    window.release()
+
+        tasks = []
+        batch: list[str] = []
+        async for _, encoded in pages:
+            await window.acquire()
+            batch.append(encoded)
+            if len(batch) == batch_size:
+                tasks.append(asyncio.create_task(_process_batch(batch, len(tasks))))
+                batch = []
+        if batch:
+            tasks.append(asyncio.create_task(_process_batch(batch, len(tasks))))
+
+        results: list[tuple[int, str]] = await asyncio.gather(*tasks)
 
     # sort by batch index and join
     results.sort(key=lambda x: x[0])
@@ -622,7 +627,7 @@ class AISOPService:
 
         image_base64 = base64.b64encode(image_bytes).decode("utf-8")
 
-        response = await openai_client.chat.completions.create(
+        response = await _chat_completion(
             # model="gpt-4o-mini",
             model="gpt-4o",  # gpt-4o-mini drops quality significantly on OCR tasks
             messages=[
@@ -0,0 +1,346 @@
+"""
+Per-call AI usage and cost accounting.
+
+Every request that goes through ``ResilientAIClient`` (AIService, AISOPService,
+OpenAIDocumentAI) and every ai_result_cache hit that stood in for one is
+recorded as a row of docucr.ai_usage: model, prompt / cached / completion
+tokens, image count and bytes, latency including retries, retry count and the
+outcome. Token counts are the provider's ``usage`` figures, not estimates.
+
+Rows are attributed from ``ai_request_context`` — the worker sets the
+organisation, document and SOP of the job it is running — so call sites don't
+pass anything through. A call that serves several documents at once (a
+batched classification request, see classification_batcher) is made inside
+``shared_usage`` with the context of every page it carries, and is recorded
+as one row per page with tokens, images and cost split evenly between them. ``record`` only appends to an in-memory buffer; a
+background thread inserts it in batches of AI_USAGE_BATCH_SIZE or every
+AI_USAGE_FLUSH_SECONDS, so accounting adds no DB round trip to a model call.
+A failing insert is logged and dropped; it never fails an analysis.
+
+Cost is computed at record time from AI_MODEL_PRICES (USD per 1M tokens,
+longest model-name prefix wins), so later price changes don't rewrite history:
+    {"gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10.0}}
+
+The table is rolled up per document, per SOP and per organisation per day at
+query time (see ``document_usage``, ``sop_usage``, ``daily_usage``).
+"""
+import atexit
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import case, func, insert
+
+from app.core.database import SessionLocal
+from app.models.ai_usage import AIUsage
+from app.services.ai_scheduler import current_ai_context
+
+AI_USAGE_ENABLED = os.getenv("AI_USAGE_ENABLED", "true").lower() == "true"
+AI_USAGE_BATCH_SIZE = int(os.getenv("AI_USAGE_BATCH_SIZE", "200"))
+AI_USAGE_FLUSH_SECONDS = float(os.getenv("AI_USAGE_FLUSH_SECONDS", "5"))
+AI_USAGE_MAX_BUFFER = int(os.getenv("AI_USAGE_MAX_BUFFER", "20000"))  # rows kept while the DB is unreachable
+
+DEFAULT_MODEL_PRICES = {
+    "gpt-4o": {"input": 2.5, "cached_input": 1.25, "output": 10.0},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.6},
+}
+AI_MODEL_PRICES = {**DEFAULT_MODEL_PRICES, **json.loads(os.getenv("AI_MODEL_PRICES") or "{}")}
+
+ENDPOINT_CACHE = "cache"
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+# Per-page figures of a shared call; everything else is copied to every page's row
+_SPLIT_COUNTS = ("prompt_tokens", "cached_prompt_tokens", "completion_tokens", "images", "image_bytes")
+
+_shared_usage = contextvars.ContextVar("ai_usage_shared", default=None)
+
+
+@contextmanager
+def shared_usage(contexts: List[dict]):
+    """Calls made inside serve one page of each of ``contexts`` (ai_request_context dicts)."""
+    token = _shared_usage.set(list(contexts) or None)
+    try:
+        yield
+    finally:
+        _shared_usage.reset(token)
+
+
+def _price(model: Optional[str]) -> Optional[dict]:
+    if not model:
+        return None
+    matches = [name for name in AI_MODEL_PRICES if model == name or model.startswith(name + "-")]
+    return AI_MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def cost_usd(model: Optional[str], prompt_tokens: int, completion_tokens: int, cached_prompt_tokens: int = 0) -> float:
+    price = _price(model)
+    if not price:
+        return 0.0
+    cached = min(cached_prompt_tokens, prompt_tokens)
+    return (
+        (prompt_tokens - cached) * price.get("input", 0)
+        + cached * price.get("cached_input", price.get("input", 0))
+        + completion_tokens * price.get("output", 0)
+    ) / 1_000_000
+
+
+def usage_tokens(response) -> Dict[str, int]:
+    """Prompt / cached / completion tokens of a chat or responses result."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0}
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:  # responses API
+        prompt = getattr(usage, "input_tokens", 0)
+        completion = getattr(usage, "output_tokens", 0)
+        details = getattr(usage, "input_tokens_details", None)
+    else:
+        completion = getattr(usage, "completion_tokens", 0)
+        details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": prompt or 0,
+        "cached_prompt_tokens": (getattr(details, "cached_tokens", 0) if details is not None else 0) or 0,
+        "completion_tokens": completion or 0,
+    }
+
+
+def image_stats(kwargs: dict) -> tuple:
+    """(images, decoded bytes) sent in a request's messages / input."""
+    images = 0
+    size = 0
+
+    def walk(node):
+        nonlocal images, size
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            if node.get("type") in ("image_url", "input_image"):
+                url = node.get("image_url")
+                url = url.get("url") if isinstance(url, dict) else url
+                images += 1
+                if isinstance(url, str) and url.startswith("data:"):
+                    size += len(url.partition(",")[2]) * 3 // 4  # base64 -> bytes
+                return
+            for key in ("content", "input"):
+                if key in node:
+                    walk(node[key])
+
+    walk(kwargs.get("messages") or kwargs.get("input") or [])
+    return images, size
+
+
+def purpose_of(kwargs: dict) -> Optional[str]:
+    """The structured-output schema name, which says what the call was for."""
+    fmt = kwargs.get("response_format") or (kwargs.get("text") or {}).get("format") or {}
+    if not isinstance(fmt, dict):
+        return None
+    return (fmt.get("json_schema") or {}).get("name") or fmt.get("name") or fmt.get("type")
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AIUsageRecorder:
+    def __init__(self, enabled: bool = AI_USAGE_ENABLED, batch_size: int = AI_USAGE_BATCH_SIZE,
+                 flush_seconds: float = AI_USAGE_FLUSH_SECONDS, max_buffer: int = AI_USAGE_MAX_BUFFER):
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._rows: List[dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    # ── recording ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _attributed(row: dict, ctx: dict, created_at: datetime) -> dict:
+        return dict(
+            row,
+            organisation_id=ctx.get("organisation_id"),
+            document_id=_int_or_none(ctx.get("document_id")),
+            sop_id=str(ctx["sop_id"]) if ctx.get("sop_id") else None,
+            created_at=created_at,
+        )
+
+    def _split(self, row: dict, contexts: List[dict], created_at: datetime) -> List[dict]:
+        """One row per page of a shared call; integer counts keep their total (remainder to the first pages)."""
+        n = len(contexts)
+        rows = [self._attributed(row, ctx, created_at) for ctx in contexts]
+        for key in _SPLIT_COUNTS:
+            share, remainder = divmod(row.get(key) or 0, n)
+            for i, split in enumerate(rows):
+                split[key] = share + (1 if i < remainder else 0)
+        for split in rows:
+            split["cost_usd"] = (row.get("cost_usd") or 0.0) / n
+        return rows
+
+    def _append(self, row: dict):
+        created_at = datetime.now(timezone.utc)
+        contexts = _shared_usage.get()
+        rows = self._split(row, contexts, created_at) if contexts \
+            else [self._attributed(row, current_ai_context(), created_at)]
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_buffer:
+                self.dropped += len(rows)
+                return
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="ai-usage-flush", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def record_call(self, endpoint: str, kwargs: dict, response=None, latency: float = 0.0,
+                    retries: int = 0, error: Optional[BaseException] = None):
+        """One request to the provider — after it succeeded or finally failed."""
+        if not self.enabled:
+            return
+        model = getattr(response, "model", None) or kwargs.get("model")
+        tokens = usage_tokens(response)
+        images, image_bytes = image_stats(kwargs)
+        self._append({
+            "endpoint": endpoint,
+            "purpose": purpose_of(kwargs),
+            "model": model,
+            **tokens,
+            "images": images,
+            "image_bytes": image_bytes,
+            "latency_ms": int(latency * 1000),
+            "retries": retries,
+            "cached": False,
+            "status": STATUS_ERROR if error is not None else STATUS_OK,
+            "error": f"{type(error).__name__}: {error}"[:500] if error is not None else None,
+            "cost_usd": cost_usd(model, tokens["prompt_tokens"], tokens["completion_tokens"], tokens["cached_prompt_tokens"]),
+        })
+
+    def record_cache_hit(self, kind: str):
+        """A page answered by ai_result_cache instead of a model call."""
+        if not self.enabled:
+            return
+        self._append({
+            "endpoint": ENDPOINT_CACHE, "purpose": kind, "model": None,
+            "prompt_tokens": 0, "cached_prompt_tokens": 0, "completion_tokens": 0,
+            "images": 0, "image_bytes": 0, "latency_ms": 0, "retries": 0,
+            "cached": True, "status": STATUS_OK, "error": None, "cost_usd": 0.0,
+        })
+
+    # ── batching ─────────────────────────────────────────────────────────────
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Insert everything buffered; returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            db = SessionLocal()
+            try:
+                for start in range(0, len(rows), self.batch_size):
+                    db.execute(insert(AIUsage), rows[start:start + self.batch_size])
+                db.commit()
+                return len(rows)
+            except Exception as e:
+                db.rollback()
+                self.dropped += len(rows)
+                print(f"[ai_usage] dropped {len(rows)} usage row(s): {e}")
+                return 0
+            finally:
+                db.close()
+
+    # ── rollups ──────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _totals(query) -> dict:
+        row = query.with_entities(*_TOTAL_COLUMNS).one()
+        return _totals_dict(row)
+
+    @staticmethod
+    def _by_model(query) -> Dict[str, dict]:
+        rows = query.with_entities(AIUsage.model, *_TOTAL_COLUMNS).filter(
+            AIUsage.cached.is_(False)
+        ).group_by(AIUsage.model).all()
+        return {row[0] or "unknown": _totals_dict(row[1:]) for row in rows}
+
+    def document_usage(self, db, organisation_id: str, document_id: int) -> dict:
+        query = db.query(AIUsage).filter(
+            AIUsage.organisation_id == organisation_id, AIUsage.document_id == document_id
+        )
+        return {"document_id": document_id, **self._totals(query), "by_model": self._by_model(query)}
+
+    def sop_usage(self, db, organisation_id: str, sop_id: str) -> dict:
+        query = db.query(AIUsage).filter(
+            AIUsage.organisation_id == organisation_id, AIUsage.sop_id == str(sop_id)
+        )
+        return {"sop_id": str(sop_id), **self._totals(query), "by_model": self._by_model(query)}
+
+    def daily_usage(self, db, organisation_id: str, days: int = 30) -> dict:
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        query = db.query(AIUsage).filter(
+            AIUsage.organisation_id == organisation_id, AIUsage.created_at >= since
+        )
+        day = func.date(AIUsage.created_at)
+        rows = query.with_entities(day, *_TOTAL_COLUMNS).group_by(day).order_by(day).all()
+        return {
+            "organisation_id": organisation_id,
+            "days": days,
+            "total": self._totals(query),
+            "by_model": self._by_model(query),
+            "daily": [{"date": row[0].isoformat(), **_totals_dict(row[1:])} for row in rows],
+        }
+
+
+_TOTAL_COLUMNS = (
+    func.count(case((AIUsage.cached.is_(False), 1))),
+    func.count(case((AIUsage.cached.is_(True), 1))),
+    func.count(case((AIUsage.status == STATUS_ERROR, 1))),
+    func.coalesce(func.sum(AIUsage.prompt_tokens), 0),
+    func.coalesce(func.sum(AIUsage.cached_prompt_tokens), 0),
+    func.coalesce(func.sum(AIUsage.completion_tokens), 0),
+    func.coalesce(func.sum(AIUsage.images), 0),
+    func.coalesce(func.sum(AIUsage.image_bytes), 0),
+    func.coalesce(func.sum(AIUsage.latency_ms), 0),
+    func.coalesce(func.sum(AIUsage.retries), 0),
+    func.coalesce(func.sum(AIUsage.cost_usd), 0.0),
+)
+
+
+def _totals_dict(row) -> Dict[str, Any]:
+    calls, cache_hits, errors, prompt, cached_prompt, completion, images, image_bytes, latency, retries, cost = row
+    return {
+        "calls": calls,
+        "cache_hits": cache_hits,
+        "errors": errors,
+        "prompt_tokens": int(prompt),
+        "cached_prompt_tokens": int(cached_prompt),
+        "completion_tokens": int(completion),
+        "images": int(images),
+        "image_bytes": int(image_bytes),
+        "model_seconds": round(int(latency) / 1000, 1),
+        "retries": int(retries),
+        "cost_usd": round(float(cost), 6),
+    }
+
+
+ai_usage = AIUsageRecorder()
+atexit.register(ai_usage.flush)
@@ -0,0 +1,204 @@
+"""
+Immediate cancellation of running analyses.
+
+Cancelling used to only set the document's status; the analysis noticed when
+``check_cancelled_callback`` polled the database between phases, so every
+classification and extraction call already in flight — or queued for a
+scheduler slot — still ran to completion and was billed.
+
+``AnalysisCancellation`` keeps, per process, the task that runs each document's
+``AIService.analyze_document``:
+
+    result = await analysis_cancellation.run(document_id, ai.analyze_document(...))
+
+``cancel(document_id)`` cancels that task. The cancellation propagates down to
+the document's pending classify_one / _extract_one tasks (AIService cancels and
+awaits its child tasks on the way out), scheduler waiters leave the queue and
+held slots are released by ``ai_scheduler.slot()``; ``run`` then raises
+``AnalysisCancelled`` ("Analysis Cancelled"), which document_service already
+treats as a cancellation rather than a failure. Shared work is left alone: a
+page already packed into a batched classification request or leading a
+coalesced cache lookup finishes for the other documents waiting on it (the
+lookup runs as its own task in ai_cache and is only stopped once no document
+is waiting for it).
+
+The document may be analysing in another process. ``publish`` sends the
+cancel with Postgres NOTIFY on CANCEL_CHANNEL, and every worker runs a
+listener thread (``start_listener``) on its own connection — outside the pool,
+so it never holds a pooled connection — that forwards it to ``cancel``. The
+DB poll stays in place as the fallback if a notification is missed.
+
+Cancel-to-idle latency — from the cancel request to the moment the document has
+no AI work left in this process — is logged, kept in ``stats()`` and recorded
+as the ``cancel_to_idle`` span of the analysis (see processing_trace), so it
+shows up in /processing-latency next to the other stages.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import text
+
+from app.core.database import engine
+from app.services.processing_trace import trace_add
+
+CANCEL_CHANNEL = os.getenv("ANALYSIS_CANCEL_CHANNEL", "docucr_analysis_cancel")
+CANCEL_LISTEN_RECONNECT_SECONDS = float(os.getenv("ANALYSIS_CANCEL_RECONNECT_SECONDS", "5"))
+
+STAGE_CANCEL_TO_IDLE = "cancel_to_idle"
+
+_LATENCY_SAMPLES = 500
+
+
+class AnalysisCancelled(Exception):
+    def __init__(self):
+        super().__init__("Analysis Cancelled")
+
+
+async def cancel_and_wait(tasks: Iterable[asyncio.Task]):
+    """Cancel the tasks that are still running and wait until they have unwound."""
+    pending = [task for task in tasks if not task.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class _Run:
+    __slots__ = ("loop", "task", "requested_at")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, task: asyncio.Task):
+        self.loop = loop
+        self.task = task
+        self.requested_at: Optional[float] = None  # wall clock, so it can come from another process
+
+
+class AnalysisCancellation:
+    def __init__(self, channel: str = CANCEL_CHANNEL):
+        self.channel = channel
+        self._lock = threading.Lock()  # cancel() is called from the listener thread
+        self._runs: Dict[int, _Run] = {}
+        self._latencies = deque(maxlen=_LATENCY_SAMPLES)
+        self.cancelled = 0
+        self._listener: Optional[threading.Event] = None  # stop flag of the running listener thread
+
+    async def run(self, document_id: int, coro):
+        """Run ``coro`` (a document's analysis) as a task that ``cancel(document_id)`` can stop."""
+        entry = _Run(asyncio.get_running_loop(), asyncio.ensure_future(coro))
+        with self._lock:
+            self._runs[document_id] = entry
+        try:
+            return await entry.task
+        except asyncio.CancelledError:
+            if entry.requested_at is None:
+                raise  # not ours — the worker itself is being cancelled
+            raise AnalysisCancelled() from None
+        finally:
+            with self._lock:
+                if self._runs.get(document_id) is entry:
+                    del self._runs[document_id]
+            if entry.requested_at is not None:
+                self._idle(document_id, entry.requested_at)
+
+    def cancel(self, document_id: int, requested_at: Optional[float] = None) -> bool:
+        """Cancel the document's analysis if it runs in this process. Safe from any thread."""
+        with self._lock:
+            entry = self._runs.get(document_id)
+            if entry is None or entry.requested_at is not None:
+                return False
+            entry.requested_at = requested_at or time.time()
+        try:
+            entry.loop.call_soon_threadsafe(entry.task.cancel)
+        except RuntimeError:
+            return False  # its loop has closed
+        print(f"[cancellation] document_id={document_id} cancelling in-flight analysis")
+        return True
+
+    def _idle(self, document_id: int, requested_at: float):
+        seconds = max(0.0, time.time() - requested_at)
+        with self._lock:
+            self.cancelled += 1
+            self._latencies.append(seconds)
+        trace_add(STAGE_CANCEL_TO_IDLE, seconds)
+        print(f"[cancellation] document_id={document_id} idle {seconds * 1000:.0f} ms after cancel")
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sorted(self._latencies)
+            running = len(self._runs)
+            cancelled = self.cancelled
+
+        def pct(p: float) -> Optional[float]:
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            "running": running,
+            "cancelled": cancelled,
+            "cancel_to_idle_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+        }
+
+    # ── Cross-process ───────────────────────────────────────────────────────
+
+    def publish(self, db, document_id: int):
+        """NOTIFY every listening worker; delivered when ``db`` commits. Never raises."""
+        payload = json.dumps({"document_id": document_id, "requested_at": time.time()})
+        try:
+            db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": self.channel, "payload": payload})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[cancellation] could not notify workers for document_id={document_id}: {e}")
+
+    def _handle(self, payload: str):
+        try:
+            message = json.loads(payload)
+            self.cancel(int(message["document_id"]), message.get("requested_at"))
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"[cancellation] ignoring malformed notification {payload!r}: {e}")
+
+    def start_listener(self):
+        if self._listener is not None or engine.dialect.name != "postgresql":
+            return
+        self._listener = threading.Event()
+        threading.Thread(target=self._listen_loop, args=(self._listener,),
+                         name="analysis-cancel-listener", daemon=True).start()
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.set()
+            self._listener = None
+
+    def _listen_loop(self, stop: threading.Event):
+        while not stop.is_set():
+            connection = None
+            try:
+                # A dedicated DBAPI connection: LISTEN lives as long as the process
+                cargs, cparams = engine.dialect.create_connect_args(engine.url)
+                connection = engine.dialect.connect(*cargs, **cparams)
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                while not stop.is_set():
+                    if select.select([connection], [], [], 1.0)[0]:
+                        connection.poll()
+                        while connection.notifies:
+                            self._handle(connection.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"[cancellation] listener error, reconnecting: {e}")
+                stop.wait(CANCEL_LISTEN_RECONNECT_SECONDS)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+analysis_cancellation = AnalysisCancellation()
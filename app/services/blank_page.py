@@ -0,0 +1,87 @@
+"""
+Blank and near-blank page detection.
+
+Runs in the raster pool on every rendered page (see rasterizer._render), so
+blank backs and separator sheets from batch scans are known before any model
+call. A page is blank when, inside the margins:
+
+- its gray levels are essentially flat (variance), or
+- almost none of it is ink (coverage) and that ink forms only a few
+  connected blobs — scanner specks, a punch-hole shadow, a stray stroke —
+  rather than the dozens of blobs any line of text produces.
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+BLANK_MAX_INK = float(os.getenv("BLANK_MAX_INK", "0.004"))  # fraction of the page that is ink
+BLANK_MAX_COMPONENTS = int(os.getenv("BLANK_MAX_COMPONENTS", "6"))
+BLANK_FLAT_STD = 2.5  # gray-level std below which a page is blank outright
+
+ANALYSIS_WIDTH = 400  # ~47 dpi for a letter page
+MARGIN = 0.04  # scanner edge shadows and punch holes live here
+INK_CONTRAST = 60  # darker than the paper by this many gray levels
+MIN_COMPONENT_PX = 3  # blobs smaller than this (at analysis scale) are noise
+
+
+def _count_components(mask: np.ndarray, min_px: int = MIN_COMPONENT_PX) -> int:
+    """
+    8-connected blobs of at least ``min_px`` pixels. Runs are extracted with
+    numpy per row; only the runs (few, on a near-blank page) are merged in Python.
+    """
+    padded = np.pad(mask, ((0, 0), (1, 1))).astype(np.int8)
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)  # same row-major order, one end per start
+    if not len(rows):
+        return 0
+
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    row_first = {}
+    for i, r in enumerate(rows):
+        row_first.setdefault(r, i)
+    for i, r in enumerate(rows):
+        j = row_first.get(r - 1)
+        if j is None:
+            continue
+        while j < len(rows) and rows[j] == r - 1:
+            # runs [s, e) touch when they overlap or meet diagonally
+            if starts[j] <= ends[i] and starts[i] <= ends[j]:
+                parent[find(j)] = find(i)
+            j += 1
+
+    sizes = {}
+    for i in range(len(rows)):
+        root = find(i)
+        sizes[root] = sizes.get(root, 0) + int(ends[i] - starts[i])
+    return sum(1 for size in sizes.values() if size >= min_px)
+
+
+def page_ink_stats(image: Image.Image) -> dict:
+    height = max(1, round(image.height * ANALYSIS_WIDTH / max(image.width, 1)))
+    gray = np.asarray(image.convert("L").resize((ANALYSIS_WIDTH, height), Image.BILINEAR), dtype=np.float32)
+    my, mx = int(height * MARGIN), int(ANALYSIS_WIDTH * MARGIN)
+    gray = gray[my:height - my or None, mx:ANALYSIS_WIDTH - mx or None]
+
+    std = float(gray.std())
+    paper = float(np.percentile(gray, 90))  # works for grey/yellowed paper too
+    ink = gray < paper - INK_CONTRAST
+    coverage = float(ink.mean())
+
+    if std < BLANK_FLAT_STD:
+        components, blank = 0, True
+    elif coverage > BLANK_MAX_INK:
+        components, blank = None, False  # plenty of ink — not worth counting blobs
+    else:
+        components = _count_components(ink)
+        blank = components <= BLANK_MAX_COMPONENTS
+
+    return {"blank": blank, "ink": round(coverage, 5), "std": round(std, 2), "components": components}
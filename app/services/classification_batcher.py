@@ -0,0 +1,222 @@
+"""
+Batched page classification.
+
+Instead of one chat completion per page (each repeating the whole
+document-type prompt), pages waiting for classification are packed into a
+single multi-image request that returns one result per page. Pages are
+grouped by organisation and prompt version, so pages from several small
+documents of the same organisation that are in flight at the same time share
+a request; pages of different organisations never do. Groups are also split
+by scheduler lane, so an interactive page never waits in a bulk request.
+
+A batch is sent in the context (ai_request_context) of one of its pages —
+they share organisation and lane — with its usage split between the documents
+of all its pages (ai_usage_service.shared_usage); a page that has to be retried or
+audited on its own is classified in its own document's context with its own
+``single`` callable.
+
+A group is sent as soon as it holds ``size`` pages or AI_BATCH_MAX_WAIT_MS
+after its first page arrived. ``size`` adapts AIMD-style, process-wide:
+
+- it grows by one page per clean batch, up to AI_BATCH_MAX_PAGES;
+- it halves when a batch comes back incomplete or malformed (those pages are
+  retried one by one), when a batch takes longer than AI_BATCH_TARGET_SECONDS,
+  or when measured accuracy drops below AI_BATCH_MIN_AGREEMENT.
+
+Accuracy is measured by auditing: a fraction (AI_BATCH_AUDIT_RATE) of batches
+has one page re-classified on its own, and agreement on the type feeds an
+exponential moving average.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from app.services.ai_scheduler import current_ai_context
+from app.services.ai_usage_service import shared_usage
+
+AI_BATCH_CLASSIFICATION = os.getenv("AI_BATCH_CLASSIFICATION", "true").lower() == "true"
+AI_BATCH_START_PAGES = int(os.getenv("AI_BATCH_START_PAGES", "4"))
+AI_BATCH_MAX_PAGES = int(os.getenv("AI_BATCH_MAX_PAGES", "8"))
+AI_BATCH_MAX_WAIT_MS = float(os.getenv("AI_BATCH_MAX_WAIT_MS", "150"))
+AI_BATCH_TARGET_SECONDS = float(os.getenv("AI_BATCH_TARGET_SECONDS", "20"))
+AI_BATCH_MIN_AGREEMENT = float(os.getenv("AI_BATCH_MIN_AGREEMENT", "0.95"))
+AI_BATCH_AUDIT_RATE = float(os.getenv("AI_BATCH_AUDIT_RATE", "0.05"))
+
+_AGREEMENT_ALPHA = 0.1
+
+SingleFn = Callable[[str], Awaitable[dict]]
+BatchFn = Callable[[List[str]], Awaitable[List[Optional[dict]]]]
+
+
+class _Item:
+    __slots__ = ("image", "future", "single", "context", "request")
+
+    def __init__(self, image: str, future: asyncio.Future, single: SingleFn):
+        self.image = image
+        self.future = future
+        self.single = single
+        self.context = contextvars.copy_context()  # the requesting document's context
+        self.request = current_ai_context()  # its organisation / lane / document, for usage
+
+
+class _Group:
+    __slots__ = ("items", "timer", "send_batch")
+
+    def __init__(self, send_batch: BatchFn):
+        self.items: List[_Item] = []
+        self.timer = None
+        self.send_batch = send_batch
+
+
+class ClassificationBatcher:
+    def __init__(self, start_pages: int = AI_BATCH_START_PAGES, max_pages: int = AI_BATCH_MAX_PAGES,
+                 max_wait: float = AI_BATCH_MAX_WAIT_MS / 1000.0, enabled: bool = AI_BATCH_CLASSIFICATION):
+        self.enabled = enabled
+        self.max_pages = max(1, max_pages)
+        self.max_wait = max_wait
+        self.size = float(min(max(1, start_pages), self.max_pages))
+        self.agreement = 1.0
+        self.stats = {"requests": 0, "pages": 0, "retried_pages": 0, "audits": 0, "disagreements": 0}
+        self._groups: Dict[tuple, _Group] = {}
+        self._tasks: Set[asyncio.Task] = set()  # in-flight sends; the loop only keeps weak references
+        self._lock = threading.Lock()  # size / agreement / stats are shared by every loop
+
+    async def classify(self, key: tuple, image: str, single: SingleFn, send_batch: BatchFn) -> dict:
+        """
+        Classify one page. ``key`` must identify the organisation and the exact
+        prompt; ``single`` classifies one image, ``send_batch`` several (returning
+        None for any page it has no usable result for).
+        """
+        if not self.enabled:
+            return await single(image)
+
+        loop = asyncio.get_running_loop()
+        group_key = (id(loop), current_ai_context()["lane"]) + tuple(key)
+        group = self._groups.get(group_key)
+        if group is None:
+            group = self._groups[group_key] = _Group(send_batch)
+        future = loop.create_future()
+        group.items.append(_Item(image, future, single))
+
+        if len(group.items) >= int(self.size):
+            self._flush(group_key)
+        elif group.timer is None:
+            group.timer = loop.call_later(self.max_wait, self._flush, group_key)
+        return await future
+
+    def _flush(self, group_key: tuple):
+        group = self._groups.pop(group_key, None)
+        if group is None:
+            return
+        if group.timer is not None:
+            group.timer.cancel()
+        items = [item for item in group.items if not item.future.done()]
+        if items:
+            self._spawn(self._send(group, items), items[0].context)
+
+    def _spawn(self, coro, context: contextvars.Context) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro, context=context)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result=None, error: BaseException = None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def _run_single(self, item: _Item):
+        try:
+            self._resolve(item.future, await item.single(item.image))
+        except Exception as e:
+            self._resolve(item.future, error=e)
+
+    def _run_alone(self, item: _Item) -> asyncio.Task:
+        """Classify one page on its own, in the context of the document it belongs to."""
+        return self._spawn(self._run_single(item), item.context)
+
+    async def _send(self, group: _Group, items: List[_Item]):
+        if len(items) == 1:
+            await self._run_single(items[0])  # already running in that page's context
+            self._adapt(ok=True, latency=0.0)
+            return
+
+        started = time.monotonic()
+        try:
+            with shared_usage([item.request for item in items]):
+                results = await group.send_batch([item.image for item in items])
+            if len(results) != len(items):
+                results = [None] * len(items)
+        except Exception as e:
+            print(f"[AI] batched classification of {len(items)} pages failed: {e}")
+            results = [None] * len(items)
+        latency = time.monotonic() - started
+
+        retry = []
+        for item, result in zip(items, results):
+            if result is None:
+                retry.append(item)
+            else:
+                self._resolve(item.future, result)
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["pages"] += len(items)
+            self.stats["retried_pages"] += len(retry)
+        self._adapt(ok=not retry, latency=latency)
+
+        if retry:
+            await asyncio.gather(*(self._run_alone(item) for item in retry))
+
+        answered = [(item, result) for item, result in zip(items, results) if result is not None]
+        if answered and random.random() < AI_BATCH_AUDIT_RATE:
+            item, batched = random.choice(answered)
+            await self._spawn(self._audit(item, batched), item.context)
+
+    async def _audit(self, item: _Item, batched: dict):
+        try:
+            alone = await item.single(item.image)
+        except Exception:
+            return
+        agree = str(alone.get("type", "")).strip().upper() == str(batched.get("type", "")).strip().upper()
+        with self._lock:
+            self.stats["audits"] += 1
+            if not agree:
+                self.stats["disagreements"] += 1
+            self.agreement = (1 - _AGREEMENT_ALPHA) * self.agreement + _AGREEMENT_ALPHA * (1.0 if agree else 0.0)
+        if not agree:
+            print(f"[AI] batch audit disagreement: batched={batched.get('type')} single={alone.get('type')} "
+                  f"(agreement {self.agreement:.2f})")
+            self._adapt(ok=True, latency=0.0)  # re-evaluates against the lowered agreement
+
+    def _adapt(self, ok: bool, latency: float):
+        with self._lock:
+            before = int(self.size)
+            if not ok or latency > AI_BATCH_TARGET_SECONDS or self.agreement < AI_BATCH_MIN_AGREEMENT:
+                self.size = max(1.0, self.size / 2)
+            else:
+                self.size = min(float(self.max_pages), self.size + 1)
+            after = int(self.size)
+        if after != before:
+            print(f"[AI] classification batch size {before} → {after} "
+                  f"(ok={ok}, latency={latency:.1f}s, agreement={self.agreement:.2f})")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "batch_size": int(self.size),
+                "agreement": round(self.agreement, 3),
+                **self.stats,
+            }
+
+
+classification_batcher = ClassificationBatcher()
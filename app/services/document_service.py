@@ -2,7 +2,11 @@ from fastapi import UploadFile
 from datetime import datetime
 from typing import List, Optional, Dict, Any, Union
 import asyncio
+import hashlib
 import json
+import os
+import tempfile
+import time
 from io import BytesIO
 from collections import Counter, defaultdict
 from pdfminer.pdfparser import PDFParser
@@ -28,14 +32,27 @@ from ..models.client import Client
 from ..models.document_form_data import DocumentFormData
 from ..services.s3_service import s3_service
 from ..services.websocket_manager import websocket_manager
+from ..services.progress_aggregator import progress_aggregator
+from ..services.analysis_cancellation import analysis_cancellation
 from ..services.webhook_service import webhook_service
-from ..core.database import SessionLocal
+from ..services.job_queue_service import JobQueueService, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from ..services.processing_trace import (
+    DocumentTrace, PHASE_ANALYSIS, PHASE_UPLOAD, current_trace, trace_add, trace_span
+)
+from ..core.database import SessionLocal, session_scope
 from app.models import client
 from app.models import user
 
+# Streaming ingest: uploads are spooled to a private temp file and pushed to S3
+# as a multipart upload, so no request ever holds the whole file in memory.
+STREAMING_UPLOADS = os.getenv("STREAMING_UPLOADS", "true").lower() == "true"
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
 
 class DocumentService:
 
+    _status_ids: Dict[str, int] = {}  # status rows are seeded and never change
+
     @staticmethod
     def get_status_id_by_code(db: Session, code: str) -> int:
         status = db.query(Status).filter(Status.code == code).first()
@@ -43,6 +60,15 @@ class DocumentService:
             return status.id
         return None
 
+    @staticmethod
+    def _cached_status_id(db: Session, code: str) -> Optional[int]:
+        status_id = DocumentService._status_ids.get(code)
+        if status_id is None:
+            status_id = DocumentService.get_status_id_by_code(db, code)
+            if status_id:
+                DocumentService._status_ids[code] = status_id
+        return status_id
+
     @staticmethod
     def _get_user_role_flags(user: User):
         role_names = [r.name for r in user.roles]
@@ -125,29 +151,97 @@ class DocumentService:
 
     @staticmethod
     def get_total_pages(file_bytes: bytes, content_type: str) -> int:
+        return DocumentService.get_total_pages_from_file(BytesIO(file_bytes), content_type)
+
+    @staticmethod
+    def get_total_pages_from_file(fp, content_type: str) -> int:
+        """Count pages from a seekable file object without loading it into memory."""
         try:
             if content_type == "application/pdf":
-                fp = BytesIO(file_bytes)
                 parser = PDFParser(fp)
                 doc = PDFDocument(parser)
                 return sum(1 for _ in PDFPage.create_pages(doc))
 
             if content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
                 from docx import Document as DocxDocument
-                doc = DocxDocument(BytesIO(file_bytes))
+                doc = DocxDocument(fp)
                 return max(1, len(doc.sections))
 
             if content_type in ("image/png", "image/jpeg", "image/jpg"):
                 return 1
 
             if content_type == "image/tiff":
-                img = Image.open(BytesIO(file_bytes))
+                img = Image.open(fp)
                 return getattr(img, "n_frames", 1)
 
         except Exception:
             pass
         return 1
 
+    @staticmethod
+    async def _spool_upload(file: UploadFile) -> dict:
+        """
+        Copy an UploadFile into a private temp file chunk by chunk.
+
+        FastAPI closes the request's own spool once the response is sent, so the
+        background upload needs a copy it owns. Size and SHA-256 are computed while
+        the chunks pass through; the page count is parsed from the temp file.
+        Hashing and disk writes run in a worker thread so a large upload never
+        blocks the event loop.
+        """
+        suffix = os.path.splitext(file.filename or "")[1]
+        tmp = tempfile.NamedTemporaryFile(delete=False, prefix="docucr_upload_", suffix=suffix)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            await file.seek(0)
+            while True:
+                chunk = await file.read(SPOOL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                await asyncio.to_thread(DocumentService._spool_chunk, tmp, digest, chunk)
+            await asyncio.to_thread(tmp.close)
+
+            with open(tmp.name, "rb") as fp:
+                total_pages = await asyncio.to_thread(
+                    DocumentService.get_total_pages_from_file, fp, file.content_type
+                )
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+
+        return {
+            'path': tmp.name,
+            'filename': file.filename,
+            'content_type': file.content_type,
+            'size': size,
+            'sha256': digest.hexdigest(),
+            'total_pages': total_pages,
+        }
+
+    @staticmethod
+    def _spool_chunk(tmp, digest, chunk: bytes):
+        digest.update(chunk)
+        tmp.write(chunk)
+
+    @staticmethod
+    def _read_file_bytes(file_data: dict) -> bytes:
+        if file_data.get('path'):
+            with open(file_data['path'], 'rb') as fp:
+                return fp.read()
+        return file_data['buffer'].getvalue()
+
+    @staticmethod
+    def _discard_spool(file_data: dict):
+        path = file_data.get('path')
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
     @staticmethod
     def build_derived_document_counts(extracted_docs, unverified_docs):
         counts = defaultdict(int)
@@ -211,9 +305,32 @@ class DocumentService:
     async def update_document_status(db: Session, document_id: int, status_code: str,
                                      progress: int = 0, error_message: str = None,
                                      s3_key: str = None, s3_bucket: str = None):
+        # Progress ticks within a status are coalesced in memory (see progress_aggregator);
+        # only status changes, S3 locations and a periodic checkpoint reach the database.
+        is_tick = progress_aggregator.is_live(document_id, status_code) and not (s3_key or s3_bucket)
+        if is_tick:
+            progress_aggregator.report(document_id, status_code, progress, error_message)
+            if not progress_aggregator.persist_due(document_id):
+                return
+            started = time.monotonic()
+            values = {Document.upload_progress: progress}
+            if error_message:
+                values[Document.error_message] = error_message
+            # Conditional on the status, so a checkpoint never undoes a cancel made elsewhere
+            db.query(Document).filter(
+                Document.id == document_id,
+                Document.status_id == DocumentService._cached_status_id(db, status_code)
+            ).update(values, synchronize_session=False)
+            db.commit()
+            trace_add("db_write", time.monotonic() - started)
+            progress_aggregator.checkpointed(document_id)
+            return
+
+        started = time.monotonic()
         document = db.query(Document).filter(Document.id == document_id).first()
         if document:
-            status_id = DocumentService.get_status_id_by_code(db, status_code)
+            user_id = str(document.created_by)  # read before commit expires the instance
+            status_id = DocumentService._cached_status_id(db, status_code)
             if status_id:
                 document.status_id = status_id
             document.upload_progress = progress
@@ -225,11 +342,13 @@ class DocumentService:
                 document.s3_bucket = s3_bucket
 
             db.commit()
+            trace_add("db_write", time.monotonic() - started)
+            progress_aggregator.persisted(document_id, status_code, user_id, progress, error_message)
 
             await websocket_manager.broadcast_document_status(
-                document_id=document.id,
+                document_id=document_id,
                 status=status_code,
-                user_id=str(document.created_by),
+                user_id=user_id,
                 progress=progress,
                 error_message=error_message
             )
@@ -288,11 +407,21 @@ class DocumentService:
             client_id_value = parsed_form_data.get("client_id")
 
         for file in files:
-            content = await file.read()
-            file_size = len(content)
-            buffer = BytesIO(content)
-            total_pages = DocumentService.get_total_pages(content, file.content_type)
-            await file.seek(0)
+            if STREAMING_UPLOADS:
+                file_entry = await DocumentService._spool_upload(file)
+            else:
+                content = await file.read()
+                file_entry = {
+                    'buffer': BytesIO(content),
+                    'filename': file.filename,
+                    'content_type': file.content_type,
+                    'size': len(content),
+                    'sha256': hashlib.sha256(content).hexdigest(),
+                    'total_pages': DocumentService.get_total_pages(content, file.content_type),
+                }
+                await file.seek(0)
+            file_size = file_entry['size']
+            total_pages = file_entry['total_pages']
 
             if isinstance(user, Organisation):
                 created_by = None
@@ -318,7 +447,8 @@ class DocumentService:
                 enable_ai=enable_ai,
                 document_type_id=document_type_id,
                 template_id=template_id,
-                total_pages=total_pages
+                total_pages=total_pages,
+                file_sha256=file_entry['sha256']
             )
             db.add(document)
             db.flush()
@@ -335,11 +465,7 @@ class DocumentService:
                 )
                 db.add(form_data_record)
 
-            file_buffers.append({
-                'buffer': buffer,
-                'filename': file.filename,
-                'content_type': file.content_type
-            })
+            file_buffers.append(file_entry)
 
         db.commit()
 
@@ -363,7 +489,8 @@ class DocumentService:
                                           template_id: str = None):
         try:
             upload_tasks = [
-                DocumentService._process_single_upload_only(doc.id, file_data)
+                DocumentService._traced(doc.id, None, PHASE_UPLOAD,
+                                        DocumentService._process_single_upload_only(doc.id, file_data))
                 for doc, file_data in zip(documents, files_data)
             ]
             results = await asyncio.gather(*upload_tasks, return_exceptions=True)
@@ -376,8 +503,26 @@ class DocumentService:
                     successful_docs.append((documents[i], files_data[i]))
 
             if enable_ai and successful_docs:
+                # Analysis runs on the worker fleet (python -m app.worker); the job row
+                # survives restarts, so a deploy no longer strands documents in AI_QUEUED.
+                priority = PRIORITY_INTERACTIVE if len(documents) == 1 else PRIORITY_BULK
                 db = SessionLocal()
                 try:
+                    for doc, file_data in successful_docs:
+                        JobQueueService.enqueue(
+                            db, "document.analyze",
+                            {
+                                "document_id": doc.id,
+                                "document_type_id": str(document_type_id) if document_type_id else None,
+                                "template_id": str(template_id) if template_id else None,
+                            },
+                            organisation_id=doc.organisation_id,
+                            document_id=doc.id,
+                            priority=priority,
+                            commit=False
+                        )
+                    db.commit()
+
                     for doc, file_data in successful_docs:
                         await DocumentService.update_document_status(
                             db, doc.id, "AI_QUEUED",
@@ -386,13 +531,24 @@ class DocumentService:
                 finally:
                     db.close()
 
-                for doc, file_data in successful_docs:
-                    await DocumentService._process_single_ai_analysis(
-                        doc.id, file_data, document_type_id, template_id
-                    )
-
         except Exception as e:
             print(f"Error in background processing: {e}")
+        finally:
+            for file_data in files_data:
+                DocumentService._discard_spool(file_data)
+
+    @staticmethod
+    async def _traced(document_id: int, organisation_id: Optional[str], phase: str, work):
+        """Await ``work`` with a DocumentTrace active and save its spans afterwards."""
+        trace = DocumentTrace(document_id, organisation_id, phase)
+        try:
+            with trace.activate():
+                return await work
+        except Exception:
+            trace.fail()
+            raise
+        finally:
+            await asyncio.to_thread(trace.save)
 
     @staticmethod
     async def _process_single_upload_only(document_id: int, file_data: dict):
@@ -403,42 +559,47 @@ class DocumentService:
             document = db.query(Document).filter(Document.id == document_id).first()
             if not document:
                 raise Exception("Document not found")
+            trace = current_trace()
+            if trace:
+                trace.organisation_id = str(document.organisation_id) if document.organisation_id else None
+                if document.created_at:
+                    trace.waited(document.created_at)
 
-            file_bytes = file_data['buffer'].getvalue()
-            total_size = len(file_bytes)
+            total_size = file_data.get('size') or 1
             uploaded_bytes = 0
             main_loop = asyncio.get_event_loop()
-            file_data['buffer'].seek(0)
 
             def progress_callback(bytes_amount):
+                # Runs on a boto3 transfer thread, once per chunk — the aggregator throttles what is sent
                 nonlocal uploaded_bytes
                 uploaded_bytes += bytes_amount
                 percentage = min(int((uploaded_bytes / total_size) * 90) + 10, 99)
-                if document and document.created_by:
-                    asyncio.run_coroutine_threadsafe(
-                        websocket_manager.broadcast_document_status(
-                            document_id=document_id,
-                            status="UPLOADING",
-                            user_id=str(document.created_by),
-                            progress=percentage
-                        ),
-                        main_loop
-                    )
+                main_loop.call_soon_threadsafe(progress_aggregator.report, document_id, "UPLOADING", percentage)
 
             safe_filename = "".join(
                 c for c in file_data['filename'] if c.isalnum() or c in ('._-')
             ).strip() or f"doc_{document_id}"
 
             custom_s3_key = f"documents/{document.created_by}/{document_id}_{safe_filename}"
-            s3_buffer = BytesIO(file_bytes)
 
-            s3_key, bucket_name = await s3_service.upload_file(
-                s3_buffer,
-                file_data['filename'],
-                file_data['content_type'],
-                progress_callback=progress_callback,
-                s3_key=custom_s3_key
-            )
+            with trace_span("s3_upload", bytes=file_data.get('size')):
+                if file_data.get('path'):
+                    with open(file_data['path'], 'rb') as fp:
+                        s3_key, bucket_name = await s3_service.upload_stream(
+                            fp,
+                            custom_s3_key,
+                            file_data['content_type'],
+                            progress_callback=progress_callback
+                        )
+                else:
+                    file_data['buffer'].seek(0)
+                    s3_key, bucket_name = await s3_service.upload_file(
+                        file_data['buffer'],
+                        file_data['filename'],
+                        file_data['content_type'],
+                        progress_callback=progress_callback,
+                        s3_key=custom_s3_key
+                    )
 
             await DocumentService.update_document_status(
                 db, document_id, "UPLOADED",
@@ -464,127 +625,141 @@ class DocumentService:
             db.close()
 
     @staticmethod
-    async def _process_single_ai_analysis(document_id: int, file_data: dict,
-                                           document_type_id: str = None,
-                                           template_id: str = None,
-                                           analysis_result=None):
+    async def _download_to_spool(s3_key: str, filename: str, content_type: str) -> dict:
+        suffix = os.path.splitext(filename or "")[1]
+        tmp = tempfile.NamedTemporaryFile(delete=False, prefix="docucr_job_", suffix=suffix)
+        try:
+            await s3_service.download_to_file(s3_key, tmp)
+            tmp.close()
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        return {
+            'path': tmp.name,
+            'filename': filename,
+            'content_type': content_type,
+            'size': os.path.getsize(tmp.name),
+        }
+
+    @staticmethod
+    async def run_analysis_job(payload: dict):
+        """
+        Worker handler for ``document.analyze`` jobs (uploads and reanalysis).
+        Fetches the stored file from S3 and runs the AI analysis. Raises on
+        failure so the job queue can retry / dead-letter the job.
+        """
+        document_id = payload["document_id"]
         db = SessionLocal()
         try:
-            await DocumentService.update_document_status(
-                db, document_id, "ANALYZING",
-                progress=0, error_message="Starting Analysis..."
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document or not document.s3_key:
+                print(f"[AI] document_id={document_id} has no stored file — skipping job")
+                return
+            if document.status and document.status.code == "CANCELLED":
+                return
+            s3_key = document.s3_key
+            filename = document.filename
+            content_type = document.content_type
+            organisation_id = document.organisation_id
+            doc_type_id = payload.get("document_type_id") or (
+                str(document.document_type_id) if document.document_type_id else None
             )
+            template_id = payload.get("template_id") or (
+                str(document.template_id) if document.template_id else None
+            )
+        finally:
+            db.close()
 
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if not document:
-                raise Exception("Document not found")
+        async def download_and_analyze():
+            with trace_span("s3_download"):
+                file_data = await DocumentService._download_to_spool(s3_key, filename, content_type)
+            try:
+                await DocumentService._process_single_ai_analysis(
+                    document_id, file_data, doc_type_id, template_id, raise_errors=True
+                )
+            finally:
+                DocumentService._discard_spool(file_data)
 
-            async def report_ai_progress(msg, pct):
+        await DocumentService._traced(document_id, organisation_id, PHASE_ANALYSIS, download_and_analyze())
+
+    @staticmethod
+    async def on_analysis_job_dead(payload: dict, error: str):
+        """Dead-letter handler: the job ran out of attempts, surface it on the document."""
+        db = SessionLocal()
+        try:
+            await DocumentService.update_document_status(
+                db, payload["document_id"], "AI_FAILED",
+                error_message=f"Analysis failed after retries: {error}"
+            )
+        finally:
+            db.close()
+
+    @staticmethod
+    async def _process_single_ai_analysis(document_id: int, file_data: dict,
+                                           document_type_id: str = None,
+                                           template_id: str = None,
+                                           analysis_result=None,
+                                           raise_errors: bool = False):
+        # No session is held across the run: an analysis spends minutes in model calls,
+        # so every DB touchpoint below is its own short unit of work (session_scope) and
+        # only plain values — never ORM instances — outlive it.
+        try:
+            with session_scope() as db:
                 await DocumentService.update_document_status(
-                    db, document_id, "ANALYZING", progress=pct, error_message=msg
+                    db, document_id, "ANALYZING",
+                    progress=0, error_message="Starting Analysis..."
                 )
 
-            file_bytes = file_data['buffer'].getvalue()
+                document = db.query(Document).filter(Document.id == document_id).first()
+                if not document:
+                    raise Exception("Document not found")
+                organisation_id = document.organisation_id
+                user_id = str(document.created_by)
+                filename = document.filename
+
+            async def report_ai_progress(msg, pct):
+                with session_scope() as db:
+                    await DocumentService.update_document_status(
+                        db, document_id, "ANALYZING", progress=pct, error_message=msg
+                    )
+
+            # Spooled files are rasterized straight from disk; only buffered uploads are read into memory
+            file_path = file_data.get('path')
+            file_bytes = None if file_path else DocumentService._read_file_bytes(file_data)
 
-            from ..models.template import Template
-            from ..models.document_type import DocumentType
             from ..models.extracted_document import ExtractedDocument
             from ..models.unverified_document import UnverifiedDocument
             from ..services.ai_service import AIService
+            from ..services.schema_registry import schema_registry
 
-            active_status = db.query(Status).filter(Status.code == "ACTIVE").first()
-            if not active_status:
-                raise Exception("ACTIVE status not found")
-
-            # Fetch ACTIVE doc types only — inactive types must not appear
-            # in the classifier prompt (they confuse the model with empty descriptions)
-            doc_types = db.query(DocumentType).filter(
-                DocumentType.organisation_id == document.organisation_id,
-                DocumentType.status_id == active_status.id,
-            ).all()
-
-            doc_type_map = {dt.name.strip().upper(): dt for dt in doc_types}
-
-            # ── Build schemas ──────────────────────────────────────────────────
-            # ALL document types for this org are passed to ai_service so the
-            # classifier sees every type the org has defined — not just those
+            # ── Schemas ───────────────────────────────────────────────────────
+            # ALL active document types for this org are passed to ai_service so
+            # the classifier sees every type the org has defined — not just those
             # that happen to have an active template.
             #
             # Two tiers:
             #   WITH active template  → classifier + field extraction → ExtractedDocument
             #   WITHOUT template      → classifier only → saved as UnverifiedDocument
             #                           (staff can review / add a template later)
+            #
+            # Built once per organisation and shared across documents until a
+            # document type or template changes (see schema_registry).
             # ──────────────────────────────────────────────────────────────────
-            templates = db.query(Template).filter(
-                Template.status_id == active_status.id,
-                Template.organisation_id == document.organisation_id
-            ).all()
-
-            template_group = defaultdict(list)
-            for t in templates:
-                template_group[t.document_type_id].append(t)
-
-            schemas = []
-            active_template_map = {}
-
-            for dt in doc_types:
-                normalized_name = dt.name.strip().upper()
-                grouped = template_group.get(dt.id, [])
-                description = (dt.description or "") if hasattr(dt, "description") else ""
-
-                if not grouped:
-                    # No active template — include in classifier but with no fields.
-                    # ai_service will classify pages as this type and save as UnverifiedDocument.
-                    schemas.append({
-                        "type_name":   normalized_name,
-                        "description": description,
-                        "fields":      [],
-                    })
-                    continue
-
-                # Only ONE active template per doc type enforced
-                if len(grouped) > 1:
-                    raise Exception(
-                        f"Multiple ACTIVE templates found for document type '{dt.name}'. "
-                        "Deactivate all but one before re-analysing."
-                    )
+            with trace_span("schemas"), session_scope() as db:
+                snapshot = schema_registry.get(db, organisation_id)
+            if snapshot.error:
+                raise Exception(snapshot.error)
+            schemas = snapshot.schemas
 
-                template_obj = grouped[0]
-                schemas.append({
-                    "type_name":   normalized_name,
-                    "description": description,
-                    "fields":      template_obj.extraction_fields or [],
-                })
-                # Only register in active_template_map if it actually has fields to extract
-                if template_obj.extraction_fields:
-                    active_template_map[normalized_name] = template_obj
-
-            print(f"[AI] document_id={document_id} "
+            print(f"[AI] document_id={document_id} schema_version={snapshot.version} "
                   f"classifier_types={[s['type_name'] for s in schemas]} "
-                  f"extractable={list(active_template_map.keys())}")
+                  f"extractable={list(snapshot.templates.keys())}")
 
             async def check_cancelled():
-                check_db = SessionLocal()
-                try:
-                    current_doc = check_db.query(Document).filter(Document.id == document_id).first()
-                    cancelled_status_id = DocumentService.get_status_id_by_code(check_db, "CANCELLED")
-                    return current_doc and current_doc.status_id == cancelled_status_id
-                finally:
-                    check_db.close()
-
-            # Instantiate per-call so each analysis gets a fresh OpenAI client
-            _ai = AIService()
-            analysis_result = await _ai.analyze_document(
-                file_bytes,
-                file_data['filename'],
-                schemas,
-                db,
-                document.id,
-                progress_callback=report_ai_progress,
-                check_cancelled_callback=check_cancelled
-            )
-
-            findings = analysis_result.get("findings", [])
+                with session_scope() as check_db:
+                    status_id = check_db.query(Document.status_id).filter(Document.id == document_id).scalar()
+                    return status_id is not None and status_id == DocumentService._cached_status_id(check_db, "CANCELLED")
 
             # ─────────────────────────────────────────────────────────────────
             # FIX [8]: normalize_fields — the list branch used item.get("exampleValue")
@@ -620,78 +795,120 @@ class DocumentService:
             # any prior run). Never delete UnverifiedDocuments — AIService already
             # wrote them and deleting them would silently lose that data.
             # ─────────────────────────────────────────────────────────────────
-            db.query(ExtractedDocument).filter(
-                ExtractedDocument.document_id == document.id
-            ).delete()
-            db.commit()
+            with session_scope() as db:
+                db.query(ExtractedDocument).filter(
+                    ExtractedDocument.document_id == document_id
+                ).delete()
 
             excel_rows = []
 
-            for finding in findings:
+            async def persist_finding(finding):
+                """Save one extracted instance as soon as it is ready and push it to the client."""
+                started = time.monotonic()
                 doc_type_raw = finding.get("type", "")
                 doc_type     = doc_type_raw.strip().upper()
                 page_range   = finding.get("page_range")
                 confidence   = finding.get("confidence", 1.0)
 
                 if not doc_type or not page_range:
-                    continue
+                    return
 
                 # findings[].data = {"fields": {fieldName: value}} from AIService
                 raw_fields = finding.get("data", {}).get("fields", {})
                 fields     = normalize_fields(raw_fields)
 
-                doc_type_obj = doc_type_map.get(doc_type)
-                template_obj = active_template_map.get(doc_type)
+                doc_type_id = snapshot.document_type_ids.get(doc_type)
+                template = snapshot.templates.get(doc_type)
 
-                if template_obj:
+                if template:
                     # Whitelist to only template-defined fields
-                    expected_fields = [f["fieldName"] for f in template_obj.extraction_fields]
-                    fields = {ef: fields.get(ef) for ef in expected_fields}
+                    fields = {ef: fields.get(ef) for ef in template["whitelist"]}
 
                     row = {"Document Type": doc_type, "Page Range": page_range}
                     row.update(fields)
                     excel_rows.append(row)
 
-                if doc_type_obj and template_obj:
-                    # Verified: matched both a DocumentType and an active Template
-                    db.add(ExtractedDocument(
-                        document_id=document.id,
-                        document_type_id=doc_type_obj.id,
-                        template_id=template_obj.id,
-                        extracted_data=fields,
-                        page_range=page_range,
-                        confidence=confidence
-                    ))
-                else:
-                    # AIService returned a type it classified but we have no DB template for —
-                    # save as unverified so staff can review (avoids silent data loss)
-                    db.add(UnverifiedDocument(
-                        document_id=document.id,
-                        suspected_type=doc_type_raw,
-                        page_range=page_range,
-                        extracted_data=fields,
-                        status="PENDING"
-                    ))
+                with session_scope() as db:
+                    if doc_type_id and template:
+                        # Verified: matched both a DocumentType and an active Template
+                        db.add(ExtractedDocument(
+                            document_id=document_id,
+                            document_type_id=doc_type_id,
+                            template_id=template["id"],
+                            extracted_data=fields,
+                            page_range=page_range,
+                            confidence=confidence,
+                            ai_metadata={"routing": finding.get("routing")}
+                        ))
+                    else:
+                        # AIService returned a type it classified but we have no DB template for —
+                        # save as unverified so staff can review (avoids silent data loss)
+                        db.add(UnverifiedDocument(
+                            document_id=document_id,
+                            suspected_type=doc_type_raw,
+                            page_range=page_range,
+                            extracted_data=fields,
+                            status="PENDING",
+                            ai_metadata={"routing": finding.get("routing")}
+                        ))
+                trace_add("db_write", time.monotonic() - started)
+
+                await websocket_manager.broadcast_document_finding(
+                    document_id=document_id,
+                    user_id=user_id,
+                    document_type=doc_type,
+                    page_range=page_range,
+                    fields=fields,
+                    verified=bool(doc_type_id and template),
+                    error=finding.get("data", {}).get("_error")
+                )
 
-            db.commit()
+            # Registered so a cancel (from any process) stops in-flight model calls at once;
+            # check_cancelled stays as the fallback if the notification is missed
+            _ai = AIService()
+            analysis_result = await analysis_cancellation.run(document_id, _ai.analyze_document(
+                file_bytes,
+                file_data['filename'],
+                schemas,
+                document_id,
+                progress_callback=report_ai_progress,
+                check_cancelled_callback=check_cancelled,
+                file_path=file_path,
+                finding_callback=persist_finding,
+                schema_snapshot=snapshot
+            ))
+
+            findings = analysis_result.get("findings", [])
+            with session_scope() as db:
+                db.query(Document).filter(Document.id == document_id).update(
+                    {Document.analysis_metadata: analysis_result.get("analysis_metadata")},
+                    synchronize_session=False
+                )
+
+            # Findings were persisted as they completed; keep the report in page order
+            excel_rows.sort(key=lambda r: int(str(r["Page Range"]).split("-")[0]))
 
             # Excel report
             if excel_rows:
-                import pandas as pd
-                import io as _io
-                df = pd.DataFrame(excel_rows)
-                excel_buffer = _io.BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Analysis Report')
-                excel_buffer.seek(0)
-
-                report_s3_key, _ = await s3_service.upload_file(
-                    excel_buffer,
-                    f"analysis_report_{document_id}.xlsx",
-                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-                document.analysis_report_s3_key = report_s3_key
-                db.commit()
+                with trace_span("report", rows=len(excel_rows)):
+                    import pandas as pd
+                    import io as _io
+                    df = pd.DataFrame(excel_rows)
+                    excel_buffer = _io.BytesIO()
+                    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
+                        df.to_excel(writer, index=False, sheet_name='Analysis Report')
+                    excel_buffer.seek(0)
+
+                    report_s3_key, _ = await s3_service.upload_file(
+                        excel_buffer,
+                        f"analysis_report_{document_id}.xlsx",
+                        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    )
+                    with session_scope() as db:
+                        db.query(Document).filter(Document.id == document_id).update(
+                            {Document.analysis_report_s3_key: report_s3_key},
+                            synchronize_session=False
+                        )
 
             # Error check — only flag _error entries as failures
             error_findings = [
@@ -701,29 +918,31 @@ class DocumentService:
 
             if error_findings:
                 first_error = error_findings[0]["data"]["_error"]
-                await DocumentService.update_document_status(
-                    db, document_id, "AI_FAILED",
-                    progress=100,
-                    error_message=f"Partial Analysis Failure: {first_error}"
-                )
+                with session_scope() as db:
+                    await DocumentService.update_document_status(
+                        db, document_id, "AI_FAILED",
+                        progress=100,
+                        error_message=f"Partial Analysis Failure: {first_error}"
+                    )
                 asyncio.create_task(asyncio.to_thread(
                     webhook_service.trigger_webhook_background,
                     "document.failed",
-                    {"document_id": document_id, "filename": document.filename,
+                    {"document_id": document_id, "filename": filename,
                      "error": f"Partial Analysis Failure: {first_error}"},
-                    str(document.created_by),
+                    user_id,
                     SessionLocal
                 ))
             else:
-                await DocumentService.update_document_status(
-                    db, document_id, "COMPLETED",
-                    progress=100, error_message="Analysis Complete"
-                )
+                with session_scope() as db:
+                    await DocumentService.update_document_status(
+                        db, document_id, "COMPLETED",
+                        progress=100, error_message="Analysis Complete"
+                    )
                 asyncio.create_task(asyncio.to_thread(
                     webhook_service.trigger_webhook_background,
                     "document.processed",
-                    {"document_id": document_id, "filename": document.filename, "status": "COMPLETED"},
-                    str(document.created_by),
+                    {"document_id": document_id, "filename": filename, "status": "COMPLETED"},
+                    user_id,
                     SessionLocal
                 ))
 
@@ -731,25 +950,29 @@ class DocumentService:
             import traceback as _tb
             error_str = str(e)
             is_cancelled = "Analysis Cancelled" in error_str
+            trace = current_trace()
+            if trace:
+                trace.fail()
             if not is_cancelled:
                 print(f"[AI] document_id={document_id} FAILED: {error_str}")
                 _tb.print_exc()
 
-            await DocumentService.update_document_status(
-                db, document_id,
-                "CANCELLED" if is_cancelled else "AI_FAILED",
-                error_message="Analysis Cancelled" if is_cancelled else error_str
-            )
+            with session_scope() as db:
+                await DocumentService.update_document_status(
+                    db, document_id,
+                    "CANCELLED" if is_cancelled else "AI_FAILED",
+                    error_message="Analysis Cancelled" if is_cancelled else error_str
+                )
 
-            if not is_cancelled:
                 # ─────────────────────────────────────────────────────────────
                 # FIX [7]: safe None-guard — don't chain .filename / .created_by
                 # on a potentially-None query result
                 # ─────────────────────────────────────────────────────────────
-                failed_doc = db.query(Document).filter(Document.id == document_id).first()
+                failed_doc = db.query(Document.filename, Document.created_by).filter(Document.id == document_id).first()
                 failed_filename  = failed_doc.filename  if failed_doc else "Unknown"
                 failed_author    = str(failed_doc.created_by) if failed_doc and failed_doc.created_by else "Unknown"
 
+            if not is_cancelled:
                 asyncio.create_task(asyncio.to_thread(
                     webhook_service.trigger_webhook_background,
                     "document.failed",
@@ -757,8 +980,9 @@ class DocumentService:
                     failed_author,
                     SessionLocal
                 ))
-        finally:
-            db.close()
+
+                if raise_errors:
+                    raise
 
     # ─────────────────────────────────────────────────────────────────────────
     # Read / list / stats — unchanged from original
@@ -1013,6 +1237,24 @@ class DocumentService:
         )
         return True
 
+    @staticmethod
+    async def confirm_classification(db: Session, document_id: int, user: User):
+        """
+        Staff accept the document's page classification: the pages' layouts (and
+        header keywords) are taught to the organisation's layout index and OCR
+        pre-classifier, so the same forms skip the classifier next time. Unverified
+        instances keep their status and only teach the index once verified.
+        """
+        from .layout_index_service import layout_index_service
+        from .ocr_classifier import ocr_classifier
+
+        document = DocumentService._get_accessible_document(db, document_id, user)
+        if not document:
+            return None
+        confirmed = layout_index_service.confirm_document(db, document)
+        ocr_classifier.invalidate(document.organisation_id)
+        return confirmed
+
     @staticmethod
     async def unarchive_document(db: Session, document_id: int, user: User):
         document = DocumentService._get_accessible_document(db, document_id, user)
@@ -1048,6 +1290,9 @@ class DocumentService:
         await DocumentService.update_document_status(
             db, document_id, "CANCELLED", error_message="Cancelled by user"
         )
+        # Stop the running analysis now instead of at its next status poll
+        if not analysis_cancellation.cancel(document_id):
+            analysis_cancellation.publish(db, document_id)
         return True
 
     @staticmethod
@@ -1057,48 +1302,18 @@ class DocumentService:
             raise Exception("Not allowed")
         if not document.s3_key:
             raise Exception("No file found")
+        JobQueueService.enqueue(
+            db, "document.analyze",
+            {"document_id": document_id, "reason": "reanalysis"},
+            organisation_id=document.organisation_id,
+            document_id=document_id,
+            priority=PRIORITY_INTERACTIVE
+        )
         await DocumentService.update_document_status(
             db, document_id, "AI_QUEUED", progress=0, error_message="Reanalysis queued"
         )
-        asyncio.create_task(
-            DocumentService._perform_reanalysis_background(document_id, user.id)
-        )
         return True
 
-    @staticmethod
-    async def _perform_reanalysis_background(document_id: int, created_by: str):
-        import io as _io
-        db = SessionLocal()
-        try:
-            document = db.query(Document).filter(Document.id == document_id).first()
-            if not document or not document.s3_key:
-                return
-            try:
-                file_bytes = await s3_service.download_file(document.s3_key)
-                file_content = _io.BytesIO(file_bytes)
-            except Exception as e:
-                await DocumentService.update_document_status(
-                    db, document_id, "AI_FAILED",
-                    error_message=f"Failed to retrieve file: {str(e)}"
-                )
-                return
-
-            file_data = {
-                'buffer': file_content,
-                'filename': document.filename,
-                'content_type': document.content_type
-            }
-            doc_type_id = str(document.document_type_id) if document.document_type_id else None
-            template_id = str(document.template_id) if document.template_id else None
-
-            await DocumentService._process_single_ai_analysis(
-                document_id, file_data, doc_type_id, template_id
-            )
-        except Exception as e:
-            print(f"Background re-analysis failed: {e}")
-        finally:
-            db.close()
-
     @staticmethod
     def get_document_stats(db: Session, user):
         base = DocumentService._document_access_query(db, user)
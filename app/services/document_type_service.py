@@ -5,6 +5,7 @@ from fastapi import HTTPException
 
 from app.models.document_type import DocumentType
 from app.models.status import Status
+from app.services.schema_registry import schema_registry
 
 
 class DocumentTypeService:
@@ -132,6 +133,7 @@ class DocumentTypeService:
         self.db.add(doc)
         self.db.commit()
         self.db.refresh(doc)
+        schema_registry.invalidate(org_id)
         return doc
 
     # --------------------------------------------------
@@ -169,6 +171,7 @@ class DocumentTypeService:
         try:
             self.db.commit()
             self.db.refresh(doc)
+            schema_registry.invalidate(doc.organisation_id)
             return doc
         except IntegrityError:
             self.db.rollback()
@@ -189,6 +192,8 @@ class DocumentTypeService:
     def delete(self, document_type_id: str) -> str:
         document_type = self.get_by_id(document_type_id) # Using get_by_id for security check
         name = document_type.name
+        organisation_id = document_type.organisation_id
         self.db.delete(document_type)
         self.db.commit()
+        schema_registry.invalidate(organisation_id)
         return name
\ No newline at end of file
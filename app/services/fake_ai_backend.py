@@ -0,0 +1,270 @@
+"""
+Deterministic local AI backend for load and CI testing (AI_BACKEND=fake).
+
+Answers every chat / responses call without the network:
+
+- The reply is valid against the request's JSON schema (``response_format`` /
+  ``text.format``); JSON mode gets ``{}`` and plain requests a short text.
+- It depends only on the request and AI_FAKE_SEED, so reruns are identical.
+  ``"<one of: A | B | C>"`` hints in the prompt (the classifier's type list)
+  choose the value of that key, arrays of ``index`` items get one item per
+  image (batch classification), and CPT / ICD fields get well-formed codes.
+- Latency is drawn from AI_FAKE_LATENCY plus AI_FAKE_IMAGE_LATENCY_MS per
+  image; AI_FAKE_ERROR_RATE / AI_FAKE_RATE_LIMIT_RATE raise 500s / 429s the
+  way the SDK does, so retries, the circuit breaker and the scheduler behave
+  as they would against the API.
+
+    AI_FAKE_LATENCY=lognormal:800:0.5   # median ms, sigma  (or fixed:200, uniform:100:500)
+
+Throughput and latency of the AI layer under load:
+
+    python -m app.services.fake_ai_backend --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import resource
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import httpx
+from openai import InternalServerError, RateLimitError
+
+from app.services.ai_resilience import estimate_tokens
+
+AI_FAKE_SEED = int(os.getenv("AI_FAKE_SEED", "0"))
+AI_FAKE_LATENCY = os.getenv("AI_FAKE_LATENCY", "lognormal:800:0.5")
+AI_FAKE_IMAGE_LATENCY_MS = float(os.getenv("AI_FAKE_IMAGE_LATENCY_MS", "150"))
+AI_FAKE_ERROR_RATE = float(os.getenv("AI_FAKE_ERROR_RATE", "0"))
+AI_FAKE_RATE_LIMIT_RATE = float(os.getenv("AI_FAKE_RATE_LIMIT_RATE", "0"))
+
+_ONE_OF = re.compile(r'"(\w+)"\s*:\s*"<one of:\s*([^>]*)>"')
+_FAKE_URL = "https://fake-ai.local/v1"
+
+
+def parse_latency(spec: str):
+    """'fixed:MS' | 'uniform:LO:HI' | 'lognormal:MEDIAN:SIGMA' -> rng -> seconds."""
+    kind, *args = (spec or "fixed:0").split(":")
+    values = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Unknown AI_FAKE_LATENCY '{spec}'")
+
+
+def _walk(node, texts: List[str]) -> int:
+    """Collect prompt text; return the number of images."""
+    images = 0
+    if isinstance(node, str):
+        texts.append(node)
+    elif isinstance(node, list):
+        for item in node:
+            images += _walk(item, texts)
+    elif isinstance(node, dict):
+        if node.get("type") in ("image_url", "input_image"):
+            # Different pages get different answers; the image itself only counts by its hash
+            texts.append(hashlib.sha256(json.dumps(node, sort_keys=True).encode("utf-8")).hexdigest())
+            return 1
+        for key in ("content", "text"):
+            if key in node:
+                images += _walk(node[key], texts)
+    return images
+
+
+def _code(key: str, rng: random.Random) -> Optional[str]:
+    key = key.lower()
+    if "cpt" in key or "procedure" in key:
+        return str(rng.randint(99202, 99215))
+    if "icd" in key or "diagnos" in key:
+        return f"{rng.choice('EIJMRZ')}{rng.randint(10, 99)}.{rng.randint(0, 9)}"
+    return None
+
+
+def fake_instance(schema: dict, rng: random.Random, key: str = "",
+                  choices: Dict[str, List[str]] = None, images: int = 1) -> Any:
+    """A value valid against ``schema`` (the strict-mode subset schema_compiler emits)."""
+    choices = choices or {}
+    types = schema.get("type", "object")
+    if isinstance(types, list):
+        if "null" in types and (len(types) == 1 or rng.random() < 0.3):
+            return None
+        types = next(t for t in types if t != "null")
+
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if types == "object":
+        return {k: fake_instance(v, rng, k, choices, images) for k, v in schema.get("properties", {}).items()}
+    if types == "array":
+        items = schema.get("items", {})
+        if "index" in items.get("properties", {}):
+            values = []
+            for index in range(1, images + 1):
+                value = fake_instance(items, rng, key, choices, images)
+                value["index"] = index
+                values.append(value)
+            return values
+        return [fake_instance(items, rng, key, choices, images) for _ in range(rng.randint(0, 2))]
+    if types == "string":
+        if key in choices:
+            return rng.choice(choices[key])
+        return _code(key, rng) or f"{key or 'value'}-{rng.randrange(16 ** 6):06x}"
+    if types == "integer":
+        return rng.randint(0, 100)
+    if types == "number":
+        return round(rng.uniform(0, 1000), 2)
+    if types == "boolean":
+        return rng.random() < 0.5
+    return None
+
+
+def _status_error(cls, status: int, headers: dict = None):
+    request = httpx.Request("POST", _FAKE_URL)
+    response = httpx.Response(status, request=request, headers=headers or {})
+    return cls(f"fake {status}", response=response, body=None)
+
+
+class FakeBackend:
+    def __init__(self, seed: int = AI_FAKE_SEED, latency: str = AI_FAKE_LATENCY,
+                 image_latency_ms: float = AI_FAKE_IMAGE_LATENCY_MS,
+                 error_rate: float = AI_FAKE_ERROR_RATE, rate_limit_rate: float = AI_FAKE_RATE_LIMIT_RATE):
+        self.seed = seed
+        self.latency = parse_latency(latency)
+        self.image_latency = image_latency_ms / 1000
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._timing = random.Random(seed)  # latency and injected errors vary per call
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.responses = SimpleNamespace(create=self._responses)
+
+    def _answer(self, kwargs: dict, prompt, schema: Optional[dict], json_mode: bool):
+        texts: List[str] = []
+        images = _walk(prompt, texts)
+        digest = hashlib.sha256(json.dumps(
+            [self.seed, kwargs.get("model"), texts, schema, images], sort_keys=True, default=str
+        ).encode("utf-8")).digest()
+        rng = random.Random(digest)
+        if schema is not None:
+            choices = {
+                key: [c.strip() for c in re.split(r"[|,]", options) if c.strip()]
+                for text in texts for key, options in _ONE_OF.findall(text)
+            }
+            content = json.dumps(fake_instance(schema, rng, choices=choices, images=images))
+        elif json_mode:
+            content = "{}"
+        else:
+            content = f"Fake answer {rng.randrange(16 ** 8):08x}."
+        return content, images
+
+    async def _respond(self, kwargs: dict, images: int):
+        self.calls += 1
+        await asyncio.sleep(self.latency(self._timing) + images * self.image_latency)
+        roll = self._timing.random()
+        if roll < self.rate_limit_rate:
+            raise _status_error(RateLimitError, 429, {"retry-after": "1"})
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise _status_error(InternalServerError, 500)
+
+    async def _chat(self, **kwargs):
+        fmt = kwargs.get("response_format") or {}
+        schema = (fmt.get("json_schema") or {}).get("schema") if fmt.get("type") == "json_schema" else None
+        content, images = self._answer(kwargs, kwargs.get("messages"), schema, fmt.get("type") == "json_object")
+        await self._respond(kwargs, images)
+        prompt_tokens = estimate_tokens({"messages": kwargs.get("messages")})
+        completion_tokens = max(1, len(content) // 4)
+        return SimpleNamespace(
+            id=f"fake-{self.calls}",
+            model=kwargs.get("model"),
+            choices=[SimpleNamespace(
+                index=0,
+                finish_reason="stop",
+                message=SimpleNamespace(role="assistant", content=content, refusal=None),
+            )],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
+
+    async def _responses(self, **kwargs):
+        fmt = (kwargs.get("text") or {}).get("format") or {}
+        schema = fmt.get("schema") if fmt.get("type") == "json_schema" else None
+        content, images = self._answer(kwargs, kwargs.get("input"), schema, False)
+        await self._respond(kwargs, images)
+        input_tokens = estimate_tokens({"input": kwargs.get("input")})
+        output_tokens = max(1, len(content) // 4)
+        return SimpleNamespace(
+            id=f"fake-{self.calls}",
+            model=kwargs.get("model"),
+            output=[SimpleNamespace(type="message", content=[SimpleNamespace(type="output_text", text=content)])],
+            output_text=content,
+            usage=SimpleNamespace(
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                total_tokens=input_tokens + output_tokens,
+            ),
+        )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Benchmark
+# ─────────────────────────────────────────────────────────────────────────────
+
+async def _benchmark(requests: int, concurrency: int, images: int):
+    from app.services.ai_resilience import ResilientAIClient
+    from app.services.ai_usage_service import AIUsageRecorder
+    from app.services.schema_compiler import CLASSIFY_PAGE_SCHEMA, response_format
+
+    backend = FakeBackend()
+    client = ResilientAIClient(backend, usage=AIUsageRecorder(enabled=False))
+    gate = asyncio.Semaphore(concurrency)
+    image = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA", "detail": "high"}}
+    latencies, failures = [], 0
+
+    async def one(i: int):
+        nonlocal failures
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": [{"type": "text", "text": f"Classify page {i}"}] + [image] * images}],
+                    response_format=response_format("page_classification", CLASSIFY_PAGE_SCHEMA),
+                    max_tokens=200,
+                )
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    print(f"requests={requests} concurrency={concurrency} images/request={images}")
+    print(f"  throughput  {requests / elapsed:8.1f} req/s  ({elapsed:.1f}s)")
+    print(f"  latency ms  p50={pct(0.50):.0f}  p95={pct(0.95):.0f}  p99={pct(0.99):.0f}")
+    print(f"  backend calls {backend.calls} (retries {backend.calls - requests}), failed {failures}")
+    print(f"  breaker {client.breaker.state}, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the AI client layer against the fake backend")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--images", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(_benchmark(args.requests, args.concurrency, args.images))
@@ -0,0 +1,135 @@
+"""
+Template field regions.
+
+Many templates keep their fields in the same place on every document — the
+patient header at the top of the front page, the ICD grid on the back page.
+A template may store those places in ``Template.field_regions``:
+
+    [{"name": "patient_header", "page": "first", "box": [0.0, 0.0, 1.0, 0.22],
+      "fields": ["patient_name", "date_of_birth"]},
+     {"name": "icd_grid", "page": "last", "box": [0.0, 0.35, 1.0, 0.95],
+      "fields": ["icd_codes"]}]
+
+- ``page`` is "first", "last" or a 1-based page number within the instance,
+- ``box`` is [left, top, right, bottom] as fractions of the whole page as
+  rendered — not of the image sent to the model, whose borders and margins
+  image_preprocess trims differently on every scan. The crop is mapped
+  through the page's recorded frame (``DocumentPages.frame``), so a box lands
+  on the same part of the form on every document,
+- ``fields`` are extraction field names; a field belongs to at most one region.
+
+During extraction each region's fields are read from a crop of that box
+instead of the whole page, and regions run in parallel. Fields outside every
+region keep the usual first/last/any page routing. Pages read from their text
+layer ignore regions.
+"""
+import base64
+import io
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from PIL import Image
+
+from app.services.image_preprocess import FULL_FRAME
+from app.services.schema_compiler import field_name
+
+AI_FIELD_REGIONS = os.getenv("AI_FIELD_REGIONS", "true").lower() == "true"
+AI_REGION_PADDING = float(os.getenv("AI_REGION_PADDING", "0.02"))  # of the page, around every box
+
+PAGE_FIRST = "first"
+PAGE_LAST = "last"
+MIN_BOX_SIDE = 0.02
+
+
+def validate_regions(regions: Optional[List[Dict[str, Any]]],
+                     fields_list: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Check and normalise a template's regions; raises ValueError on bad input."""
+    if not regions:
+        return []
+    if not isinstance(regions, list):
+        raise ValueError("field_regions must be a list")
+    known = {field_name(f) for f in fields_list or []} - {""}
+    claimed = set()
+    normalised = []
+    for i, region in enumerate(regions, 1):
+        if not isinstance(region, dict):
+            raise ValueError(f"field_regions[{i}] must be an object")
+        name = str(region.get("name") or f"region_{i}").strip()
+
+        page = region.get("page", PAGE_FIRST)
+        if isinstance(page, str) and page.strip().isdigit():
+            page = int(page)
+        if not (page in (PAGE_FIRST, PAGE_LAST) or (isinstance(page, int) and not isinstance(page, bool) and page >= 1)):
+            raise ValueError(f"field_regions '{name}': page must be \"first\", \"last\" or a page number")
+
+        box = region.get("box")
+        try:
+            left, top, right, bottom = (float(v) for v in box)
+        except (TypeError, ValueError):
+            raise ValueError(f"field_regions '{name}': box must be [left, top, right, bottom]")
+        if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+            raise ValueError(f"field_regions '{name}': box values must be fractions with left < right and top < bottom")
+        if right - left < MIN_BOX_SIDE or bottom - top < MIN_BOX_SIDE:
+            raise ValueError(f"field_regions '{name}': box is too small")
+
+        fields = region.get("fields")
+        if not isinstance(fields, list) or not fields or not all(isinstance(f, str) and f.strip() for f in fields):
+            raise ValueError(f"field_regions '{name}': fields must be a non-empty list of field names")
+        fields = [f.strip() for f in fields]
+        if known and set(fields) - known:
+            raise ValueError(f"field_regions '{name}': unknown fields {sorted(set(fields) - known)}")
+        if claimed & set(fields):
+            raise ValueError(f"field_regions '{name}': fields {sorted(claimed & set(fields))} are already in another region")
+        claimed.update(fields)
+
+        normalised.append({"name": name, "page": page, "box": [left, top, right, bottom], "fields": fields})
+    return normalised
+
+
+def region_page(region: Dict[str, Any], num_pages: int) -> Optional[int]:
+    """0-based index of the region's page among ``num_pages`` content pages, or None."""
+    page = region.get("page", PAGE_FIRST)
+    if page == PAGE_FIRST:
+        return 0
+    if page == PAGE_LAST:
+        return num_pages - 1
+    if isinstance(page, int) and 1 <= page <= num_pages:
+        return page - 1
+    return None
+
+
+def frame_box(box: List[float], frame: Sequence[float] = FULL_FRAME, padding: float = 0.0) -> tuple:
+    """
+    ``box`` (page fractions, plus ``padding``) as fractions of an image that shows
+    only ``frame`` of the page, clipped to the image.
+    """
+    f_left, f_top, f_right, f_bottom = frame
+    width, height = (f_right - f_left) or 1.0, (f_bottom - f_top) or 1.0
+    left, top, right, bottom = box
+
+    def clip(value: float) -> float:
+        return min(1.0, max(0.0, value))
+
+    return (
+        clip((left - padding - f_left) / width),
+        clip((top - padding - f_top) / height),
+        clip((right + padding - f_left) / width),
+        clip((bottom + padding - f_top) / height),
+    )
+
+
+def crop_region(img_b64: str, box: List[float], quality: int = 85,
+                padding: float = AI_REGION_PADDING, frame: Sequence[float] = FULL_FRAME) -> str:
+    """Base64 JPEG of page-relative ``box`` (plus ``padding``) cut out of a page image showing ``frame``."""
+    image = Image.open(io.BytesIO(base64.b64decode(img_b64)))
+    left, top, right, bottom = frame_box(box, frame, padding)
+    # A box that falls in a trimmed margin keeps at least one pixel, so the call still has an image
+    x0, y0 = min(int(left * image.width), image.width - 1), min(int(top * image.height), image.height - 1)
+    crop = image.crop((
+        x0, y0,
+        max(int(right * image.width), x0 + 1),
+        max(int(bottom * image.height), y0 + 1),
+    ))
+    buf = io.BytesIO()
+    crop.save(buf, format="JPEG", quality=quality, optimize=True)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
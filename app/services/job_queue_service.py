@@ -0,0 +1,194 @@
+import os
+from datetime import timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import Session
+
+from app.models.processing_job import ProcessingJob
+from app.models.document import Document
+from app.models.status import Status
+
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "900"))  # seconds
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_DELAY = int(os.getenv("JOB_RETRY_BASE_DELAY", "30"))  # seconds, doubled per attempt
+UPLOAD_STALE_AFTER_MINUTES = int(os.getenv("UPLOAD_STALE_AFTER_MINUTES", "60"))
+
+PENDING = "PENDING"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+DEAD = "DEAD"
+
+# Single-file uploads and user-triggered reanalysis jump ahead of bulk batches
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BULK = 0
+
+
+class JobQueueService:
+    """
+    Postgres-backed job queue.
+
+    Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED so any number of
+    workers can poll the same table without handing a job out twice. A claim
+    holds a lease (locked_until); a worker that dies simply lets the lease
+    expire and the job becomes claimable again.
+    """
+
+    @staticmethod
+    def enqueue(db: Session, job_type: str, payload: dict,
+                organisation_id: str = None, document_id: int = None,
+                priority: int = 0, max_attempts: int = None,
+                commit: bool = True) -> ProcessingJob:
+        job = ProcessingJob(
+            job_type=job_type,
+            payload=payload or {},
+            status=PENDING,
+            priority=priority,
+            max_attempts=max_attempts or JOB_MAX_ATTEMPTS,
+            organisation_id=organisation_id,
+            document_id=document_id,
+        )
+        db.add(job)
+        if commit:
+            db.commit()
+            db.refresh(job)
+        else:
+            db.flush()
+        return job
+
+    @staticmethod
+    def claim(db: Session, worker_id: str, job_types: Optional[List[str]] = None,
+              visibility_timeout: int = JOB_VISIBILITY_TIMEOUT) -> Optional[ProcessingJob]:
+        """
+        Claim the next runnable job, or return None.
+
+        A RUNNING job whose lease expired and has no attempts left is moved to
+        DEAD and returned as-is so the caller can run its dead-letter handling.
+        """
+        query = db.query(ProcessingJob).filter(
+            or_(
+                and_(ProcessingJob.status == PENDING, ProcessingJob.run_after <= func.now()),
+                and_(ProcessingJob.status == RUNNING, ProcessingJob.locked_until < func.now()),
+            )
+        )
+        if job_types:
+            query = query.filter(ProcessingJob.job_type.in_(job_types))
+
+        job = (
+            query.order_by(ProcessingJob.priority.desc(), ProcessingJob.run_after)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if not job:
+            db.commit()
+            return None
+
+        if job.status == RUNNING and job.attempts >= job.max_attempts:
+            job.status = DEAD
+            job.last_error = (
+                f"Lease held by {job.locked_by} expired after {job.attempts} attempt(s); "
+                f"last error: {job.last_error or 'none'}"
+            )
+            job.locked_by = None
+            job.locked_until = None
+            job.finished_at = func.now()
+            db.commit()
+            db.refresh(job)
+            return job
+
+        job.status = RUNNING
+        job.attempts = (job.attempts or 0) + 1
+        job.locked_by = worker_id
+        job.locked_until = func.now() + timedelta(seconds=visibility_timeout)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def heartbeat(db: Session, job_id, worker_id: str,
+                  visibility_timeout: int = JOB_VISIBILITY_TIMEOUT) -> bool:
+        """Extend the lease of a job this worker still owns."""
+        updated = (
+            db.query(ProcessingJob)
+            .filter(
+                ProcessingJob.id == job_id,
+                ProcessingJob.status == RUNNING,
+                ProcessingJob.locked_by == worker_id,
+            )
+            .update(
+                {ProcessingJob.locked_until: func.now() + timedelta(seconds=visibility_timeout)},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return bool(updated)
+
+    @staticmethod
+    def complete(db: Session, job_id):
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if not job:
+            return
+        job.status = SUCCEEDED
+        job.locked_by = None
+        job.locked_until = None
+        job.last_error = None
+        job.finished_at = func.now()
+        db.commit()
+
+    @staticmethod
+    def fail(db: Session, job_id, error: str) -> bool:
+        """
+        Record a failed attempt. Returns True when the job was dead-lettered,
+        False when it was rescheduled with exponential backoff.
+        """
+        job = db.query(ProcessingJob).filter(ProcessingJob.id == job_id).first()
+        if not job:
+            return False
+
+        job.last_error = (error or "")[:4000]
+        job.locked_by = None
+        job.locked_until = None
+
+        if job.attempts >= job.max_attempts:
+            job.status = DEAD
+            job.finished_at = func.now()
+            db.commit()
+            return True
+
+        delay = JOB_RETRY_BASE_DELAY * (2 ** max(job.attempts - 1, 0))
+        job.status = PENDING
+        job.run_after = func.now() + timedelta(seconds=delay)
+        db.commit()
+        return False
+
+    @staticmethod
+    def fail_interrupted_uploads(db: Session,
+                                 older_than_minutes: int = UPLOAD_STALE_AFTER_MINUTES) -> List[int]:
+        """
+        Mark documents whose upload never reached S3 as UPLOAD_FAILED.
+
+        The upload spool lives on the API instance that received the request, so
+        a crash or deploy mid-upload loses the bytes; without this sweep those
+        documents would sit in QUEUED/UPLOADING forever.
+        """
+        stuck_codes = ["QUEUED", "UPLOADING"]
+        failed_status = db.query(Status).filter(Status.code == "UPLOAD_FAILED").first()
+        if not failed_status:
+            return []
+
+        stuck = (
+            db.query(Document)
+            .join(Status, Status.id == Document.status_id)
+            .filter(
+                Status.code.in_(stuck_codes),
+                Document.s3_key.is_(None),
+                Document.updated_at < func.now() - timedelta(minutes=older_than_minutes),
+            )
+            .with_for_update(of=Document, skip_locked=True)
+            .all()
+        )
+        for document in stuck:
+            document.status_id = failed_status.id
+            document.error_message = "Upload interrupted — please upload the file again"
+        db.commit()
+        return [d.id for d in stuck]
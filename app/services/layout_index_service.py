@@ -0,0 +1,337 @@
+"""
+Per-organisation nearest-neighbour index of page layouts.
+
+Most pages an organisation sends are one of a few dozen printed forms
+(superbills, DXA orders, intake sheets). Once staff have confirmed how a
+document was classified, the layout vector of each of its pages
+(``rasterizer.layout_vector``) is labelled with its type and header_restart
+and added to that organisation's index. During classification a page whose
+nearest confirmed layouts are all within AI_LAYOUT_MAX_DISTANCE and agree on
+the label is classified locally; anything ambiguous still goes to the model.
+
+The index lives in memory (one numpy matrix per organisation, cosine distance
+by a single mat-vec) and is kept in step with docucr.layout_fingerprints
+incrementally: each process pulls rows confirmed since its last refresh at most
+every AI_LAYOUT_REFRESH_SECONDS, and confirmations made in this process are
+applied immediately.
+
+Lookup latency at scale:
+
+    python -m app.services.layout_index_service --size 100000
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.database import SessionLocal
+from app.models.layout_fingerprint import LayoutFingerprint
+from app.services.rasterizer import LAYOUT_DIM
+
+AI_LAYOUT_INDEX_ENABLED = os.getenv("AI_LAYOUT_INDEX_ENABLED", "true").lower() == "true"
+AI_LAYOUT_MAX_DISTANCE = float(os.getenv("AI_LAYOUT_MAX_DISTANCE", "0.08"))  # cosine distance
+AI_LAYOUT_NEIGHBOURS = int(os.getenv("AI_LAYOUT_NEIGHBOURS", "5"))
+AI_LAYOUT_MIN_SUPPORT = int(os.getenv("AI_LAYOUT_MIN_SUPPORT", "1"))  # confirmed pages that must agree
+AI_LAYOUT_REFRESH_SECONDS = float(os.getenv("AI_LAYOUT_REFRESH_SECONDS", "60"))
+
+# Neighbours out to this multiple of the threshold must agree, so a page that
+# sits between two similar forms is left to the model.
+AMBIGUITY_FACTOR = 2.0
+
+
+class LayoutIndex:
+    """
+    Growable matrix of unit vectors with one (type, header_restart) label per row.
+
+    ``search`` and ``match`` hold the lock for a full mat-vec over the index, so
+    call them from a worker thread, not the event loop.
+    """
+
+    def __init__(self, dim: int = LAYOUT_DIM, capacity: int = 1024):
+        self.dim = dim
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._labels = np.zeros(capacity, dtype=np.int32)
+        self._label_keys: List[tuple] = []  # label id -> (document_type, header_restart)
+        self._label_ids: Dict[tuple, int] = {}
+        self._slots: Dict[str, int] = {}  # fingerprint row id -> matrix row
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _label_id(self, key: tuple) -> int:
+        label = self._label_ids.get(key)
+        if label is None:
+            label = len(self._label_keys)
+            self._label_keys.append(key)
+            self._label_ids[key] = label
+        return label
+
+    def upsert(self, row_id: str, vector: np.ndarray, document_type: str, header_restart: bool):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            return
+        with self._lock:
+            slot = self._slots.get(row_id)
+            if slot is None:
+                if self._size == len(self._vectors):
+                    grow = len(self._vectors) * 2
+                    self._vectors = np.resize(self._vectors, (grow, self.dim))
+                    self._labels = np.resize(self._labels, grow)
+                slot = self._size
+                self._size += 1
+                self._slots[row_id] = slot
+            self._vectors[slot] = vector
+            self._labels[slot] = self._label_id((document_type, bool(header_restart)))
+
+    def search(self, vector: np.ndarray, k: int = AI_LAYOUT_NEIGHBOURS) -> List[tuple]:
+        """``k`` nearest rows as (distance, document_type, header_restart), closest first."""
+        with self._lock:
+            n = self._size
+            if not n:
+                return []
+            sims = self._vectors[:n] @ np.asarray(vector, dtype=np.float32).reshape(-1)
+            k = min(k, n)
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            return [
+                (float(1.0 - sims[i]),) + self._label_keys[self._labels[i]]
+                for i in top
+            ]
+
+    def match(self, vector: Optional[np.ndarray], valid_types=None,
+              max_distance: float = AI_LAYOUT_MAX_DISTANCE,
+              k: int = AI_LAYOUT_NEIGHBOURS) -> Optional[dict]:
+        """Label for ``vector`` if its confirmed neighbours agree on one, else None."""
+        if vector is None:
+            return None
+        hits = self.search(vector, k)
+        if not hits or hits[0][0] > max_distance:
+            return None
+        band = [h for h in hits if h[0] <= max_distance * AMBIGUITY_FACTOR]
+        labels = {(h[1], h[2]) for h in band}
+        if len(labels) != 1 or len(band) < AI_LAYOUT_MIN_SUPPORT:
+            return None
+        document_type, header_restart = labels.pop()
+        if valid_types is not None and document_type not in valid_types:
+            return None  # type was since renamed or deactivated
+        return {
+            "type": document_type,
+            "header_restart": header_restart,
+            "distance": hits[0][0],
+            "support": len(band),
+        }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# DB helpers (run in a thread — the ORM session is synchronous)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _load_confirmed(organisation_id: str, since: Optional[datetime]) -> List[tuple]:
+    db = SessionLocal()
+    try:
+        query = db.query(
+            LayoutFingerprint.id, LayoutFingerprint.vector,
+            LayoutFingerprint.document_type, LayoutFingerprint.header_restart,
+            LayoutFingerprint.confirmed_at,
+        ).filter(
+            LayoutFingerprint.organisation_id == organisation_id,
+            LayoutFingerprint.confirmed_at.isnot(None),
+            LayoutFingerprint.document_type.isnot(None),
+        )
+        if since is not None:
+            query = query.filter(LayoutFingerprint.confirmed_at >= since)
+        return query.order_by(LayoutFingerprint.confirmed_at).all()
+    finally:
+        db.close()
+
+
+def _store_pages(organisation_id: str, document_id: int, layouts: Dict[int, np.ndarray],
+                 headers: Dict[int, str]):
+    db = SessionLocal()
+    try:
+        stmt = insert(LayoutFingerprint).values([
+            {
+                "organisation_id": organisation_id,
+                "document_id": document_id,
+                "page_number": page_no,
+                "vector": np.asarray(vector, dtype=np.float32).tobytes(),
+                "header_text": headers.get(page_no),
+            }
+            for page_no, vector in sorted(layouts.items())
+        ])
+        # Re-analysis refreshes the vector but keeps any confirmed label
+        db.execute(stmt.on_conflict_do_update(
+            constraint="uq_layout_fingerprints_document_page",
+            set_={
+                "vector": stmt.excluded.vector,
+                "header_text": func.coalesce(stmt.excluded.header_text, LayoutFingerprint.header_text),
+            },
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _page_numbers(page_range: str) -> List[int]:
+    start, _, end = (page_range or "").partition("-")
+    start = int(start)
+    return list(range(start, int(end or start) + 1))
+
+
+class LayoutIndexService:
+    def __init__(self, enabled: bool = AI_LAYOUT_INDEX_ENABLED):
+        self.enabled = enabled
+        self._indexes: Dict[str, LayoutIndex] = {}
+        self._loaded_until: Dict[str, datetime] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self, organisation_id: str) -> LayoutIndex:
+        with self._lock:
+            index = self._indexes.setdefault(organisation_id, LayoutIndex())
+            since = self._loaded_until.get(organisation_id)
+        rows = _load_confirmed(organisation_id, since)
+        for row_id, vector, document_type, header_restart, confirmed_at in rows:
+            index.upsert(str(row_id), np.frombuffer(vector, dtype=np.float32), document_type, header_restart)
+        with self._lock:
+            if rows:
+                self._loaded_until[organisation_id] = rows[-1][4]
+            self._checked_at[organisation_id] = time.monotonic()
+        if rows:
+            print(f"[layout_index] org={organisation_id} +{len(rows)} confirmed page(s), {len(index)} total")
+        return index
+
+    async def for_organisation(self, organisation_id: Optional[str]) -> Optional[LayoutIndex]:
+        """The org's index, pulling in newly confirmed pages if the last refresh is stale."""
+        if not self.enabled or not organisation_id:
+            return None
+        organisation_id = str(organisation_id)
+        with self._lock:
+            index = self._indexes.get(organisation_id)
+            fresh = time.monotonic() - self._checked_at.get(organisation_id, float("-inf")) < AI_LAYOUT_REFRESH_SECONDS
+        if index is not None and fresh:
+            return index
+        try:
+            return await asyncio.to_thread(self._refresh, organisation_id)
+        except Exception as e:
+            print(f"[layout_index] refresh failed for org={organisation_id}: {e}")
+            return index
+
+    async def record_pages(self, organisation_id: Optional[str], document_id: int,
+                           layouts: Dict[int, np.ndarray], headers: Dict[int, str] = None):
+        """
+        Keep this document's page vectors (and header text, see ocr_classifier)
+        so a later confirmation can label them.
+        """
+        if not self.enabled or not organisation_id or not layouts:
+            return
+        try:
+            await asyncio.to_thread(_store_pages, str(organisation_id), document_id, layouts, headers or {})
+        except Exception as e:
+            print(f"[layout_index] could not record pages for document {document_id}: {e}")
+
+    def confirm_document(self, db, document) -> int:
+        """
+        Label the document's recorded pages from its current (staff-reviewed)
+        instances and add them to the index. Returns the number of pages labelled.
+
+        Unverified instances only count once a reviewer has marked them VERIFIED:
+        a PENDING suspected type is still the model's guess, and learning it would
+        let one wrong classification answer every later page of that layout.
+        """
+        from app.models.extracted_document import ExtractedDocument
+        from app.models.unverified_document import UnverifiedDocument
+
+        labels = {}
+        extracted = db.query(ExtractedDocument).filter(ExtractedDocument.document_id == document.id).all()
+        for ed in extracted:
+            if ed.document_type and ed.page_range:
+                pages = _page_numbers(ed.page_range)
+                for page_no in pages:
+                    labels[page_no] = (ed.document_type.name.strip().upper(), page_no == pages[0])
+        unverified = db.query(UnverifiedDocument).filter(
+            UnverifiedDocument.document_id == document.id,
+            UnverifiedDocument.status == "VERIFIED",
+        ).all()
+        for ud in unverified:
+            if ud.suspected_type and ud.page_range:
+                pages = _page_numbers(ud.page_range)
+                for page_no in pages:
+                    labels[page_no] = (ud.suspected_type, page_no == pages[0])
+
+        now = datetime.now(timezone.utc)
+        rows = db.query(LayoutFingerprint).filter(LayoutFingerprint.document_id == document.id).all()
+        confirmed = []
+        for row in rows:
+            label = labels.get(row.page_number)
+            if not label:
+                continue
+            row.document_type, row.header_restart = label
+            row.confirmed_at = now
+            confirmed.append(row)
+        db.commit()
+
+        organisation_id = str(document.organisation_id)
+        with self._lock:
+            index = self._indexes.get(organisation_id)
+        if index is not None:
+            for row in confirmed:
+                index.upsert(str(row.id), np.frombuffer(row.vector, dtype=np.float32),
+                             row.document_type, row.header_restart)
+        return len(confirmed)
+
+
+layout_index_service = LayoutIndexService()
+
+
+def _benchmark(size: int, queries: int, layouts: int):
+    rng = np.random.default_rng(7)
+    centres = rng.normal(size=(layouts, LAYOUT_DIM)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+
+    def sample(n):
+        which = rng.integers(0, layouts, n)
+        v = centres[which] + rng.normal(scale=0.15, size=(n, LAYOUT_DIM)).astype(np.float32) / np.sqrt(LAYOUT_DIM)
+        return which, v / np.linalg.norm(v, axis=1, keepdims=True)
+
+    index = LayoutIndex()
+    which, vectors = sample(size)
+    started = time.perf_counter()
+    for i in range(size):
+        index.upsert(str(i), vectors[i], f"TYPE_{which[i]}", which[i] % 2 == 0)
+    build = time.perf_counter() - started
+
+    which, probes = sample(queries)
+    timings, matched, correct = [], 0, 0
+    for i in range(queries):
+        started = time.perf_counter()
+        hit = index.match(probes[i])
+        timings.append((time.perf_counter() - started) * 1000)
+        if hit:
+            matched += 1
+            correct += hit["type"] == f"TYPE_{which[i]}"
+
+    timings = np.array(timings)
+    print(f"fingerprints={size} dim={LAYOUT_DIM} layouts={layouts} memory={index._vectors.nbytes / 2**20:.0f} MiB")
+    print(f"build: {build:.2f}s ({size / build:,.0f} upserts/s)")
+    print(f"match: p50={np.percentile(timings, 50):.2f}ms p95={np.percentile(timings, 95):.2f}ms "
+          f"p99={np.percentile(timings, 99):.2f}ms over {queries} queries")
+    print(f"matched locally: {matched}/{queries}, correct: {correct}/{matched}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Layout index lookup benchmark")
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--layouts", type=int, default=60)
+    args = parser.parse_args()
+    _benchmark(args.size, args.queries, args.layouts)
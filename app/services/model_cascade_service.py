@@ -0,0 +1,203 @@
+"""
+Per-organisation model cascade.
+
+Every stage (page classification, template extraction, auto-extraction of
+unverified types) runs an ordered list of models, cheapest first. A page or
+instance is re-run on the next model only when the cheaper answer looks
+unreliable:
+
+- low_confidence   — the model itself reported LOW confidence
+- invalid_codes    — a CPT/ICD field holds values the code validators reject
+- missing_required — a field marked ``required`` in the template came back null
+- empty            — auto-extraction found nothing at all
+
+Settings live in ``Organisation.ai_settings["model_cascade"]`` and are merged
+over the defaults below, e.g.:
+
+    {"enabled": true,
+     "models": {"extract": ["gpt-4o-mini", "gpt-4o"]},
+     "escalate_on": ["invalid_codes", "missing_required"]}
+
+Every model call is recorded (see ``routing_record``); findings carry a summary
+in ``ai_metadata["routing"]`` and the document in
+``analysis_metadata["model_routing"]``, so cost and escalation rates can be set
+against review outcomes.
+"""
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from app.core.database import SessionLocal
+from app.models.organisation import Organisation
+
+STAGE_CLASSIFY = "classify"
+STAGE_EXTRACT = "extract"
+STAGE_AUTO_EXTRACT = "auto_extract"
+STAGES = (STAGE_CLASSIFY, STAGE_EXTRACT, STAGE_AUTO_EXTRACT)
+
+REASON_LOW_CONFIDENCE = "low_confidence"
+REASON_INVALID_CODES = "invalid_codes"
+REASON_MISSING_REQUIRED = "missing_required"
+REASON_EMPTY = "empty"
+REASONS = (REASON_LOW_CONFIDENCE, REASON_INVALID_CODES, REASON_MISSING_REQUIRED, REASON_EMPTY)
+
+
+def _models_env(name: str, default: str) -> List[str]:
+    return [m.strip() for m in os.getenv(name, default).split(",") if m.strip()]
+
+
+AI_CASCADE_ENABLED = os.getenv("AI_CASCADE_ENABLED", "true").lower() == "true"
+AI_CASCADE_REFRESH_SECONDS = float(os.getenv("AI_CASCADE_REFRESH_SECONDS", "60"))
+
+# Models used before the cascade existed — what a disabled cascade runs
+LEGACY_MODELS = {
+    STAGE_CLASSIFY: ["gpt-4o-mini"],
+    STAGE_EXTRACT: ["gpt-4o"],
+    STAGE_AUTO_EXTRACT: ["gpt-4o"],
+}
+
+DEFAULT_CASCADE = {
+    "enabled": AI_CASCADE_ENABLED,
+    "models": {
+        STAGE_CLASSIFY: _models_env("AI_CASCADE_CLASSIFY_MODELS", "gpt-4o-mini,gpt-4o"),
+        STAGE_EXTRACT: _models_env("AI_CASCADE_EXTRACT_MODELS", "gpt-4o-mini,gpt-4o"),
+        STAGE_AUTO_EXTRACT: _models_env("AI_CASCADE_AUTO_EXTRACT_MODELS", "gpt-4o-mini,gpt-4o"),
+    },
+    "escalate_on": list(REASONS),
+}
+
+LEGACY_CASCADE = {"enabled": False, "models": LEGACY_MODELS, "escalate_on": []}
+
+
+def validate_cascade(settings: Optional[dict]) -> dict:
+    """Check an organisation's cascade overrides; raises ValueError on bad input."""
+    if settings is None:
+        return {}
+    if not isinstance(settings, dict):
+        raise ValueError("model_cascade must be an object")
+    unknown = set(settings) - {"enabled", "models", "escalate_on"}
+    if unknown:
+        raise ValueError(f"Unknown model_cascade keys: {sorted(unknown)}")
+    if "enabled" in settings and not isinstance(settings["enabled"], bool):
+        raise ValueError("model_cascade.enabled must be true or false")
+    models = settings.get("models", {})
+    if not isinstance(models, dict) or set(models) - set(STAGES):
+        raise ValueError(f"model_cascade.models must map {list(STAGES)} to model lists")
+    for stage, names in models.items():
+        if not isinstance(names, list) or not names or not all(isinstance(m, str) and m.strip() for m in names):
+            raise ValueError(f"model_cascade.models.{stage} must be a non-empty list of model names")
+    escalate_on = settings.get("escalate_on", [])
+    if not isinstance(escalate_on, list) or set(escalate_on) - set(REASONS):
+        raise ValueError(f"model_cascade.escalate_on must be a subset of {list(REASONS)}")
+    return settings
+
+
+def resolve_cascade(settings: Optional[dict]) -> dict:
+    """Effective cascade for an organisation: its overrides merged over the defaults."""
+    try:
+        settings = validate_cascade(settings)
+    except ValueError as e:
+        print(f"[model_cascade] ignoring invalid settings: {e}")
+        settings = {}
+    cascade = copy.deepcopy(DEFAULT_CASCADE)
+    cascade["enabled"] = settings.get("enabled", cascade["enabled"])
+    cascade["models"].update({stage: [m.strip() for m in names] for stage, names in settings.get("models", {}).items()})
+    cascade["escalate_on"] = list(settings.get("escalate_on", cascade["escalate_on"]))
+    if not cascade["enabled"]:
+        return copy.deepcopy(LEGACY_CASCADE)
+    return cascade
+
+
+def routing_record(stage: str, model: str, cached: bool, reasons: List[str],
+                   escalated_to: Optional[str] = None, page_role: str = "") -> dict:
+    """One model call (or cache hit) and whether its answer was accepted."""
+    record = {
+        "stage": stage,
+        "model": model,
+        "cached": cached,
+        "reasons": reasons,
+        "escalated_to": escalated_to,
+    }
+    if page_role:
+        record["page_role"] = page_role
+    return record
+
+
+def summarize_routing(records: List[dict]) -> dict:
+    """Per-model call counts and escalations for a list of routing records."""
+    return {
+        "calls": dict(Counter(r["model"] for r in records if not r["cached"])),
+        "cached_calls": sum(1 for r in records if r["cached"]),
+        "escalations": dict(Counter(
+            reason for r in records if r["escalated_to"] for reason in r["reasons"]
+        )),
+        "escalated": any(r["escalated_to"] for r in records),
+        # the answer that was kept for each page / instance
+        "final_models": dict(Counter(r["model"] for r in records if not r["escalated_to"])),
+    }
+
+
+def _load_settings(organisation_id: str) -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        row = db.query(Organisation.ai_settings).filter(Organisation.id == organisation_id).first()
+        return ((row[0] if row else None) or {}).get("model_cascade")
+    finally:
+        db.close()
+
+
+class ModelCascadeService:
+    def __init__(self, refresh_seconds: float = AI_CASCADE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._cache: Dict[str, tuple] = {}  # organisation_id -> (loaded_at, cascade)
+        self._lock = threading.Lock()
+
+    async def for_organisation(self, organisation_id: Optional[str]) -> dict:
+        """Effective cascade, re-read from the DB at most every AI_CASCADE_REFRESH_SECONDS."""
+        if not organisation_id:
+            return resolve_cascade(None)
+        with self._lock:
+            entry = self._cache.get(organisation_id)
+        if entry and time.monotonic() - entry[0] < self.refresh_seconds:
+            return entry[1]
+        try:
+            cascade = resolve_cascade(await asyncio.to_thread(_load_settings, organisation_id))
+        except Exception as e:
+            print(f"[model_cascade] could not load settings for {organisation_id}: {e}")
+            return entry[1] if entry else resolve_cascade(None)
+        with self._lock:
+            self._cache[organisation_id] = (time.monotonic(), cascade)
+        return cascade
+
+    def invalidate(self, organisation_id: str):
+        with self._lock:
+            self._cache.pop(organisation_id, None)
+
+    @staticmethod
+    def get_settings(db, organisation_id: str) -> dict:
+        org = db.query(Organisation).filter(Organisation.id == organisation_id).first()
+        settings = ((org.ai_settings if org else None) or {}).get("model_cascade")
+        return {"settings": settings or {}, "effective": resolve_cascade(settings)}
+
+    def update_settings(self, db, organisation_id: str, settings: Optional[dict]) -> Optional[dict]:
+        """Replace the organisation's cascade overrides (None resets to defaults)."""
+        validate_cascade(settings)
+        org = db.query(Organisation).filter(Organisation.id == organisation_id).first()
+        if not org:
+            return None
+        ai_settings = dict(org.ai_settings or {})
+        if settings:
+            ai_settings["model_cascade"] = settings
+        else:
+            ai_settings.pop("model_cascade", None)
+        org.ai_settings = ai_settings
+        db.commit()
+        self.invalidate(organisation_id)
+        return self.get_settings(db, organisation_id)
+
+
+model_cascade_service = ModelCascadeService()
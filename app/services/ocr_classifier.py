@@ -0,0 +1,254 @@
+"""
+Local header-OCR pre-classifier.
+
+The top of a page (form title, letterhead, "Page 2 of 3") usually decides both
+its document type and whether it starts a new document. With OCR_PRECLASSIFY
+on, the header strip of every page not already settled by the layout index is
+read by Tesseract in a process pool and matched against keyword signatures:
+
+- built from each DocumentType's name and description, and
+- learned from staff-confirmed pages — the header text is stored on the page's
+  layout_fingerprints row and labelled with it on confirmation (see
+  layout_index_service); words found on most confirmed headers of a type join
+  its signature.
+
+Words are weighted by how few types share them. A page is settled locally when
+its best type scores at least OCR_MIN_SCORE, beats the runner-up by
+OCR_MIN_MARGIN, and its header_restart is decided by an explicit cue (the type's
+title or "Page 1 of 3" → restart, "Page 2 of 3" / "continued" → continuation).
+Patient identifiers are not a cue: continuation pages of most forms repeat the
+patient name, DOB and MRN in their header. Everything else goes to the model as
+before.
+
+While the OpenAI circuit breaker is open the best OCR guess is used even when
+uncertain (confidence LOW), so classification degrades instead of stalling; a
+page without a cue is left undecided and joins the instance before it when the
+type matches (see ai_service.InstanceAssembler).
+Born-digital pages are matched on the top of their text layer; no OCR is run.
+"""
+import asyncio
+import base64
+import io
+import math
+import os
+import re
+import shutil
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from app.core.database import SessionLocal
+from app.models.layout_fingerprint import LayoutFingerprint
+from app.services.ai_cache_service import prompt_hash
+
+OCR_PRECLASSIFY = os.getenv("OCR_PRECLASSIFY", "false").lower() == "true"
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+OCR_HEADER_FRACTION = float(os.getenv("OCR_HEADER_FRACTION", "0.25"))  # top share of the page read
+OCR_MIN_SCORE = float(os.getenv("OCR_MIN_SCORE", "4.0"))
+OCR_MIN_MARGIN = float(os.getenv("OCR_MIN_MARGIN", "0.5"))  # runner-up must score below (1 - margin) × best
+OCR_REFRESH_SECONDS = float(os.getenv("OCR_REFRESH_SECONDS", "300"))
+
+HEADER_LINES = 12  # lines of a text-layer page treated as its header
+LEARNED_MIN_SHARE = 0.5  # a word must appear on this share of a type's confirmed headers
+LEARNED_WEIGHT = 2.0  # confirmed headers outweigh the type description
+TITLE_BONUS = 3.0  # the type's own name written in the header
+LEARNED_MAX_ROWS = 5000
+
+_STOPWORDS = frozenset("""
+a an and any are as at be by for from has have if in into is it its of on or per
+the this that these those to was were with without which who will may must can
+page pages form forms document documents type usually contains includes including
+""".split())
+
+_WORD = re.compile(r"[a-z][a-z0-9]{2,}")
+_CONTINUATION = re.compile(r"\bpage\s*(?:[2-9]|\d{2,})\s*(?:of|/)\s*\d+|\bcontinued\b|\bcont'?d\b", re.I)
+_FIRST_PAGE = re.compile(r"\bpage\s*1\s*(?:of|/)\s*\d+", re.I)
+
+
+def words(text: str) -> List[str]:
+    return [w for w in _WORD.findall((text or "").lower()) if w not in _STOPWORDS]
+
+
+def header_of_text(page_text: str) -> str:
+    """Header of a born-digital page: the first lines of its text layer (in reading order)."""
+    return "\n".join(page_text.splitlines()[:HEADER_LINES])
+
+
+def _ocr_header(img_b64: str, fraction: float) -> str:
+    """Tesseract over the top ``fraction`` of a page image (runs in a worker process)."""
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(base64.b64decode(img_b64)))
+    strip = ImageOps.grayscale(img.crop((0, 0, img.width, max(1, int(img.height * fraction)))))
+    if strip.width < 1600:
+        # Classification renders are small; Tesseract wants ~300 dpi text
+        scale = 1600 / strip.width
+        strip = strip.resize((1600, max(1, int(strip.height * scale))))
+    return pytesseract.image_to_string(strip, config="--psm 6")
+
+
+def _restart_cue(header: str, title: str) -> Optional[bool]:
+    if _CONTINUATION.search(header):
+        return False
+    if _FIRST_PAGE.search(header):
+        return True
+    if title and title in " ".join(words(header)):
+        return True
+    return None
+
+
+class KeywordSignatures:
+    """Weighted keyword signature per document type for one organisation."""
+
+    def __init__(self, document_types: List[Dict[str, str]], learned: Dict[str, List[str]] = None):
+        raw: Dict[str, Dict[str, float]] = {}
+        for dt in document_types:
+            name = dt["name"]
+            terms = {w: 1.0 for w in words(name.replace("_", " ")) + words(dt.get("description"))}
+            headers = (learned or {}).get(name) or []
+            if headers:
+                seen = Counter(w for h in headers for w in set(words(h)))
+                for w, n in seen.items():
+                    share = n / len(headers)
+                    if share >= LEARNED_MIN_SHARE:
+                        terms[w] = max(terms.get(w, 0.0), LEARNED_WEIGHT * share)
+            raw[name] = terms
+
+        # Words shared by many types say little about any of them
+        df = Counter(w for terms in raw.values() for w in terms)
+        n_types = max(1, len(raw))
+        self.signatures = {
+            name: {w: weight * math.log(1 + n_types / df[w]) for w, weight in terms.items()}
+            for name, terms in raw.items()
+        }
+        self.titles = {name: " ".join(words(name.replace("_", " "))) for name in raw}
+
+    def match(self, header: str) -> dict:
+        """Best type for a header, whether it can be settled locally, and why."""
+        header_words = set(words(header))
+        header_joined = " ".join(words(header))
+        scores = []
+        for name, terms in self.signatures.items():
+            hits = sorted(w for w in terms if w in header_words)
+            score = sum(terms[w] for w in hits)
+            if self.titles[name] and self.titles[name] in header_joined:
+                score += TITLE_BONUS
+            scores.append((score, name, hits))
+        scores.sort(key=lambda s: -s[0])
+
+        if not scores or scores[0][0] <= 0:
+            return {"type": None, "score": 0.0, "settled": False, "header_restart": None, "hits": []}
+        best, name, hits = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        header_restart = _restart_cue(header, self.titles[name])
+        settled = (
+            best >= OCR_MIN_SCORE
+            and runner_up <= (1 - OCR_MIN_MARGIN) * best
+            and header_restart is not None
+        )
+        return {
+            "type": name,
+            "score": round(best, 2),
+            "runner_up": round(runner_up, 2),
+            "settled": settled,
+            "header_restart": header_restart,
+            "hits": hits[:8],
+        }
+
+
+def _load_learned(organisation_id: str) -> Dict[str, List[str]]:
+    db = SessionLocal()
+    try:
+        rows = db.query(LayoutFingerprint.document_type, LayoutFingerprint.header_text).filter(
+            LayoutFingerprint.organisation_id == organisation_id,
+            LayoutFingerprint.confirmed_at.isnot(None),
+            LayoutFingerprint.document_type.isnot(None),
+            LayoutFingerprint.header_text.isnot(None),
+        ).order_by(LayoutFingerprint.confirmed_at.desc()).limit(LEARNED_MAX_ROWS).all()
+    finally:
+        db.close()
+    learned = defaultdict(list)
+    for document_type, header_text in rows:
+        learned[document_type].append(header_text)
+    return learned
+
+
+class OcrClassifier:
+    def __init__(self, enabled: bool = OCR_PRECLASSIFY, workers: int = OCR_WORKERS):
+        self.workers = max(1, workers)
+        self._enabled = enabled
+        self._available: Optional[bool] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._learned: Dict[str, tuple] = {}  # organisation_id -> (loaded_at, {type: [header, ...]})
+        self._signatures: Dict[tuple, KeywordSignatures] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        if not self._enabled:
+            return False
+        if self._available is None:
+            self._available = shutil.which("tesseract") is not None
+            if not self._available:
+                print("[ocr_classifier] OCR_PRECLASSIFY is on but tesseract is not installed — disabled")
+        return self._available
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    async def header_text(self, img_b64: str) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor(), _ocr_header, img_b64, OCR_HEADER_FRACTION)
+
+    async def for_organisation(self, organisation_id: Optional[str],
+                               document_types: List[Dict[str, str]]) -> Optional[KeywordSignatures]:
+        """The org's signatures, picking up newly confirmed headers every OCR_REFRESH_SECONDS."""
+        if not self.enabled:
+            return None
+        organisation_id = str(organisation_id) if organisation_id else ""
+        with self._lock:
+            entry = self._learned.get(organisation_id)
+        if organisation_id and (entry is None or time.monotonic() - entry[0] >= OCR_REFRESH_SECONDS):
+            try:
+                learned = await asyncio.to_thread(_load_learned, organisation_id)
+            except Exception as e:
+                print(f"[ocr_classifier] could not load confirmed headers for org={organisation_id}: {e}")
+                learned = entry[1] if entry else {}
+            entry = (time.monotonic(), learned)
+            with self._lock:
+                self._learned[organisation_id] = entry
+        learned = entry[1] if entry else {}
+
+        key = (organisation_id, entry[0] if entry else 0.0, prompt_hash(document_types))
+        with self._lock:
+            signatures = self._signatures.get(key)
+        if signatures is None:
+            signatures = KeywordSignatures(document_types, learned)
+            with self._lock:
+                # One live signature set per organisation
+                for stale in [k for k in self._signatures if k[0] == organisation_id]:
+                    del self._signatures[stale]
+                self._signatures[key] = signatures
+        return signatures
+
+    def invalidate(self, organisation_id: Optional[str]):
+        """Reload confirmed headers on the next analysis (after staff confirm a document)."""
+        if organisation_id is None:
+            return
+        with self._lock:
+            self._learned.pop(str(organisation_id), None)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+ocr_classifier = OcrClassifier()
@@ -1,15 +1,28 @@
 import json
-import io
-import base64
 from typing import List, Dict, Any
-from pdf2image import convert_from_bytes
-from PIL import Image
 from openai import OpenAIError
 import re
 
+from app.services.rasterizer import DocumentPages
+from app.services.schema_compiler import extraction_schema, strict_object, text_format
+
 from pydantic import fields
 
 
+_PAGES_SCHEMA = strict_object({
+    "pages": {
+        "type": "array",
+        "items": strict_object({
+            "page_number": {"type": "integer"},
+            "document_type": {"type": "string"},
+            "is_new_document": {"type": "boolean"},
+            "patient_name": {"type": ["string", "null"]},
+            "dob": {"type": ["string", "null"]},
+        }),
+    },
+})
+
+
 class OpenAIDocumentAI:
     MAX_PAGES_PER_REQUEST = 4  # hard limit for stability
 
@@ -19,6 +32,11 @@ class OpenAIDocumentAI:
 
     # ---------- helpers ----------
 
+    async def _create_response(self, **kwargs):
+        if kwargs.get("text") is None:
+            kwargs.pop("text", None)  # no schema — plain text output
+        return await self.client.responses.create(**kwargs)
+
     def _extract_json_from_response(self, response) -> Dict[str, Any]:
         """
         Correctly extract JSON from OpenAI Responses API output objects.
@@ -44,17 +62,10 @@ class OpenAIDocumentAI:
             f"No JSON output found. Full response: {response}"
         )
 
-    def _encode_image(self, image: Image.Image) -> str:
-        if image.mode != "RGB":
-            image = image.convert("RGB")
-
-        buf = io.BytesIO()
-        image.save(buf, format="JPEG", quality=85)
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
-
-    def _pdf_to_images(self, file_bytes: bytes) -> List[str]:
-        pages = convert_from_bytes(file_bytes)
-        return [self._encode_image(p) for p in pages]
+    async def _pdf_to_images(self, file_bytes: bytes) -> List[str]:
+        # Rendered batch by batch in the shared raster pool, off the event loop
+        async with await DocumentPages.from_bytes(file_bytes, "document.pdf") as pages:
+            return [encoded async for _, encoded in pages]
 
     def _chunk(self, items: List[str], size: int):
         for i in range(0, len(items), size):
@@ -143,7 +154,7 @@ class OpenAIDocumentAI:
                     "image_url": f"data:image/jpeg;base64,{img}"
                 })
 
-            response = await self.client.responses.create(
+            response = await self._create_response(
                 model=self.model,
                 input=[
                     {
@@ -155,7 +166,8 @@ class OpenAIDocumentAI:
                         "content": user_content
                     }
                 ],
-                max_output_tokens=800
+                max_output_tokens=800,
+                text=text_format("page_classification", _PAGES_SCHEMA)
             )
 
             chunk_result = self._extract_json_from_response(response)
@@ -213,6 +225,9 @@ class OpenAIDocumentAI:
             [f'"{f["fieldName"]}": null' for f in schema.get("fields", [])]
         )
 
+        fields_schema = extraction_schema(schema.get("fields", []), with_confidence=False)
+        reply_schema = strict_object({"fields": fields_schema}) if fields_schema else None
+
         # 3️⃣ Now build system prompt
         system_prompt = f"""
     You are a structured document data extraction engine.
@@ -258,7 +273,7 @@ class OpenAIDocumentAI:
                 "image_url": f"data:image/jpeg;base64,{img}"
             })
 
-        response = await self.client.responses.create(
+        response = await self._create_response(
             model=self.model,
             input=[
                 {
@@ -270,7 +285,8 @@ class OpenAIDocumentAI:
                     "content": user_content
                 }
             ],
-            max_output_tokens=1000
+            max_output_tokens=1000,
+            text=text_format("field_extraction", reply_schema)
         )
 
         result = self._extract_json_from_response(response)
@@ -286,7 +302,7 @@ class OpenAIDocumentAI:
         if not filename.lower().endswith(".pdf"):
             raise ValueError("Unsupported file type")
 
-        images = self._pdf_to_images(file_bytes)
+        images = await self._pdf_to_images(file_bytes)
 
         final_documents = []
 
@@ -299,7 +315,7 @@ class OpenAIDocumentAI:
             page_number = idx + 1
 
             # Quick lightweight header detection using AI but NOT segmentation
-            response = await self.client.responses.create(
+            response = await self._create_response(
                 model=self.model,
                 input=[
                     {
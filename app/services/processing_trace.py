@@ -0,0 +1,229 @@
+"""
+Stage timings for document processing.
+
+A document's status only says where it is (QUEUED → UPLOADING → AI_QUEUED →
+ANALYZING → COMPLETED), not where its time went. ``DocumentTrace`` collects
+span-style timings for one pass over a document — the upload, or one analysis
+attempt — and writes them to docucr.document_processing_spans in a single
+insert when the pass ends:
+
+    trace = DocumentTrace(document_id, organisation_id, PHASE_ANALYSIS)
+    with trace.activate():
+        with trace.span("s3_download"):
+            ...
+        await ai.analyze_document(...)        # adds rasterize / classify / extract
+    await asyncio.to_thread(trace.save)
+
+Code further down (AIService, update_document_status) reports into whichever
+trace is active through ``trace_span`` / ``trace_add``; both do nothing when
+no trace is active, so the same code runs untraced from scripts and tests.
+
+Two kinds of span are recorded:
+
+- wall-clock spans (``span``) — s3_upload, s3_download, classify, extract, report;
+  classify and extract overlap because extraction is pipelined behind it,
+- accumulated spans (``add``) — rasterize and db_write are many short pieces
+  spread over the run, so their duration is the sum of the pieces.
+
+queue_wait is the time before a pass started: for the upload, since the
+document row was created; for analysis, how long the job waited to be claimed
+(the worker passes it in with ``job_timing``).
+"""
+import contextvars
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, insert
+
+from app.core.database import SessionLocal
+from app.models.document_processing_span import DocumentProcessingSpan
+
+PHASE_UPLOAD = "upload"
+PHASE_ANALYSIS = "analysis"
+
+STAGE_TOTAL = "total"
+STAGE_QUEUE_WAIT = "queue_wait"
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+_current_trace = contextvars.ContextVar("document_trace", default=None)
+_current_job = contextvars.ContextVar("document_trace_job", default=None)
+
+
+@contextmanager
+def job_timing(queue_wait: Optional[float], attempt: int = 1):
+    """Set by the worker around a job: seconds it waited to be claimed, and which attempt this is."""
+    token = _current_job.set({"queue_wait": queue_wait, "attempt": attempt})
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def current_trace() -> Optional["DocumentTrace"]:
+    return _current_trace.get()
+
+
+@contextmanager
+def trace_span(stage: str, **attrs):
+    trace = _current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(stage, **attrs) as span_attrs:
+        yield span_attrs
+
+
+def trace_add(stage: str, seconds: float, **attrs):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds, **attrs)
+
+
+class DocumentTrace:
+    def __init__(self, document_id: int, organisation_id: Optional[str], phase: str):
+        job = _current_job.get() or {}
+        self.document_id = document_id
+        self.organisation_id = str(organisation_id) if organisation_id else None
+        self.phase = phase
+        self.attempt = job.get("attempt") or 1
+        self._started = time.monotonic()
+        self._started_at = datetime.now(timezone.utc)
+        self._spans: List[dict] = []
+        self._accumulated: Dict[str, dict] = defaultdict(lambda: {"seconds": 0.0, "count": 0, "first": None})
+        self._status = STATUS_OK
+        if job.get("queue_wait") is not None and phase == PHASE_ANALYSIS:
+            self.waited(self._started_at - timedelta(seconds=job["queue_wait"]))
+
+    def _row(self, stage: str, started_at: datetime, seconds: float, status: str, attrs: dict) -> dict:
+        return {
+            "document_id": self.document_id,
+            "organisation_id": self.organisation_id,
+            "phase": self.phase,
+            "attempt": self.attempt,
+            "stage": stage,
+            "started_at": started_at,
+            "duration_ms": max(0, int(seconds * 1000)),
+            "status": status,
+            "attrs": attrs or None,
+        }
+
+    @contextmanager
+    def activate(self):
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    @contextmanager
+    def span(self, stage: str, **attrs):
+        started_at = datetime.now(timezone.utc)
+        started = time.monotonic()
+        status = STATUS_OK
+        try:
+            yield attrs  # callers may add attributes while the span is open
+        except BaseException:
+            status = STATUS_ERROR
+            raise
+        finally:
+            self._spans.append(self._row(stage, started_at, time.monotonic() - started, status, attrs))
+
+    def add(self, stage: str, seconds: float, **attrs):
+        entry = self._accumulated[stage]
+        if entry["first"] is None:
+            entry["first"] = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        entry["seconds"] += seconds
+        entry["count"] += 1
+        for key, value in attrs.items():
+            entry[key] = entry.get(key, 0) + value if isinstance(value, (int, float)) else value
+
+    def waited(self, since: datetime):
+        """Record the time between ``since`` (queued / created) and the start of this pass."""
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        seconds = (self._started_at - since).total_seconds()
+        self._spans.append(self._row(STAGE_QUEUE_WAIT, since, max(0.0, seconds), STATUS_OK, {}))
+
+    def fail(self):
+        self._status = STATUS_ERROR
+
+    def rows(self) -> List[dict]:
+        rows = list(self._spans)
+        for stage, entry in self._accumulated.items():
+            attrs = {k: v for k, v in entry.items() if k not in ("seconds", "first")}
+            rows.append(self._row(stage, entry["first"], entry["seconds"], STATUS_OK, attrs))
+        rows.append(self._row(STAGE_TOTAL, self._started_at, time.monotonic() - self._started, self._status, {}))
+        return rows
+
+    def save(self):
+        """Write every span of this pass in one insert. Never raises."""
+        rows = self.rows()
+        db = SessionLocal()
+        try:
+            db.execute(insert(DocumentProcessingSpan), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[processing_trace] could not save {len(rows)} span(s) for document_id={self.document_id}: {e}")
+        finally:
+            db.close()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Queries
+# ─────────────────────────────────────────────────────────────────────────────
+
+def document_spans(db, organisation_id: str, document_id: int) -> List[dict]:
+    rows = db.query(DocumentProcessingSpan).filter(
+        DocumentProcessingSpan.organisation_id == organisation_id,
+        DocumentProcessingSpan.document_id == document_id,
+    ).order_by(DocumentProcessingSpan.created_at, DocumentProcessingSpan.started_at).all()
+    return [
+        {
+            "phase": r.phase,
+            "attempt": r.attempt,
+            "stage": r.stage,
+            "started_at": r.started_at.isoformat() if r.started_at else None,
+            "duration_ms": r.duration_ms,
+            "status": r.status,
+            "attrs": r.attrs or {},
+        }
+        for r in rows
+    ]
+
+
+def stage_percentiles(db, organisation_id: str, days: int = 7) -> dict:
+    """p50 / p95 / p99 duration per stage, overall and per day, for one organisation."""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    span = DocumentProcessingSpan
+    day = func.date(span.created_at)
+    columns = [func.count(span.id)] + [
+        func.percentile_cont(p).within_group(span.duration_ms) for p in PERCENTILES
+    ]
+    base = db.query(span).filter(span.organisation_id == organisation_id, span.created_at >= since)
+
+    def stats(row) -> Dict[str, Any]:
+        count, *values = row
+        return {"count": count, **{
+            f"p{int(p * 100)}_ms": round(float(v)) if v is not None else None for p, v in zip(PERCENTILES, values)
+        }}
+
+    overall = base.with_entities(span.phase, span.stage, *columns).group_by(span.phase, span.stage).all()
+    daily = base.with_entities(day, span.phase, span.stage, *columns).group_by(day, span.phase, span.stage).order_by(day).all()
+
+    by_day: Dict[str, dict] = defaultdict(dict)
+    for row in daily:
+        by_day[row[0].isoformat()][f"{row[1]}.{row[2]}"] = stats(row[3:])
+    return {
+        "organisation_id": organisation_id,
+        "days": days,
+        "stages": {f"{row[0]}.{row[1]}": stats(row[2:]) for row in overall},
+        "daily": [{"date": d, "stages": stages} for d, stages in by_day.items()],
+    }
@@ -0,0 +1,131 @@
+"""
+Coalesced document progress.
+
+Progress used to cost a websocket message per boto3 chunk callback and a
+Document + Status query and a commit per ``report_ai_progress`` tick — with 50
+concurrent uploads that is thousands of messages and commits a second for a
+progress bar. ``ProgressAggregator`` keeps the latest progress of every
+document that is UPLOADING or ANALYZING in memory and:
+
+- sends it over the websocket at most once per PROGRESS_EMIT_INTERVAL per
+  document (the leading tick goes out immediately; the latest of the ticks
+  that follow is sent when the interval is up, so the last value is never lost),
+- says when a same-status tick should be written to the database — at most
+  every PROGRESS_PERSIST_SECONDS, so a page reload still shows roughly where
+  a document is.
+
+Status transitions bypass the throttle: update_document_status persists and
+sends them immediately and tells the aggregator (``persisted``), which drops
+whatever tick was pending. State is dropped once a document leaves the live
+statuses.
+
+Everything runs on the event loop; worker threads (the S3 upload callback)
+hand ticks over with ``loop.call_soon_threadsafe(progress_aggregator.report, ...)``.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Set
+
+from app.services.websocket_manager import websocket_manager
+
+PROGRESS_EMIT_INTERVAL = float(os.getenv("PROGRESS_EMIT_INTERVAL", "0.5"))  # seconds, per document
+PROGRESS_PERSIST_SECONDS = float(os.getenv("PROGRESS_PERSIST_SECONDS", "15"))
+
+LIVE_STATUSES = ("UPLOADING", "ANALYZING")
+
+
+class _Progress:
+    __slots__ = ("status", "progress", "message", "user_id", "emitted_at", "persisted_at", "timer")
+
+    def __init__(self, status: str, user_id: str):
+        self.status = status
+        self.progress = 0
+        self.message = None
+        self.user_id = user_id
+        self.emitted_at = 0.0
+        self.persisted_at = time.monotonic()
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class ProgressAggregator:
+    def __init__(self, emit_interval: float = PROGRESS_EMIT_INTERVAL,
+                 persist_interval: float = PROGRESS_PERSIST_SECONDS):
+        self.emit_interval = emit_interval
+        self.persist_interval = persist_interval
+        self._documents: Dict[int, _Progress] = {}
+        self._tasks: Set[asyncio.Task] = set()  # sends in flight; the loop only holds weak references
+        self.emitted = 0
+        self.coalesced = 0
+
+    def is_live(self, document_id: int, status: str) -> bool:
+        """True if ``status`` is what this process last persisted for the document (a tick, not a transition)."""
+        state = self._documents.get(document_id)
+        return state is not None and state.status == status
+
+    def persist_due(self, document_id: int) -> bool:
+        state = self._documents.get(document_id)
+        return state is None or time.monotonic() - state.persisted_at >= self.persist_interval
+
+    def persisted(self, document_id: int, status: str, user_id: str, progress: int = 0,
+                  message: Optional[str] = None):
+        """
+        update_document_status wrote (and is about to send) this state — a status
+        change or a periodic persist. Drops the pending tick and restarts the throttle.
+        """
+        state = self._documents.get(document_id)
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+        if status not in LIVE_STATUSES:
+            self._documents.pop(document_id, None)
+        else:
+            if state is None or state.status != status:
+                state = self._documents[document_id] = _Progress(status, user_id)
+            state.persisted_at = time.monotonic()
+            state.progress, state.message, state.timer = progress, message, None
+            state.emitted_at = time.monotonic()
+
+    def checkpointed(self, document_id: int):
+        """A same-status tick was written to the database; the next one is due in PROGRESS_PERSIST_SECONDS."""
+        state = self._documents.get(document_id)
+        if state is not None:
+            state.persisted_at = time.monotonic()
+
+    def report(self, document_id: int, status: str, progress: int, message: Optional[str] = None):
+        """A progress tick for a document already in ``status``; throttled per document."""
+        state = self._documents.get(document_id)
+        if state is None or state.status != status:
+            return  # superseded by a transition this tick raced with
+        state.progress = progress
+        if message:
+            state.message = message
+        if state.timer is not None:
+            self.coalesced += 1
+            return
+        wait = state.emitted_at + self.emit_interval - time.monotonic()
+        if wait <= 0:
+            self._emit(document_id)
+        else:
+            state.timer = asyncio.get_running_loop().call_later(wait, self._emit, document_id)
+
+    def _emit(self, document_id: int):
+        state = self._documents.get(document_id)
+        if state is None:
+            return
+        state.timer = None
+        state.emitted_at = time.monotonic()
+        if not state.user_id:
+            return
+        self.emitted += 1
+        task = asyncio.get_running_loop().create_task(websocket_manager.broadcast_document_status(
+            document_id=document_id,
+            status=state.status,
+            user_id=state.user_id,
+            progress=state.progress,
+            error_message=state.message
+        ))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+progress_aggregator = ProgressAggregator()
@@ -0,0 +1,294 @@
+"""
+Page-range PDF rasterizer.
+
+Rather than converting a whole PDF in one convert_from_bytes call and holding
+every page as a PIL image + base64 string, pages are rendered in small
+first_page/last_page batches in a dedicated process pool and kept in a
+bounded LRU window. A 300-page scan then costs roughly
+RASTER_WINDOW_PAGES pages of memory instead of all 300.
+
+    async with await DocumentPages.open(path, filename) as pages:
+        async for page_no, b64 in pages:      # sequential, next batch prefetched
+            ...
+        b64 = await pages.get(17)              # random access (re-rendered if evicted)
+        b64 = await pages.get(17, "extract")   # another image profile (see image_preprocess)
+        pages.fingerprint(17)                  # normalized content hash (see ai_cache_service)
+        pages.layout(17)                       # edge-map layout vector (see layout_index_service)
+        pages.is_blank(17)                     # blank / near-blank (see blank_page)
+        pages.frame(17)                        # part of the page the image shows (see image_preprocess.prepare)
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from app.services.blank_page import page_ink_stats
+from app.services.image_preprocess import FULL_FRAME, render_profiles
+
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+RASTER_BATCH_PAGES = int(os.getenv("RASTER_BATCH_PAGES", "4"))
+RASTER_WINDOW_PAGES = int(os.getenv("RASTER_WINDOW_PAGES", "16"))
+
+# Page fingerprints are taken over a grayscale copy this wide, 16 gray levels
+FINGERPRINT_WIDTH = 512
+
+# Layout vectors: edge map of a LAYOUT_SIZE page, pooled into a LAYOUT_GRID of cells
+LAYOUT_SIZE = (128, 160)  # width, height
+LAYOUT_GRID = (16, 16)
+LAYOUT_DIM = LAYOUT_GRID[0] * LAYOUT_GRID[1]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RASTER_WORKERS)
+        return _pool
+
+
+def encode_page(image: Image.Image, quality: int = 85) -> str:
+    """PIL image -> base64 JPEG for the vision API."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def page_fingerprint(image: Image.Image) -> str:
+    """
+    Hash of the page content that ignores encoding noise: grayscale, fixed
+    width, 4-bit levels. Identical pages rendered or re-encoded separately
+    hash the same; a pen mark still changes the hash.
+    """
+    gray = image.convert("L")
+    height = max(1, round(gray.height * FINGERPRINT_WIDTH / max(gray.width, 1)))
+    small = gray.resize((FINGERPRINT_WIDTH, height), Image.BILINEAR)
+    quantized = small.point(lambda v: v >> 4)
+    digest = hashlib.sha256(f"{small.width}x{small.height}".encode())
+    digest.update(quantized.tobytes())
+    return digest.hexdigest()
+
+
+def layout_vector(image: Image.Image) -> np.ndarray:
+    """
+    Coarse description of where the printed structure sits on the page: edge
+    density (gradient magnitude) pooled into a 16x16 grid, mean-centred and
+    L2-normalised so layouts compare by cosine distance. Handwriting moves it
+    a little; a different form moves it a lot.
+    """
+    small = np.asarray(image.convert("L").resize(LAYOUT_SIZE, Image.BILINEAR), dtype=np.float32) / 255.0
+    edges = np.zeros_like(small)
+    edges[:, 1:] += np.abs(np.diff(small, axis=1))
+    edges[1:, :] += np.abs(np.diff(small, axis=0))
+    cols, rows = LAYOUT_GRID
+    cells = edges.reshape(rows, LAYOUT_SIZE[1] // rows, cols, LAYOUT_SIZE[0] // cols).mean(axis=(1, 3))
+    vector = cells.ravel() - cells.mean()
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm if norm else vector).astype(np.float32)
+
+
+DEFAULT_PROFILE = "default"
+
+
+def _render(image: Image.Image, quality: int, dpi: float,
+            profiles: Optional[Dict[str, dict]]) -> Tuple[Dict[str, str], str, np.ndarray, dict, tuple]:
+    if profiles:
+        encoded, frame = render_profiles(image, profiles, dpi)
+    else:
+        encoded, frame = {DEFAULT_PROFILE: encode_page(image, quality)}, FULL_FRAME
+    return encoded, page_fingerprint(image), layout_vector(image), page_ink_stats(image), frame
+
+
+def _rasterize_range(path: str, is_pdf: bool, first_page: int, last_page: int,
+                     dpi: int, quality: int,
+                     profiles: Optional[Dict[str, dict]] = None) -> List[Tuple[Dict[str, str], str, np.ndarray, dict, tuple]]:
+    """
+    Runs in the raster process pool; only ({profile: base64}, fingerprint,
+    layout, ink stats, frame) tuples cross the process boundary.
+    """
+    if not is_pdf:
+        with Image.open(path) as image:
+            image_dpi = (image.info.get("dpi") or (dpi,))[0] or dpi
+            return [_render(image, quality, image_dpi, profiles)]
+    pages = convert_from_path(path, dpi=dpi, first_page=first_page, last_page=last_page)
+    return [_render(p, quality, dpi, profiles) for p in pages]
+
+
+def _count_pages(path: str, is_pdf: bool) -> int:
+    if not is_pdf:
+        return 1
+    return int(pdfinfo_from_path(path)["Pages"])
+
+
+class DocumentPages:
+    """
+    ``profiles`` (name -> image_preprocess profile) renders every page once per
+    profile; the first one is what ``get`` and iteration return by default.
+    Without profiles pages are plain ``quality`` JPEGs.
+    """
+
+    def __init__(self, path: str, filename: str, dpi: int = 200, quality: int = 85,
+                 batch_pages: int = RASTER_BATCH_PAGES, window_pages: int = RASTER_WINDOW_PAGES,
+                 owns_file: bool = False, profiles: Optional[Dict[str, dict]] = None):
+        self.path = path
+        self.filename = filename
+        self.is_pdf = (filename or path).lower().endswith(".pdf")
+        self.dpi = dpi
+        self.quality = quality
+        self.profiles = dict(profiles) if profiles else None
+        self.default_profile = next(iter(self.profiles)) if self.profiles else DEFAULT_PROFILE
+        self.batch_pages = max(1, batch_pages)
+        self.window_pages = max(self.batch_pages, window_pages)
+        self.total_pages = 0
+        self._owns_file = owns_file
+        self._cache: "OrderedDict[int, Dict[str, str]]" = OrderedDict()
+        self._fingerprints: Dict[int, str] = {}  # kept for every page seen; 64 bytes each
+        self._layouts: Dict[int, np.ndarray] = {}  # likewise; 1 KB each
+        self._ink: Dict[int, dict] = {}  # likewise; blank_page.page_ink_stats
+        self._frames: Dict[int, tuple] = {}  # likewise; image_preprocess.prepare
+        self._inflight = {}
+        self._holders = asyncio.Semaphore(self.window_pages)
+        self.render_seconds = 0.0  # wall time of every batch rendered, re-renders included
+        self.pages_rendered = 0
+
+    @classmethod
+    async def open(cls, path: str, filename: str, **kwargs) -> "DocumentPages":
+        pages = cls(path, filename, **kwargs)
+        pages.total_pages = await asyncio.to_thread(_count_pages, path, pages.is_pdf)
+        return pages
+
+    @classmethod
+    async def from_bytes(cls, file_content: bytes, filename: str, **kwargs) -> "DocumentPages":
+        suffix = os.path.splitext(filename or "")[1]
+        with tempfile.NamedTemporaryFile(delete=False, prefix="docucr_raster_", suffix=suffix) as tmp:
+            tmp.write(file_content)
+        try:
+            return await cls.open(tmp.name, filename, owns_file=True, **kwargs)
+        except Exception:
+            os.remove(tmp.name)
+            raise
+
+    def __len__(self):
+        return self.total_pages
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._cache.clear()
+        if self._owns_file and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def hold(self) -> asyncio.Semaphore:
+        """
+        Bound how many pages callers keep alive at once.
+        Take it before ``get`` and keep it until the page string is no longer needed.
+        """
+        return self._holders
+
+    def _batch_start(self, page_no: int) -> int:
+        return ((page_no - 1) // self.batch_pages) * self.batch_pages + 1
+
+    def fingerprint(self, page_no: int) -> Optional[str]:
+        """Normalized content hash of a page that has already been rendered, else None."""
+        return self._fingerprints.get(page_no)
+
+    def layout(self, page_no: int) -> Optional[np.ndarray]:
+        """Layout vector of a page that has already been rendered, else None."""
+        return self._layouts.get(page_no)
+
+    def layouts(self) -> Dict[int, np.ndarray]:
+        return dict(self._layouts)
+
+    def is_blank(self, page_no: int) -> bool:
+        """True if the (already rendered) page is blank or near-blank."""
+        return bool(self._ink.get(page_no, {}).get("blank"))
+
+    def blank_pages(self) -> List[int]:
+        return sorted(p for p, stats in self._ink.items() if stats.get("blank"))
+
+    def frame(self, page_no: int) -> tuple:
+        """[left, top, right, bottom] of the page the rendered image shows, as page fractions."""
+        return self._frames.get(page_no, FULL_FRAME)
+
+    def _remember(self, page_no: int, encoded: Dict[str, str], fingerprint: str, layout: np.ndarray, ink: dict,
+                  frame: tuple = FULL_FRAME):
+        self._frames[page_no] = frame
+        self._fingerprints[page_no] = fingerprint
+        self._layouts[page_no] = layout
+        self._ink[page_no] = ink
+        self._cache[page_no] = encoded
+        self._cache.move_to_end(page_no)
+        while len(self._cache) > self.window_pages:
+            self._cache.popitem(last=False)
+
+    def _load_batch(self, start: int) -> asyncio.Future:
+        """Render pages [start, start+batch) once, sharing the result with concurrent callers."""
+        task = self._inflight.get(start)
+        if task is None:
+            end = min(start + self.batch_pages - 1, self.total_pages)
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            task = asyncio.ensure_future(loop.run_in_executor(
+                _get_pool(), _rasterize_range,
+                self.path, self.is_pdf, start, end, self.dpi, self.quality, self.profiles
+            ))
+            self._inflight[start] = task
+
+            def _done(t, start=start, started=started):
+                self._inflight.pop(start, None)
+                self.render_seconds += loop.time() - started
+                if not t.cancelled() and t.exception() is None:
+                    self.pages_rendered += len(t.result())
+                    for offset, rendered in enumerate(t.result()):
+                        self._remember(start + offset, *rendered)
+
+            task.add_done_callback(_done)
+        return task
+
+    async def get(self, page_no: int, profile: Optional[str] = None) -> str:
+        if page_no < 1 or page_no > self.total_pages:
+            raise IndexError(f"page {page_no} out of range 1-{self.total_pages}")
+        # Unknown profile names (or pages rendered without profiles) get the default rendering
+        profile = profile if self.profiles and profile in self.profiles else self.default_profile
+        cached = self._cache.get(page_no)
+        if cached is not None:
+            self._cache.move_to_end(page_no)
+            return cached[profile]
+        start = self._batch_start(page_no)
+        batch = await asyncio.shield(self._load_batch(start))
+        return batch[page_no - start][0][profile]
+
+    async def get_range(self, first_page: int, last_page: int, profile: Optional[str] = None) -> List[str]:
+        return [await self.get(p, profile) for p in range(first_page, last_page + 1)]
+
+    async def __aiter__(self):
+        next_batch = self._load_batch(1) if self.total_pages else None
+        start = 1
+        while next_batch is not None:
+            batch = await asyncio.shield(next_batch)
+            following = start + self.batch_pages
+            next_batch = self._load_batch(following) if following <= self.total_pages else None
+            for offset, rendered in enumerate(batch):
+                yield start + offset, rendered[0][self.default_profile]
+            start = following
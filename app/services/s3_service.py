@@ -5,6 +5,10 @@ from botocore.exceptions import ClientError
 import asyncio
 import uuid
 
+# S3 rejects multipart parts under 5 MB (except the last one)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv('S3_MULTIPART_CHUNK_MB', '8')) * 1024 * 1024
+
 class S3Service:
     def __init__(self):
         self.s3_client = boto3.client(
@@ -37,10 +41,89 @@ class S3Service:
             )
             
             return s3_key, self.bucket_name
-            
+
         except ClientError as e:
             raise Exception(f"Failed to upload file to S3: {str(e)}")
-    
+
+    async def upload_stream(self, file_obj: BinaryIO, s3_key: str, content_type: str,
+                            progress_callback=None, chunk_size: int = None) -> tuple[str, str]:
+        """
+        Upload a file object to S3 as a multipart upload, one chunk at a time.
+
+        Only a single part is held in memory, so peak memory stays at
+        ``chunk_size`` regardless of the file size. Files smaller than one
+        part are sent with a plain put_object.
+        """
+        chunk_size = max(chunk_size or S3_MULTIPART_CHUNK_SIZE, S3_MIN_PART_SIZE)
+        loop = asyncio.get_event_loop()
+
+        first = await loop.run_in_executor(None, file_obj.read, chunk_size)
+        try:
+            if len(first) < chunk_size:
+                await loop.run_in_executor(
+                    None,
+                    lambda: self.s3_client.put_object(
+                        Bucket=self.bucket_name, Key=s3_key, Body=first, ContentType=content_type
+                    )
+                )
+                if progress_callback:
+                    progress_callback(len(first))
+                return s3_key, self.bucket_name
+        except ClientError as e:
+            raise Exception(f"Failed to upload file to S3: {str(e)}")
+
+        try:
+            mpu = await loop.run_in_executor(
+                None,
+                lambda: self.s3_client.create_multipart_upload(
+                    Bucket=self.bucket_name, Key=s3_key, ContentType=content_type
+                )
+            )
+        except ClientError as e:
+            raise Exception(f"Failed to upload file to S3: {str(e)}")
+
+        upload_id = mpu["UploadId"]
+        parts = []
+        chunk = first
+        try:
+            while chunk:
+                part_number = len(parts) + 1
+                body = chunk
+                response = await loop.run_in_executor(
+                    None,
+                    lambda: self.s3_client.upload_part(
+                        Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id,
+                        PartNumber=part_number, Body=body
+                    )
+                )
+                parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+                if progress_callback:
+                    progress_callback(len(chunk))
+                chunk = await loop.run_in_executor(None, file_obj.read, chunk_size)
+
+            await loop.run_in_executor(
+                None,
+                lambda: self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id,
+                    MultipartUpload={"Parts": parts}
+                )
+            )
+            return s3_key, self.bucket_name
+
+        except BaseException as e:
+            try:
+                await loop.run_in_executor(
+                    None,
+                    lambda: self.s3_client.abort_multipart_upload(
+                        Bucket=self.bucket_name, Key=s3_key, UploadId=upload_id
+                    )
+                )
+            except Exception:
+                pass
+            if isinstance(e, ClientError):
+                raise Exception(f"Failed to upload file to S3: {str(e)}")
+            raise
+
     async def delete_file(self, s3_key: str) -> bool:
         """Delete file from S3"""
         try:
@@ -65,6 +148,17 @@ class S3Service:
         except ClientError as e:
             raise Exception(f"Failed to download file from S3: {str(e)}")
 
+    async def download_to_file(self, s3_key: str, file_obj: BinaryIO):
+        """Stream an S3 object into a file object without buffering it in memory"""
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                None,
+                lambda: self.s3_client.download_fileobj(self.bucket_name, s3_key, file_obj)
+            )
+        except ClientError as e:
+            raise Exception(f"Failed to download file from S3: {str(e)}")
+
     async def get_file_stream(self, s3_key: str):
         """Get file stream from S3"""
         try:
@@ -0,0 +1,172 @@
+"""
+Strict JSON schemas for model replies.
+
+Compiles a template's ``extraction_fields`` (and the fixed classification /
+auto-extraction reply shapes) into JSON schemas sent as schema-constrained
+``response_format``s, so the model can only answer with the expected keys and
+types: no prose, no truncated objects, no "N/A" in a number field.
+
+Strict mode requires every property to be listed in ``required`` and
+``additionalProperties: false``; optional values are expressed as nullable types.
+Free-form maps (auto-extraction's handwritten fields) are therefore sent as
+``[{label, value}]`` and turned back into a dict by ``from_auto_extract``.
+
+Compiled extraction schemas are cached per template version — the hash of the
+field definitions — so an edited template compiles once and old versions age
+out. Templates strict mode cannot express (too many fields, duplicate names)
+fall back to plain JSON mode.
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.services.ai_cache_service import prompt_hash
+
+AI_STRUCTURED_OUTPUTS = os.getenv("AI_STRUCTURED_OUTPUTS", "true").lower() == "true"
+
+MAX_PROPERTIES = 100  # OpenAI strict-mode limit per schema
+COMPILED_CACHE_SIZE = 512
+
+JSON_OBJECT = {"type": "json_object"}
+
+CONFIDENCE = {"type": "string", "enum": ["HIGH", "MEDIUM", "LOW"]}
+
+_NUMBER_TYPES = {"number", "numeric", "integer", "int", "float", "decimal", "currency", "amount"}
+_BOOLEAN_TYPES = {"boolean", "bool", "checkbox"}
+_LIST_TYPES = {"array", "list", "multiselect", "multi_select"}
+_LIST_NAME_HINTS = ("codes", "diagnos", "medication", "procedure")
+
+
+def field_name(field: Dict[str, Any]) -> str:
+    return field.get("fieldName") or field.get("name") or ""
+
+
+def field_type(field: Dict[str, Any]) -> str:
+    return str(field.get("type") or field.get("fieldType") or "text").strip().lower()
+
+
+def is_list_field(field: Dict[str, Any]) -> bool:
+    """List-valued fields: declared arrays, plus code/diagnosis/medication/procedure fields."""
+    return field_type(field) in _LIST_TYPES or any(kw in field_name(field).lower() for kw in _LIST_NAME_HINTS)
+
+
+def _field_schema(field: Dict[str, Any]) -> dict:
+    ft = field_type(field)
+    if is_list_field(field):
+        schema = {"type": ["array", "null"], "items": {"type": "string"}}
+    elif ft in _NUMBER_TYPES:
+        schema = {"type": ["number", "null"]}
+    elif ft in _BOOLEAN_TYPES:
+        schema = {"type": ["boolean", "null"]}
+    else:
+        schema = {"type": ["string", "null"]}
+    description = (field.get("description") or field.get("label") or "").strip()
+    if ft == "date":
+        description = f"{description} (as written on the page)".strip()
+    if description:
+        schema["description"] = description
+    return schema
+
+
+def strict_object(properties: Dict[str, dict]) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+def response_format(name: str, schema: Optional[dict]) -> dict:
+    """Chat Completions ``response_format`` for ``schema`` (JSON mode when there is none)."""
+    if not AI_STRUCTURED_OUTPUTS or schema is None:
+        return JSON_OBJECT
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+def text_format(name: str, schema: Optional[dict]) -> Optional[dict]:
+    """Responses API ``text`` parameter for ``schema``, or None to leave the default."""
+    if not AI_STRUCTURED_OUTPUTS or schema is None:
+        return None
+    return {"format": {"type": "json_schema", "name": name, "strict": True, "schema": schema}}
+
+
+# ── Fixed reply shapes ─────────────────────────────────────────────────────
+
+_CLASSIFY_PROPERTIES = {
+    "type": {"type": "string"},
+    "confidence": CONFIDENCE,
+    "key_signal": {"type": "string"},
+    "header_restart": {"type": "boolean"},
+}
+
+CLASSIFY_PAGE_SCHEMA = strict_object(_CLASSIFY_PROPERTIES)
+
+CLASSIFY_BATCH_SCHEMA = strict_object({
+    "pages": {
+        "type": "array",
+        "items": strict_object({"index": {"type": "integer"}, **_CLASSIFY_PROPERTIES}),
+    },
+})
+
+AUTO_EXTRACT_SCHEMA = strict_object({
+    "marked_items": {"type": "array", "items": {"type": "string"}},
+    "handwritten_fields": {
+        "type": "array",
+        "items": strict_object({"label": {"type": "string"}, "value": {"type": "string"}}),
+    },
+    "document_summary": {"type": "string"},
+    "_confidence": CONFIDENCE,
+})
+
+
+def from_auto_extract(result: dict) -> dict:
+    """Turn the strict ``handwritten_fields`` list back into the stored ``{label: value}`` map."""
+    fields = result.get("handwritten_fields")
+    if isinstance(fields, list):
+        result["handwritten_fields"] = {
+            item["label"]: item.get("value")
+            for item in fields
+            if isinstance(item, dict) and item.get("label")
+        }
+    return result
+
+
+# ── Template extraction schemas ────────────────────────────────────────────
+
+_compiled: Dict[str, Optional[dict]] = {}
+_lock = threading.Lock()
+
+
+def _compile_fields(fields_list: List[Dict[str, Any]], extra: Dict[str, dict]) -> Optional[dict]:
+    properties = {}
+    for f in fields_list:
+        name = field_name(f)
+        if not name:
+            continue
+        if name in properties or name in extra:
+            print(f"[schema_compiler] duplicate field '{name}' — using JSON mode")
+            return None
+        properties[name] = _field_schema(f)
+    properties.update(extra)
+    if len(properties) > MAX_PROPERTIES:
+        print(f"[schema_compiler] {len(properties)} fields exceed strict-mode limit — using JSON mode")
+        return None
+    return strict_object(properties)
+
+
+def extraction_schema(fields_list: List[Dict[str, Any]], with_confidence: bool = True) -> Optional[dict]:
+    """
+    Strict schema for an extraction reply over ``fields_list``, or None if the
+    fields cannot be expressed in strict mode. Cached per field-definition hash.
+    """
+    version = prompt_hash(fields_list, with_confidence)
+    with _lock:
+        if version in _compiled:
+            return _compiled[version]
+    schema = _compile_fields(fields_list, {"_confidence": CONFIDENCE} if with_confidence else {})
+    with _lock:
+        if len(_compiled) >= COMPILED_CACHE_SIZE:
+            _compiled.clear()
+        _compiled[version] = schema
+    return schema
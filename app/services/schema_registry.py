@@ -0,0 +1,179 @@
+"""
+Per-organisation registry of compiled analysis schemas.
+
+Every analysis needs the organisation's active document types and templates in
+several shapes: the ``schemas`` list handed to AIService, the name → id maps used
+to persist findings, the template field whitelists, the classifier prompt and
+the field regions. A ``SchemaSnapshot`` holds all of them, built once and shared
+by every job in the process until the definitions change. Strict reply schemas
+are not kept here: extraction requests cover per-page subsets of a template's
+fields, which schema_compiler.extraction_schema compiles and caches on demand.
+
+- ``version`` is a hash of the snapshot's content, so two processes that built
+  the same definitions agree on it (it is recorded in analysis_metadata).
+- DocumentTypeService and TemplateService call ``invalidate`` after every write,
+  which takes effect immediately in that process.
+- Other processes (the job workers) notice changes through a stamp — row count
+  and latest ``updated_at`` of both tables for the organisation — checked at most
+  every AI_SCHEMA_REGISTRY_CHECK_SECONDS. A 500-document batch therefore builds
+  its snapshot once and re-checks it with one small query every few seconds.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func
+
+from app.models.document_type import DocumentType
+from app.models.status import Status
+from app.models.template import Template
+from app.services.ai_cache_service import prompt_hash
+from app.services.field_regions import validate_regions
+from app.services.schema_compiler import field_name
+
+AI_SCHEMA_REGISTRY_CHECK_SECONDS = float(os.getenv("AI_SCHEMA_REGISTRY_CHECK_SECONDS", "5"))
+
+
+class SchemaSnapshot:
+    __slots__ = (
+        "organisation_id", "version", "stamp", "checked_at", "error",
+        "schemas", "document_type_ids", "templates", "_derived", "_lock",
+    )
+
+    def __init__(self, organisation_id: str, stamp: tuple, schemas: List[dict],
+                 document_type_ids: Dict[str, Any], templates: Dict[str, dict], error: str = None):
+        self.organisation_id = organisation_id
+        self.stamp = stamp
+        self.checked_at = time.monotonic()
+        self.error = error
+        self.schemas = schemas  # as passed to AIService.analyze_document
+        self.document_type_ids = document_type_ids  # NAME -> DocumentType.id
+        self.templates = templates  # NAME -> {"id", "fields", "whitelist", "regions"}, extractable types only
+        self.version = prompt_hash(schemas)[:16]
+        self._derived: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def classifier_types(self) -> List[Dict[str, str]]:
+        return [{"name": s["type_name"], "description": s["description"]} for s in self.schemas]
+
+    @property
+    def valid_names(self) -> frozenset:
+        return frozenset(self.document_type_ids)
+
+    def derive(self, name: str, build: Callable[[], Any]) -> Any:
+        """Memoize something computed from this snapshot (e.g. the classifier prompt)."""
+        with self._lock:
+            if name in self._derived:
+                return self._derived[name]
+        value = build()
+        with self._lock:
+            return self._derived.setdefault(name, value)
+
+
+def _stamp(db, organisation_id: str) -> tuple:
+    types = db.query(func.count(DocumentType.id), func.max(DocumentType.updated_at)).filter(
+        DocumentType.organisation_id == organisation_id
+    ).one()
+    templates = db.query(func.count(Template.id), func.max(Template.updated_at)).filter(
+        Template.organisation_id == organisation_id
+    ).one()
+    return tuple(types) + tuple(templates)
+
+
+def _build(db, organisation_id: str, stamp: tuple) -> SchemaSnapshot:
+    active_status = db.query(Status).filter(Status.code == "ACTIVE").first()
+    if not active_status:
+        raise Exception("ACTIVE status not found")
+
+    # ACTIVE doc types only — inactive types must not appear in the classifier prompt
+    doc_types = db.query(DocumentType).filter(
+        DocumentType.organisation_id == organisation_id,
+        DocumentType.status_id == active_status.id,
+    ).order_by(DocumentType.name).all()
+
+    template_group = defaultdict(list)
+    for t in db.query(Template).filter(
+        Template.status_id == active_status.id,
+        Template.organisation_id == organisation_id,
+    ).all():
+        template_group[t.document_type_id].append(t)
+
+    schemas, document_type_ids, templates, error = [], {}, {}, None
+    for dt in doc_types:
+        normalized_name = dt.name.strip().upper()
+        document_type_ids[normalized_name] = dt.id
+        grouped = template_group.get(dt.id, [])
+        fields, regions = [], []
+
+        if len(grouped) > 1:
+            # Only ONE active template per doc type is allowed
+            error = (
+                f"Multiple ACTIVE templates found for document type '{dt.name}'. "
+                "Deactivate all but one before re-analysing."
+            )
+        elif grouped:
+            fields = grouped[0].extraction_fields or []
+            try:
+                regions = validate_regions(grouped[0].field_regions, fields)
+            except ValueError as e:
+                # Saved before a field was renamed or removed — extract from whole pages
+                print(f"[schema_registry] ignoring field regions of '{dt.name}': {e}")
+            # Only extractable if the template actually has fields
+            if fields:
+                templates[normalized_name] = {
+                    "id": grouped[0].id,
+                    "fields": fields,
+                    "whitelist": [field_name(f) for f in fields if field_name(f)],
+                    "regions": regions,
+                }
+
+        # Types without an active template are still classified (→ UnverifiedDocument)
+        schemas.append({
+            "type_name": normalized_name,
+            "description": dt.description or "",
+            "fields": fields,
+            "regions": regions,
+        })
+
+    return SchemaSnapshot(organisation_id, stamp, schemas, document_type_ids, templates, error)
+
+
+class SchemaRegistry:
+    def __init__(self, check_seconds: float = AI_SCHEMA_REGISTRY_CHECK_SECONDS):
+        self.check_seconds = check_seconds
+        self._snapshots: Dict[str, SchemaSnapshot] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, db, organisation_id: str) -> SchemaSnapshot:
+        """Current snapshot for the organisation, rebuilt only when its definitions changed."""
+        organisation_id = str(organisation_id)
+        with self._lock:
+            snapshot = self._snapshots.get(organisation_id)
+        if snapshot and time.monotonic() - snapshot.checked_at < self.check_seconds:
+            return snapshot
+
+        stamp = _stamp(db, organisation_id)
+        if snapshot and snapshot.stamp == stamp:
+            snapshot.checked_at = time.monotonic()
+            return snapshot
+
+        snapshot = _build(db, organisation_id, stamp)
+        with self._lock:
+            self._snapshots[organisation_id] = snapshot
+            self.builds += 1
+        print(f"[schema_registry] organisation {organisation_id}: version {snapshot.version} "
+              f"({len(snapshot.schemas)} types, {len(snapshot.templates)} extractable)")
+        return snapshot
+
+    def invalidate(self, organisation_id: Optional[str]):
+        if organisation_id is None:
+            return
+        with self._lock:
+            self._snapshots.pop(str(organisation_id), None)
+
+
+schema_registry = SchemaRegistry()
@@ -4,6 +4,8 @@ from app.models.template import Template
 from app.models.document_type import DocumentType
 from app.models.status import Status
 from app.models.user import User
+from app.services.schema_registry import schema_registry
+from app.services.field_regions import validate_regions
 from fastapi import HTTPException, status
 
 class TemplateService:
@@ -18,6 +20,14 @@ class TemplateService:
             return []
         return [r.name for r in self.current_user.roles]
 
+    @staticmethod
+    def _validated_regions(field_regions: Optional[List[Dict[str, Any]]],
+                           extraction_fields: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+        try:
+            return validate_regions(field_regions, extraction_fields) or None
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     def _get_context_org_id(self) -> Optional[str]:
         if not self.current_user:
             return None
@@ -56,6 +66,7 @@ class TemplateService:
                 "status_id": template.status_id,
                 "statusCode": template.status.code if template.status else "",
                 "extraction_fields": template.extraction_fields,
+                "field_regions": template.field_regions,
                 "created_at": template.created_at,
                 "updated_at": template.updated_at,
                 "document_type": {
@@ -113,7 +124,8 @@ class TemplateService:
     description: Optional[str] = None,
     extraction_fields: Optional[List[Dict[str, Any]]] = None,
     status_id: Optional[str] = None,
-    user_id: Optional[str] = None
+    user_id: Optional[str] = None,
+    field_regions: Optional[List[Dict[str, Any]]] = None
 ) -> Template:
 
         if not self.current_user:
@@ -159,6 +171,8 @@ class TemplateService:
         if not doc_type:
             raise HTTPException(400, "Document type not found")
 
+        field_regions = self._validated_regions(field_regions, extraction_fields)
+
         # -----------------------------
         # If creating ACTIVE → deactivate old one
         # -----------------------------
@@ -181,6 +195,7 @@ class TemplateService:
             document_type_id=document_type_id,
             status_id=status_id_val,
             extraction_fields=extraction_fields or [],
+            field_regions=field_regions,
             created_by=self.current_user.id,
             organisation_id=org_id
         )
@@ -188,6 +203,7 @@ class TemplateService:
         self.db.add(template)
         self.db.commit()
         self.db.refresh(template)
+        schema_registry.invalidate(template.organisation_id)
         return template
 
     def update(
@@ -198,6 +214,7 @@ class TemplateService:
     document_type_id: Optional[str] = None,
     extraction_fields: Optional[List[Dict[str, Any]]] = None,
     status_id: Optional[str] = None,
+    field_regions: Optional[List[Dict[str, Any]]] = None,
 ) -> Template:
 
         template = self.get_by_id(template_id)
@@ -275,8 +292,12 @@ class TemplateService:
         if extraction_fields is not None:
             template.extraction_fields = extraction_fields
 
+        if field_regions is not None:
+            template.field_regions = self._validated_regions(field_regions, template.extraction_fields)
+
         self.db.commit()
         self.db.refresh(template)
+        schema_registry.invalidate(template.organisation_id)
 
         return template
 
@@ -305,6 +326,8 @@ class TemplateService:
         template = self.get_by_id(template_id)
         
         name = template.template_name
+        organisation_id = template.organisation_id
         self.db.delete(template)
         self.db.commit()
+        schema_registry.invalidate(organisation_id)
         return name
\ No newline at end of file
@@ -0,0 +1,172 @@
+"""
+Text-layer pre-pass for born-digital PDFs.
+
+Electronically generated PDFs (lab reports, referral letters, typed forms)
+carry their full text, so classifying and extracting them from an image is
+both slower and more expensive than reading the text. ``TextLayer`` reads
+each page's layout with pdfminer — in chunks, off the event loop, only when a
+page is first asked for — and decides per page whether the text layer can be
+trusted:
+
+- enough text (TEXT_MIN_CHARS), and
+- little of the page covered by embedded images (TEXT_MAX_IMAGE_COVERAGE) —
+  a scan with an OCR layer is one page-sized image, and handwriting or pen
+  marks on it are invisible to the text layer, and
+- the text decodes: almost no ``(cid:N)`` glyphs or control characters, and
+- nothing is drawn on the page that pdfminer can't read: it only sees the
+  content stream, so filled AcroForm fields and annotations (highlights, ink,
+  stamps — anything in /Annots but links) are invisible to it, and neither are
+  vector marks — ticks and circles drawn as free-form curves — legible as text.
+  A filled e-form easily has TEXT_MIN_CHARS of printed labels, so these pages
+  would otherwise pass and extract as nulls.
+
+Pages that fail any test take the image path as before. If none of the first
+chunk's pages has any text the file is treated as a scan and never read again.
+
+Off by default (TEXT_LAYER_ROUTING): turn it on per deployment once its
+documents have been checked against the image path.
+"""
+import asyncio
+import os
+from typing import Dict, Optional
+
+from pdfminer.converter import PDFPageAggregator
+from pdfminer.layout import LAParams, LTCurve, LTFigure, LTImage, LTLine, LTRect, LTTextContainer
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1
+
+TEXT_LAYER_ROUTING = os.getenv("TEXT_LAYER_ROUTING", "false").lower() == "true"
+TEXT_MIN_CHARS = int(os.getenv("TEXT_MIN_CHARS", "200"))
+TEXT_MAX_IMAGE_COVERAGE = float(os.getenv("TEXT_MAX_IMAGE_COVERAGE", "0.35"))
+TEXT_MAX_CHARS = int(os.getenv("TEXT_MAX_CHARS", "8000"))  # per page sent to the model
+
+CHUNK_PAGES = 16
+MIN_DECODED = 0.97  # share of non-space characters that must be real text
+
+# Annotations that carry no content of their own
+_PASSIVE_ANNOTATIONS = {"Link", "Popup"}
+
+
+def _image_area(obj) -> float:
+    if isinstance(obj, LTImage):
+        return max(0.0, obj.width) * max(0.0, obj.height)
+    if isinstance(obj, LTFigure):
+        return sum(_image_area(child) for child in obj)
+    return 0.0
+
+
+def _curves(obj) -> int:
+    """Free-form vector paths (ticks, circles, pen strokes); ruling lines and boxes don't count."""
+    if isinstance(obj, LTCurve):
+        return 0 if isinstance(obj, (LTLine, LTRect)) else 1
+    if isinstance(obj, LTFigure):
+        return sum(_curves(child) for child in obj)
+    return 0
+
+
+def _annotations(page: PDFPage) -> int:
+    """Form widgets and markup annotations on the page."""
+    count = 0
+    for annot in resolve1(page.annots) or []:
+        annot = resolve1(annot)
+        subtype = annot.get("Subtype") if isinstance(annot, dict) else None
+        if getattr(subtype, "name", subtype) not in _PASSIVE_ANNOTATIONS:
+            count += 1
+    return count
+
+
+def _page_layer(layout, annotations: int = 0) -> dict:
+    page_area = max(layout.width * layout.height, 1.0)
+    boxes = [el for el in layout if isinstance(el, LTTextContainer)]
+    # Reading order: top to bottom, then left to right (pdfminer's y grows upwards)
+    boxes.sort(key=lambda b: (-round(b.y1), b.x0))
+    text = "\n".join(t for t in (b.get_text().strip() for b in boxes) if t)
+
+    coverage = min(1.0, sum(_image_area(el) for el in layout) / page_area)
+    glyphs = [c for c in text if not c.isspace()]
+    undecoded = text.count("(cid:") * 6 + sum(1 for c in glyphs if not c.isprintable())
+    decoded = 1.0 - undecoded / len(glyphs) if glyphs else 0.0
+    curves = sum(_curves(el) for el in layout)
+
+    reliable = (
+        len(glyphs) >= TEXT_MIN_CHARS
+        and coverage <= TEXT_MAX_IMAGE_COVERAGE
+        and decoded >= MIN_DECODED
+        and not annotations
+        and not curves
+    )
+    return {
+        "reliable": reliable,
+        "chars": len(glyphs),
+        "boxes": len(boxes),
+        "image_coverage": round(coverage, 3),
+        "annotations": annotations,
+        "curves": curves,
+        "text": text[:TEXT_MAX_CHARS] if reliable else None,
+    }
+
+
+def _read_chunk(path: str, first: int, last: int) -> Dict[int, dict]:
+    """Text layer of pages first..last (1-based, inclusive)."""
+    layers = {}
+    # extract_pages without the wrapper: the PDFPage is needed for its /Annots
+    resources = PDFResourceManager()
+    device = PDFPageAggregator(resources, laparams=LAParams())
+    interpreter = PDFPageInterpreter(resources, device)
+    with open(path, "rb") as fp:
+        pages = PDFPage.get_pages(fp, pagenos=set(range(first - 1, last)))
+        for page_no, page in zip(range(first, last + 1), pages):
+            interpreter.process_page(page)
+            layers[page_no] = _page_layer(device.get_result(), _annotations(page))
+    return layers
+
+
+class TextLayer:
+    def __init__(self, path: str, total_pages: int, chunk_pages: int = CHUNK_PAGES):
+        self.path = path
+        self.total_pages = total_pages
+        self.chunk_pages = max(1, chunk_pages)
+        self.scanned = False  # no text at all in the first chunk — stop reading
+        self._pages: Dict[int, dict] = {}
+        self._chunks: Dict[int, asyncio.Task] = {}
+
+    async def _load(self, chunk: int):
+        first = chunk * self.chunk_pages + 1
+        last = min(self.total_pages, first + self.chunk_pages - 1)
+        try:
+            layers = await asyncio.to_thread(_read_chunk, self.path, first, last)
+        except Exception as e:
+            print(f"[text_layer] pages {first}-{last} unreadable, using images: {e}")
+            layers = {}
+        self._pages.update(layers)
+        if chunk == 0 and not any(layer["chars"] for layer in layers.values()):
+            self.scanned = True
+
+    async def page_text(self, page_no: int) -> Optional[str]:
+        """Trusted text of the page, or None if it must be read from the image."""
+        chunk = (page_no - 1) // self.chunk_pages
+        if chunk and 0 not in self._chunks:
+            self._chunks[0] = asyncio.ensure_future(self._load(0))
+        if chunk and not self._chunks[0].done():
+            await asyncio.shield(self._chunks[0])
+        if self.scanned and chunk:
+            return None
+        if chunk not in self._chunks:
+            self._chunks[chunk] = asyncio.ensure_future(self._load(chunk))
+        await asyncio.shield(self._chunks[chunk])
+        layer = self._pages.get(page_no)
+        return layer["text"] if layer and layer["reliable"] else None
+
+    def summary(self) -> dict:
+        reliable = sorted(p for p, layer in self._pages.items() if layer["reliable"])
+        return {
+            "scanned": self.scanned,
+            "pages_read": len(self._pages),
+            "text_pages": reliable,
+        }
+
+    def close(self):
+        for task in self._chunks.values():
+            if not task.done():
+                task.cancel()
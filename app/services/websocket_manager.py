@@ -1,10 +1,36 @@
+"""
+Per-user websocket connections and the document status / finding messages sent
+to them.
+
+Only API processes hold client sockets. A standalone worker
+(``python -m app.worker``) sets ``relay``: its messages are published with
+Postgres NOTIFY on WS_RELAY_CHANNEL, and every API process runs a listener
+thread (``start_listener``) that delivers them to its own connections. With the
+embedded worker messages are sent directly, as before.
+"""
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Dict, List, Optional
+import asyncio
 import json
+import os
+import select
+import threading
+
+from sqlalchemy import text
+
+from app.core.database import engine
+
+WS_RELAY_CHANNEL = os.getenv("WS_RELAY_CHANNEL", "docucr_ws_relay")
+WS_RELAY_RECONNECT_SECONDS = float(os.getenv("WS_RELAY_RECONNECT_SECONDS", "5"))
+
+_NOTIFY_MAX_BYTES = 7900  # Postgres rejects NOTIFY payloads of 8000 bytes or more
 
 class WebSocketManager:
-    def __init__(self):
+    def __init__(self, channel: str = WS_RELAY_CHANNEL):
         self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.channel = channel
+        self.relay = False  # no local sockets: publish to the API processes instead
+        self._listener: Optional[threading.Event] = None  # stop flag of the running listener thread
     
     async def connect(self, websocket: WebSocket, user_id: str):
         try:
@@ -34,6 +60,12 @@ class WebSocketManager:
                 del self.active_connections[user_id]
     
     async def send_personal_message(self, message: dict, user_id: str):
+        if self.relay:
+            await asyncio.to_thread(self._publish, message, user_id)
+            return
+        await self._send_local(message, user_id)
+
+    async def _send_local(self, message: dict, user_id: str):
         if user_id in self.active_connections:
             # Iterate over a copy to safely remove items
             for connection in self.active_connections[user_id][:]:
@@ -56,4 +88,81 @@ class WebSocketManager:
         }
         await self.send_personal_message(message, user_id)
 
-websocket_manager = WebSocketManager()
\ No newline at end of file
+    async def broadcast_document_finding(self, document_id: int, user_id: str, document_type: str,
+                                         page_range: str, fields: dict, verified: bool = True,
+                                         error: str = None):
+        message = {
+            "type": "document_finding",
+            "document_id": document_id,
+            "document_type": document_type,
+            "page_range": page_range,
+            "fields": fields,
+            "verified": verified,
+            "error": error
+        }
+        await self.send_personal_message(message, user_id)
+
+    # ── Relay between processes ─────────────────────────────────────────────
+
+    def _publish(self, message: dict, user_id: str):
+        payload = json.dumps({"user_id": user_id, "message": message})
+        if len(payload.encode("utf-8")) > _NOTIFY_MAX_BYTES and message.get("type") == "document_finding":
+            # The finding is already saved; the client reads its fields with the document
+            payload = json.dumps({"user_id": user_id, "message": {**message, "fields": None, "truncated": True}})
+        try:
+            with engine.begin() as connection:
+                connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                   {"channel": self.channel, "payload": payload})
+        except Exception as e:
+            print(f"WebSocketManager: could not relay message for user_id {user_id}: {e}")
+
+    def _handle(self, loop: asyncio.AbstractEventLoop, payload: str):
+        try:
+            relayed = json.loads(payload)
+            message, user_id = relayed["message"], str(relayed["user_id"])
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"WebSocketManager: ignoring malformed relay message {payload[:200]!r}: {e}")
+            return
+        if user_id in self.active_connections:
+            asyncio.run_coroutine_threadsafe(self._send_local(message, user_id), loop)
+
+    def start_listener(self):
+        """Deliver messages relayed by standalone workers to this process's sockets."""
+        if self._listener is not None or engine.dialect.name != "postgresql":
+            return
+        self._listener = threading.Event()
+        threading.Thread(target=self._listen_loop, args=(asyncio.get_running_loop(), self._listener),
+                         name="websocket-relay-listener", daemon=True).start()
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.set()
+            self._listener = None
+
+    def _listen_loop(self, loop: asyncio.AbstractEventLoop, stop: threading.Event):
+        while not stop.is_set():
+            connection = None
+            try:
+                # A dedicated DBAPI connection outside the pool: LISTEN lives as long as the process
+                cargs, cparams = engine.dialect.create_connect_args(engine.url)
+                connection = engine.dialect.connect(*cargs, **cparams)
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                while not stop.is_set():
+                    if select.select([connection], [], [], 1.0)[0]:
+                        connection.poll()
+                        while connection.notifies:
+                            self._handle(loop, connection.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"WebSocketManager: relay listener error, reconnecting: {e}")
+                stop.wait(WS_RELAY_RECONNECT_SECONDS)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+websocket_manager = WebSocketManager()
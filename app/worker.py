@@ -0,0 +1,345 @@
+"""
+Background job worker.
+
+Polls docucr.processing_jobs and runs document analysis / SOP extraction jobs.
+Runs embedded in the API process by default (EMBEDDED_WORKER=true) and can be
+scaled out as a separate fleet with:
+
+    python -m app.worker --concurrency 4
+
+A standalone worker relays its websocket messages to the API processes (see
+websocket_manager), so users keep getting live status and findings.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import traceback
+import uuid
+
+from app.core.database import SessionLocal
+from app.services.job_queue_service import JobQueueService, JOB_VISIBILITY_TIMEOUT, DEAD, PRIORITY_INTERACTIVE
+from app.services.ai_scheduler import ai_request_context, LANE_INTERACTIVE, LANE_BULK
+from app.services.ocr_classifier import ocr_classifier
+from app.services.ai_usage_service import ai_usage
+from app.services.processing_trace import job_timing
+from app.services.analysis_cancellation import analysis_cancellation
+from app.services.websocket_manager import websocket_manager
+
+# Documents in flight per worker process. Outbound AI calls are capped separately
+# by ai_scheduler (AI_MAX_CONCURRENCY), so this can be higher than the old one-at-a-time loop.
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))  # seconds
+UPLOAD_SWEEP_INTERVAL = int(os.getenv("UPLOAD_SWEEP_INTERVAL", "300"))  # seconds
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "true").lower() == "true"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Job handlers — imported lazily so the worker does not pull in every service
+# (weasyprint, pdf2image, ...) until a job of that type actually runs.
+# ─────────────────────────────────────────────────────────────────────────────
+
+async def _run_document_analysis(payload: dict):
+    from app.services.document_service import DocumentService
+    await DocumentService.run_analysis_job(payload)
+
+
+async def _document_analysis_dead(payload: dict, error: str):
+    from app.services.document_service import DocumentService
+    await DocumentService.on_analysis_job_dead(payload, error)
+
+
+async def _run_sop_extraction(payload: dict):
+    from app.services.ai_sop_service import AISOPService
+    # process_sop_extraction drives its own event loops via asyncio.run
+    await asyncio.to_thread(
+        AISOPService.process_sop_extraction,
+        payload["sop_id"],
+        None,
+        payload.get("content_type"),
+        s3_key=payload["s3_key"],
+    )
+
+
+async def _run_sop_document_extraction(payload: dict):
+    from app.services.sop_service import SOPService
+    await asyncio.to_thread(
+        SOPService.extract_and_apply_document,
+        doc_id=payload["doc_id"],
+        sop_id=payload["sop_id"],
+    )
+
+
+def _mark_sop_failed(sop_id: str):
+    from app.models.sop import SOP
+    from app.models.status import Status
+
+    db = SessionLocal()
+    try:
+        failed_status = db.query(Status).filter(
+            Status.code == "FAILED", Status.type == "DOCUMENT"
+        ).first()
+        sop = db.query(SOP).filter(SOP.id == sop_id).first()
+        if sop and failed_status:
+            sop.status_id = failed_status.id
+            db.commit()
+    finally:
+        db.close()
+
+
+async def _sop_extraction_dead(payload: dict, error: str):
+    await asyncio.to_thread(_mark_sop_failed, payload["sop_id"])
+
+
+JOB_HANDLERS = {
+    "document.analyze": _run_document_analysis,
+    "sop.extract": _run_sop_extraction,
+    "sop.document_extract": _run_sop_document_extraction,
+}
+
+DEAD_LETTER_HANDLERS = {
+    "document.analyze": _document_analysis_dead,
+    "sop.extract": _sop_extraction_dead,
+}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Short-lived DB helpers (run in a thread — the ORM session is synchronous)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _claim(worker_id: str, job_types):
+    db = SessionLocal()
+    try:
+        job = JobQueueService.claim(db, worker_id, job_types)
+        if not job:
+            return None
+        return {
+            "id": job.id,
+            "job_type": job.job_type,
+            "payload": job.payload or {},
+            "status": job.status,
+            "priority": job.priority,
+            "organisation_id": job.organisation_id,
+            "attempts": job.attempts,
+            "last_error": job.last_error,
+            # claim time (updated_at) minus the time the job became runnable
+            "queue_wait": max(0.0, (job.updated_at - job.run_after).total_seconds())
+            if job.updated_at and job.run_after else None,
+        }
+    finally:
+        db.close()
+
+
+def _heartbeat(job_id, worker_id: str) -> bool:
+    db = SessionLocal()
+    try:
+        return JobQueueService.heartbeat(db, job_id, worker_id)
+    finally:
+        db.close()
+
+
+def _complete(job_id):
+    db = SessionLocal()
+    try:
+        JobQueueService.complete(db, job_id)
+    finally:
+        db.close()
+
+
+def _fail(job_id, error: str) -> bool:
+    db = SessionLocal()
+    try:
+        return JobQueueService.fail(db, job_id, error)
+    finally:
+        db.close()
+
+
+def _sweep_interrupted_uploads():
+    db = SessionLocal()
+    try:
+        return JobQueueService.fail_interrupted_uploads(db)
+    finally:
+        db.close()
+
+
+class JobWorker:
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY,
+                 poll_interval: float = JOB_POLL_INTERVAL, job_types=None):
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.job_types = job_types or list(JOB_HANDLERS.keys())
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopping = asyncio.Event()
+        self._tasks = []
+
+    async def run(self):
+        print(f"[worker] {self.worker_id} started (concurrency={self.concurrency}, types={self.job_types})")
+        self._tasks = [asyncio.create_task(self._slot_loop(i)) for i in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._sweep_loop()))
+        if "document.analyze" in self.job_types:
+            analysis_cancellation.start_listener()
+        try:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            analysis_cancellation.stop_listener()
+            ocr_classifier.shutdown()
+            await asyncio.to_thread(ai_usage.flush)
+            print(f"[worker] {self.worker_id} stopped")
+
+    def stop(self):
+        """Stop claiming new jobs; in-flight jobs are allowed to finish."""
+        self._stopping.set()
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _slot_loop(self, slot: int):
+        while not self._stopping.is_set():
+            try:
+                job = await asyncio.to_thread(_claim, self.worker_id, self.job_types)
+            except Exception as e:
+                print(f"[worker] claim failed: {e}")
+                await self._sleep(self.poll_interval)
+                continue
+
+            if not job:
+                await self._sleep(self.poll_interval)
+                continue
+
+            await self._execute(job)
+
+    async def _execute(self, job: dict):
+        job_id = job["id"]
+        job_type = job["job_type"]
+        payload = job["payload"]
+
+        if job["status"] == DEAD:
+            # Lease expired on the final attempt (worker crashed mid-job)
+            await self._dead_letter(job_type, payload, job["last_error"])
+            return
+
+        handler = JOB_HANDLERS.get(job_type)
+        if not handler:
+            await asyncio.to_thread(_fail, job_id, f"No handler for job type {job_type}")
+            return
+
+        print(f"[worker] running {job_type} job={job_id} attempt={job['attempts']}")
+        lane = LANE_INTERACTIVE if (job["priority"] or 0) >= PRIORITY_INTERACTIVE else LANE_BULK
+        # The handler runs as its own task (created inside the contexts so it inherits
+        # them) so the heartbeat can stop it once the lease belongs to someone else.
+        with ai_request_context(job["organisation_id"], lane,
+                                document_id=payload.get("document_id"), sop_id=payload.get("sop_id")), \
+                job_timing(job["queue_wait"], job["attempts"]):
+            work = asyncio.create_task(handler(payload))
+        heartbeat = asyncio.create_task(self._heartbeat_loop(job_id, work))
+        try:
+            await work
+        except asyncio.CancelledError:
+            if not heartbeat.done() or not heartbeat.result():
+                work.cancel()
+                raise  # not a lost lease — the worker itself is being cancelled
+            # Lease lost: the job was reclaimed (or finished) by another worker, which
+            # now owns its outcome — recording one here would overwrite theirs.
+            print(f"[worker] {job_type} job={job_id} lost its lease; abandoned without recording a result")
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            dead = await asyncio.to_thread(_fail, job_id, error)
+            if dead:
+                print(f"[worker] {job_type} job={job_id} dead-lettered: {error}")
+                await self._dead_letter(job_type, payload, error)
+            else:
+                print(f"[worker] {job_type} job={job_id} will retry: {error}")
+            return
+        finally:
+            heartbeat.cancel()
+
+        await asyncio.to_thread(_complete, job_id)
+
+    async def _heartbeat_loop(self, job_id, work: asyncio.Task) -> bool:
+        """Extend the lease while ``work`` runs. Returns True after cancelling ``work``
+        because the lease is no longer ours."""
+        interval = max(JOB_VISIBILITY_TIMEOUT / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                owned = await asyncio.to_thread(_heartbeat, job_id, self.worker_id)
+            except Exception as e:
+                print(f"[worker] heartbeat failed for job={job_id}: {e}")
+                continue
+            if not owned:
+                print(f"[worker] job={job_id} lease lost; cancelling handler")
+                work.cancel()
+                return True
+
+    async def _dead_letter(self, job_type: str, payload: dict, error: str):
+        handler = DEAD_LETTER_HANDLERS.get(job_type)
+        if not handler:
+            return
+        try:
+            await handler(payload, error)
+        except Exception as e:
+            print(f"[worker] dead-letter handler for {job_type} failed: {e}")
+
+    async def _sweep_loop(self):
+        while not self._stopping.is_set():
+            try:
+                failed = await asyncio.to_thread(_sweep_interrupted_uploads)
+                if failed:
+                    print(f"[worker] marked {len(failed)} interrupted upload(s) as UPLOAD_FAILED: {failed}")
+            except Exception as e:
+                print(f"[worker] upload sweep failed: {e}")
+            await self._sleep(UPLOAD_SWEEP_INTERVAL)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Embedded mode (FastAPI startup/shutdown)
+# ─────────────────────────────────────────────────────────────────────────────
+
+_embedded_worker = None
+_embedded_task = None
+
+
+def start_embedded():
+    global _embedded_worker, _embedded_task
+    if not EMBEDDED_WORKER or _embedded_task:
+        return
+    _embedded_worker = JobWorker()
+    _embedded_task = asyncio.create_task(_embedded_worker.run())
+
+
+async def stop_embedded():
+    global _embedded_worker, _embedded_task
+    if not _embedded_task:
+        return
+    _embedded_worker.stop()
+    await _embedded_task
+    _embedded_worker = None
+    _embedded_task = None
+
+
+async def _main(concurrency: int, job_types):
+    # No client sockets here: status and findings go to the API processes over NOTIFY
+    websocket_manager.relay = True
+    worker = JobWorker(concurrency=concurrency, job_types=job_types)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            pass
+    await worker.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="docucr background job worker")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    parser.add_argument("--job-type", action="append", dest="job_types",
+                        help="Only run these job types (repeatable). Defaults to all.")
+    args = parser.parse_args()
+    asyncio.run(_main(args.concurrency, args.job_types))
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import app.services.ai_cache_service as cache_module
+from app.services.ai_cache_service import AICacheService, KIND_CLASSIFY
+from app.services.ai_scheduler import ai_request_context
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """An enabled cache whose database table is a dict."""
+    table = {}
+    monkeypatch.setattr(cache_module, "_load", lambda key, cutoff: table.get(key))
+    monkeypatch.setattr(cache_module, "_store", lambda key, kind, org, result: table.__setitem__(key, result))
+    service = AICacheService(enabled=True)
+    service.table = table
+    return service
+
+
+class Model:
+    """compute() stand-in: counts calls and answers after a short delay."""
+
+    def __init__(self, result=None, error=None):
+        self.calls = 0
+        self.result = result if result is not None else {"type": "SUPERBILL"}
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        if self.error:
+            raise self.error
+        return dict(self.result)
+
+
+def _gather(cache, model, count, page="page-1", org="org-a", **kwargs):
+    async def one():
+        with ai_request_context(org):
+            return await cache.get_or_compute(KIND_CLASSIFY, page, "schema", model, **kwargs)
+
+    async def run():
+        return await asyncio.gather(*(one() for _ in range(count)), return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+def test_identical_pages_in_flight_send_one_request(cache):
+    model = Model()
+    results = _gather(cache, model, 5)
+    assert model.calls == 1
+    assert sorted(from_cache for _, from_cache in results) == [False, True, True, True, True]
+    assert all(result == {"type": "SUPERBILL"} for result, _ in results)
+    # every caller gets its own copy
+    results[0][0]["type"] = "CHANGED"
+    assert results[1][0] == {"type": "SUPERBILL"}
+    counts = cache.stats("org-a")["organisations"]["org-a"][KIND_CLASSIFY]
+    assert (counts["misses"], counts["coalesced"], counts["stores"]) == (5, 4, 1)
+    assert counts["hit_rate"] == 0.8
+
+
+def test_later_request_is_served_from_memory(cache):
+    model = Model()
+    _gather(cache, model, 1)
+    cache.table.clear()
+    (result, from_cache), = _gather(cache, model, 1)
+    assert (result, from_cache, model.calls) == ({"type": "SUPERBILL"}, True, 1)
+    assert cache.stats("org-a")["organisations"]["org-a"][KIND_CLASSIFY]["memory_hits"] == 1
+
+
+def test_stored_result_is_served_to_a_new_process(cache):
+    model = Model()
+    _gather(cache, model, 1)
+    fresh = AICacheService(enabled=True)
+    (result, from_cache), = _gather(fresh, model, 1)
+    assert (result, from_cache, model.calls) == ({"type": "SUPERBILL"}, True, 1)
+
+
+def test_organisations_never_share_results(cache):
+    model = Model()
+
+    async def run():
+        async def one(org):
+            with ai_request_context(org):
+                return await cache.get_or_compute(KIND_CLASSIFY, "page-1", "schema", model)
+        return await asyncio.gather(one("org-a"), one("org-b"))
+
+    assert [from_cache for _, from_cache in asyncio.run(run())] == [False, False]
+    assert model.calls == 2
+
+
+def test_followers_retry_on_their_own_when_the_leader_fails(cache):
+    model = Model(error=RuntimeError("upstream"))
+    results = _gather(cache, model, 3)
+    assert model.calls == 3
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.table == {}
+
+
+def test_uncacheable_result_is_not_shared(cache):
+    model = Model(result={"type": "UNKNOWN"})
+    results = _gather(cache, model, 3, cacheable=lambda r: r["type"] != "UNKNOWN")
+    assert model.calls == 3
+    assert [from_cache for _, from_cache in results] == [False, False, False]
+    assert cache.table == {}
+
+
+def test_failing_cache_does_not_fail_the_lookup(cache, monkeypatch):
+    def broken(*args):
+        raise ConnectionError("database down")
+
+    monkeypatch.setattr(cache_module, "_load", broken)
+    monkeypatch.setattr(cache_module, "_store", broken)
+    model = Model()
+    (result, from_cache), = _gather(cache, model, 1)
+    assert (result, from_cache, model.calls) == ({"type": "SUPERBILL"}, False, 1)
+
+
+def test_disabled_cache_always_computes():
+    model = Model()
+    results = _gather(AICacheService(enabled=False), model, 3)
+    assert model.calls == 3
+    assert [from_cache for _, from_cache in results] == [False, False, False]
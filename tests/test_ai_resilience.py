@@ -0,0 +1,163 @@
+import asyncio
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+import pytest
+from openai import BadRequestError, InternalServerError, RateLimitError
+
+from app.services.ai_resilience import CircuitBreaker, ResilientAIClient, _retry_after
+from app.services.ai_usage_service import AIUsageRecorder
+from app.services.fake_ai_backend import _status_error
+
+
+def _error(**headers):
+    """An SDK-style error whose response carries ``headers``."""
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+def test_retry_after_seconds():
+    assert _retry_after(_error(**{"retry-after": "2"})) == 2.0
+
+
+def test_retry_after_ms_wins_over_seconds():
+    assert _retry_after(_error(**{"retry-after-ms": "1500", "retry-after": "9"})) == 1.5
+
+
+def test_retry_after_http_date():
+    value = formatdate(time.time() + 30, usegmt=True)
+    assert _retry_after(_error(**{"retry-after": value})) == pytest.approx(30, abs=2)
+
+
+def test_retry_after_date_without_zone_is_utc():
+    # "-0000" parses to a naive datetime
+    value = formatdate(time.time() + 60)
+    assert value.endswith("-0000")
+    assert _retry_after(_error(**{"retry-after": value})) == pytest.approx(60, abs=2)
+
+
+def test_retry_after_past_date_is_zero():
+    value = formatdate(time.time() - 60, usegmt=True)
+    assert _retry_after(_error(**{"retry-after": value})) == 0.0
+
+
+@pytest.mark.parametrize("value", ["soon", "Wed, 99 Foo 2024", ""])
+def test_retry_after_unparseable(value):
+    assert _retry_after(_error(**{"retry-after": value})) is None
+
+
+def test_retry_after_without_response():
+    assert _retry_after(Exception("boom")) is None
+
+
+# ── Retries and the circuit breaker ─────────────────────────────────────────
+
+class ScriptedBackend:
+    """``chat.completions.create`` that plays ``script`` in order: an exception
+    instance is raised, "hang" blocks until cancelled, anything else is returned."""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls += 1
+        step = self.script.pop(0) if self.script else "ok"
+        if step == "hang":
+            await asyncio.Event().wait()
+        if isinstance(step, Exception):
+            raise step
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=step))])
+
+
+def _client(backend, threshold=5, cooldown=30.0, max_retries=3):
+    client = ResilientAIClient(backend, max_retries=max_retries, usage=AIUsageRecorder(enabled=False))
+    client.breaker = CircuitBreaker(threshold=threshold, cooldown=cooldown)
+    return client
+
+
+def _create(client):
+    return client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "hi"}])
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr("app.services.ai_resilience.AI_RETRY_BASE_DELAY", 0.0)
+
+
+def test_retries_server_errors(no_backoff):
+    backend = ScriptedBackend(_status_error(InternalServerError, 500), _status_error(InternalServerError, 503), "done")
+    response = asyncio.run(_create(_client(backend)))
+    assert response.choices[0].message.content == "done"
+    assert backend.calls == 3
+
+
+def test_rate_limit_honours_retry_after(no_backoff):
+    backend = ScriptedBackend(_status_error(RateLimitError, 429, {"retry-after-ms": "50"}), "done")
+    started = time.monotonic()
+    asyncio.run(_create(_client(backend)))
+    assert backend.calls == 2
+    assert time.monotonic() - started >= 0.05
+
+
+def test_client_errors_are_not_retried(no_backoff):
+    backend = ScriptedBackend(_status_error(BadRequestError, 400))
+    client = _client(backend)
+    with pytest.raises(BadRequestError):
+        asyncio.run(_create(client))
+    assert backend.calls == 1
+    assert not client.breaker.is_open
+
+
+def test_gives_up_after_max_retries(no_backoff):
+    backend = ScriptedBackend(*[_status_error(InternalServerError, 500)] * 3)
+    with pytest.raises(InternalServerError):
+        asyncio.run(_create(_client(backend, max_retries=2)))
+    assert backend.calls == 3
+
+
+def test_breaker_opens_then_probe_closes_it(no_backoff):
+    backend = ScriptedBackend(*[_status_error(InternalServerError, 500)] * 2)
+    client = _client(backend, threshold=2, cooldown=0.05, max_retries=0)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(InternalServerError):
+                await _create(client)
+        assert client.breaker.state == CircuitBreaker.OPEN
+        started = time.monotonic()
+        await _create(client)  # waits out the cooldown, then goes through as the probe
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.04
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens(no_backoff):
+    breaker = CircuitBreaker(threshold=1, cooldown=0.0)
+    breaker.record_failure()
+    assert asyncio.run(breaker.wait_until_closed()) is True
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_cancelled_probe_lets_next_call_through(no_backoff):
+    backend = ScriptedBackend(_status_error(InternalServerError, 500), "hang", "after")
+    client = _client(backend, threshold=1, cooldown=0.0, max_retries=0)
+
+    async def run():
+        with pytest.raises(InternalServerError):
+            await _create(client)
+        probe = asyncio.create_task(_create(client))
+        while backend.calls < 2:
+            await asyncio.sleep(0.01)
+        assert client.breaker.state == CircuitBreaker.HALF_OPEN
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        return await asyncio.wait_for(_create(client), timeout=2)
+
+    assert asyncio.run(run()).choices[0].message.content == "after"
+    assert client.breaker.state == CircuitBreaker.CLOSED
@@ -0,0 +1,124 @@
+import asyncio
+
+from app.services.ai_scheduler import (
+    AIRequestScheduler, ai_request_context, current_ai_context, LANE_BULK, LANE_INTERACTIVE,
+)
+
+
+def _grant_order(scheduler, requests):
+    """Queue ``requests`` (name, org, lane) behind a held slot, then release one
+    slot at a time and return the order the waiters were served in."""
+    async def run():
+        await scheduler.acquire("holder")
+        order = []
+
+        async def request(name, org, lane):
+            await scheduler.acquire(org, lane)
+            order.append(name)
+
+        tasks = [asyncio.create_task(request(*r)) for r in requests]
+        await asyncio.sleep(0)
+        assert sum(scheduler.snapshot()["waiting"].values()) == len(requests)
+        for _ in requests:
+            scheduler.release()
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+        scheduler.release()
+        assert scheduler.snapshot()["in_flight"] == 0
+        return order
+
+    return asyncio.run(run())
+
+
+def test_free_slots_are_taken_without_queueing():
+    scheduler = AIRequestScheduler(max_concurrency=2)
+
+    async def run():
+        await scheduler.acquire()
+        await scheduler.acquire()
+        return scheduler.snapshot()
+
+    assert asyncio.run(run()) == {"max_concurrency": 2, "in_flight": 2,
+                                  "waiting": {LANE_INTERACTIVE: 0, LANE_BULK: 0}}
+
+
+def test_interactive_lane_is_served_first():
+    order = _grant_order(AIRequestScheduler(max_concurrency=1), [
+        ("bulk-1", "a", LANE_BULK),
+        ("bulk-2", "a", LANE_BULK),
+        ("upload", "b", LANE_INTERACTIVE),
+    ])
+    assert order == ["upload", "bulk-1", "bulk-2"]
+
+
+def test_large_batch_does_not_starve_other_organisations():
+    batch = [(f"a{i}", "org-a", LANE_BULK) for i in range(1, 6)]
+    order = _grant_order(AIRequestScheduler(max_concurrency=1),
+                         batch + [("b1", "org-b", LANE_BULK), ("b2", "org-b", LANE_BULK)])
+    assert order == ["a1", "b1", "a2", "b2", "a3", "a4", "a5"]
+
+
+def test_weights_scale_an_organisations_share():
+    scheduler = AIRequestScheduler(max_concurrency=1, org_weights={"org-a": 2})
+    order = _grant_order(scheduler, [(f"a{i}", "org-a", LANE_BULK) for i in range(1, 5)]
+                         + [("b1", "org-b", LANE_BULK), ("b2", "org-b", LANE_BULK)])
+    assert order == ["a1", "a2", "b1", "a3", "a4", "b2"]
+
+
+def test_context_supplies_organisation_and_lane():
+    scheduler = AIRequestScheduler(max_concurrency=1)
+
+    async def run():
+        await scheduler.acquire()
+        order = []
+
+        async def request(name, org, lane):
+            with ai_request_context(org, lane):
+                assert current_ai_context()["organisation_id"] == org
+                await scheduler.acquire()
+            order.append(name)
+
+        tasks = [asyncio.create_task(request("bulk", "a", LANE_BULK)),
+                 asyncio.create_task(request("interactive", "b", LANE_INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert scheduler.snapshot()["waiting"] == {LANE_INTERACTIVE: 1, LANE_BULK: 1}
+        for _ in tasks:
+            scheduler.release()
+            await asyncio.sleep(0.01)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "bulk"]
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = AIRequestScheduler(max_concurrency=1)
+
+    async def run():
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire("a"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.snapshot()["waiting"][LANE_INTERACTIVE] == 0
+        scheduler.release()
+        return scheduler.snapshot()["in_flight"]
+
+    assert asyncio.run(run()) == 0
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_passed_on():
+    scheduler = AIRequestScheduler(max_concurrency=1)
+
+    async def run():
+        await scheduler.acquire()
+        first = asyncio.create_task(scheduler.acquire("a"))
+        second = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        scheduler.release()  # hands the slot to ``first``...
+        first.cancel()       # ...which is cancelled before it wakes up
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.wait_for(second, 1)
+        scheduler.release()
+        return scheduler.snapshot()["in_flight"]
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+
+import app.services.ai_cache_service as cache_module
+from app.services.ai_cache_service import AICacheService, KIND_CLASSIFY
+from app.services.ai_scheduler import AIRequestScheduler, ai_request_context
+from app.services.analysis_cancellation import AnalysisCancellation, AnalysisCancelled, cancel_and_wait
+
+
+async def _until(predicate, timeout=1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.005)
+
+
+def test_cancel_stops_the_analysis():
+    cancellation = AnalysisCancellation()
+    stopped = []
+
+    async def analysis():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            stopped.append(True)
+            raise
+
+    async def run():
+        task = asyncio.create_task(cancellation.run(7, analysis()))
+        await asyncio.sleep(0)
+        assert cancellation.stats()["running"] == 1
+        assert cancellation.cancel(7)
+        assert not cancellation.cancel(7)  # already requested
+        with pytest.raises(AnalysisCancelled):
+            await task
+
+    asyncio.run(run())
+    stats = cancellation.stats()
+    assert stopped == [True]
+    assert (stats["running"], stats["cancelled"]) == (0, 1)
+    assert stats["cancel_to_idle_ms"]["max"] is not None
+
+
+def test_cancel_from_another_thread_and_notification():
+    cancellation = AnalysisCancellation()
+
+    async def run():
+        task = asyncio.create_task(cancellation.run(7, asyncio.sleep(5)))
+        await asyncio.sleep(0)
+        await asyncio.to_thread(cancellation._handle, '{"document_id": 7, "requested_at": 1}')
+        with pytest.raises(AnalysisCancelled):
+            await task
+
+    asyncio.run(run())
+    assert cancellation.stats()["cancelled"] == 1
+
+
+def test_unknown_or_finished_document_is_not_cancelled():
+    cancellation = AnalysisCancellation()
+
+    async def run():
+        assert await cancellation.run(7, asyncio.sleep(0, result="done")) == "done"
+
+    asyncio.run(run())
+    assert not cancellation.cancel(7)
+    cancellation._handle("not json")
+
+
+def test_worker_shutdown_is_not_reported_as_a_cancelled_analysis():
+    cancellation = AnalysisCancellation()
+
+    async def run():
+        task = asyncio.create_task(cancellation.run(7, asyncio.sleep(5)))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert cancellation.stats()["cancelled"] == 0
+
+
+def test_cancel_and_wait():
+    async def run():
+        finished = asyncio.create_task(asyncio.sleep(0))
+        await finished
+        unwound = []
+
+        async def child():
+            try:
+                await asyncio.sleep(5)
+            finally:
+                await asyncio.sleep(0.01)
+                unwound.append(True)
+
+        pending = [asyncio.create_task(child()) for _ in range(3)]
+        await asyncio.sleep(0)
+        await cancel_and_wait([finished] + pending)
+        return unwound, pending
+
+    unwound, pending = asyncio.run(run())
+    assert unwound == [True, True, True]
+    assert all(task.cancelled() for task in pending)
+
+
+def test_cancel_releases_scheduler_slots():
+    cancellation = AnalysisCancellation()
+    scheduler = AIRequestScheduler(max_concurrency=1)
+
+    async def call():
+        async with scheduler.slot():
+            await asyncio.sleep(5)
+
+    async def analysis():
+        children = [asyncio.create_task(call()) for _ in range(3)]
+        try:
+            await asyncio.gather(*children)
+        finally:
+            await cancel_and_wait(children)
+
+    async def run():
+        task = asyncio.create_task(cancellation.run(7, analysis()))
+        await _until(lambda: scheduler.snapshot()["waiting"]["interactive"] == 2)
+        cancellation.cancel(7)
+        with pytest.raises(AnalysisCancelled):
+            await task
+        return scheduler.snapshot()
+
+    snapshot = asyncio.run(run())
+    assert snapshot["in_flight"] == 0
+    assert snapshot["waiting"] == {"interactive": 0, "bulk": 0}
+
+
+# ── Coalesced cache lookups ─────────────────────────────────────────────────
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(cache_module, "_load", lambda key, cutoff: None)
+    monkeypatch.setattr(cache_module, "_store", lambda key, kind, org, result: None)
+    return AICacheService(enabled=True)
+
+
+class Model:
+    def __init__(self):
+        self.calls = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {"type": "SUPERBILL"}
+
+
+def _lookup(cache, model):
+    async def lookup():
+        with ai_request_context("org-a"):
+            return await cache.get_or_compute(KIND_CLASSIFY, "page-1", "schema", model)
+    return asyncio.create_task(lookup())
+
+
+def test_cancelled_leader_finishes_the_shared_lookup_for_other_documents(cache):
+    model = Model()
+
+    async def run():
+        leader = _lookup(cache, model)
+        await asyncio.sleep(0)
+        follower = _lookup(cache, model)
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        return leader, await follower
+
+    leader, (result, from_cache) = asyncio.run(run())
+    assert leader.cancelled()
+    assert (result, from_cache) == ({"type": "SUPERBILL"}, True)
+    assert (model.calls, model.cancelled) == (1, 0)
+
+
+def test_cancelled_leader_without_waiters_stops_the_request(cache):
+    model = Model()
+
+    async def run():
+        leader = _lookup(cache, model)
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert cache._inflight == {}
+        return await _lookup(cache, model)
+
+    assert asyncio.run(run()) == ({"type": "SUPERBILL"}, False)
+    assert (model.calls, model.cancelled) == (2, 1)
+
+
+def test_request_stops_when_the_last_waiter_is_cancelled(cache):
+    model = Model()
+
+    async def run():
+        leader = _lookup(cache, model)
+        await asyncio.sleep(0)
+        follower = _lookup(cache, model)
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.gather(leader, follower, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert (model.calls, model.cancelled) == (1, 1)
+    assert cache._inflight == {}
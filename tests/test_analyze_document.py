@@ -0,0 +1,175 @@
+"""
+AIService.analyze_document end to end against the deterministic fake backend
+(app.services.fake_ai_backend): pages are rendered, classified, grouped into
+instances and extracted through the real ResilientAIClient, with no network
+and no database.
+"""
+import asyncio
+import contextlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image, ImageDraw
+
+import app.services.ai_service as ai_service
+import app.services.rasterizer as rasterizer
+from app.services.ai_resilience import ResilientAIClient
+from app.services.ai_scheduler import ai_request_context
+from app.services.ai_usage_service import AIUsageRecorder
+from app.services.classification_batcher import classification_batcher
+from app.services.fake_ai_backend import FakeBackend
+
+SCHEMAS = [{
+    "type_name": "SUPERBILL",
+    "description": "Itemised superbill listing CPT procedure codes and diagnosis codes",
+    "fields": [
+        {"fieldName": "cpt_codes", "type": "list"},
+        {"fieldName": "patient_name", "required": True},
+        {"fieldName": "icd_codes", "type": "list"},
+    ],
+}]
+
+
+def _page(text: str) -> Image.Image:
+    image = Image.new("RGB", (1700, 2200), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(150, 2050, 45):
+        draw.text((150, y), text, fill="black")
+    return image
+
+
+class _Session:
+    """Just enough of a Session for analyze_document's short write scopes."""
+
+    def __init__(self, added: list):
+        self.added = added
+
+    def query(self, *entities):
+        return self
+
+    def filter(self, *criteria):
+        return self
+
+    def delete(self):
+        return 0
+
+    def all(self):
+        return []
+
+    def add(self, row):
+        self.added.append(row)
+
+
+@pytest.fixture
+def pdf_pages(monkeypatch):
+    """A 3-page PDF rendered in-process (no poppler, no worker processes)."""
+    images = [_page(f"SUPERBILL page {i} CPT 99213") for i in range(1, 4)]
+    monkeypatch.setattr(rasterizer, "pdfinfo_from_path", lambda path: {"Pages": len(images)})
+    monkeypatch.setattr(rasterizer, "convert_from_path",
+                        lambda path, dpi, first_page, last_page: images[first_page - 1:last_page])
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        monkeypatch.setattr(rasterizer, "_get_pool", lambda: pool)
+        yield images
+
+
+@pytest.fixture
+def rows(monkeypatch):
+    added = []
+    monkeypatch.setattr(ai_service, "session_scope", lambda: contextlib.nullcontext(_Session(added)))
+    # Batches depend on timing; one request per page keeps the fake's answers reproducible
+    monkeypatch.setattr(classification_batcher, "enabled", False)
+    return added
+
+
+class SuperbillBackend(FakeBackend):
+    """The fake, except that every page is classified as the start of a SUPERBILL.
+
+    Which type the plain fake picks depends on the encoded page images (and so on
+    the JPEG encoder), so the extraction leg is pinned to a known structure here.
+    """
+
+    def _answer(self, kwargs, prompt, schema, json_mode):
+        content, images = super()._answer(kwargs, prompt, schema, json_mode)
+        fmt = kwargs.get("response_format") or {}
+        if (fmt.get("json_schema") or {}).get("name") == "page_classification":
+            reply = json.loads(content)
+            reply.update(type="SUPERBILL", confidence="HIGH", header_restart=True)
+            content = json.dumps(reply)
+        return content, images
+
+
+def _analyze(findings_seen: list, backend_class=FakeBackend):
+    backend = backend_class(latency="fixed:1", image_latency_ms=0)
+    service = ai_service.AIService(ResilientAIClient(backend, usage=AIUsageRecorder(enabled=False)))
+
+    async def on_finding(finding):
+        findings_seen.append(finding)
+
+    async def run():
+        with ai_request_context(lane="interactive", document_id=1):
+            return await service.analyze_document(b"%PDF-1.4", "scan.pdf", SCHEMAS, 1, finding_callback=on_finding)
+
+    return asyncio.run(run()), backend
+
+
+def test_analyze_document_extracts_every_instance(pdf_pages, rows):
+    seen = []
+    result, backend = _analyze(seen, SuperbillBackend)
+
+    metadata = result["analysis_metadata"]
+    assert metadata["total_pages"] == 3
+    assert metadata["page_classification"] == {"model": 3}
+    assert metadata["page_routing"]["image"] == 3
+    assert metadata["instances"] == 3
+    assert backend.calls >= 6  # one classification and at least one extraction per page
+
+    assert [f["page_range"] for f in result["findings"]] == ["1-1", "2-2", "3-3"]
+    for finding in result["findings"]:
+        assert finding["type"] == "SUPERBILL"
+        assert set(finding["data"]["fields"]) == {"cpt_codes", "patient_name", "icd_codes"}
+        assert finding["routing"]["calls"]
+    assert sorted(f["page_range"] for f in seen) == ["1-1", "2-2", "3-3"]
+    assert rows == []
+
+
+def test_analyze_document_covers_every_page(pdf_pages, rows):
+    # Unpinned fake: whatever types it picks, every instance is either extracted
+    # against its template or saved for review, and together they cover each page once
+    result, _ = _analyze([])
+    metadata = result["analysis_metadata"]
+    assert metadata["instances"] >= 1
+    assert len(result["findings"]) + len(rows) == metadata["instances"]
+
+    ranges = [f["page_range"] for f in result["findings"]] + [row.page_range for row in rows]
+    covered = sorted(page for r in ranges for page in range(int(r.split("-")[0]), int(r.split("-")[1]) + 1))
+    assert covered == [1, 2, 3]
+
+
+def test_analyze_document_is_deterministic(pdf_pages, rows):
+    first, _ = _analyze([])
+    first_rows = [(row.suspected_type, row.page_range, row.extracted_data) for row in rows]
+    rows.clear()
+    second, _ = _analyze([])
+    assert first["findings"] == second["findings"]
+    assert first_rows == [(row.suspected_type, row.page_range, row.extracted_data) for row in rows]
+    assert first["analysis_metadata"]["page_classification"] == second["analysis_metadata"]["page_classification"]
+
+
+def test_extract_fields_with_fake_backend(pdf_pages):
+    # The template-extraction leg on its own, for a known SUPERBILL instance
+    service = ai_service.AIService(ResilientAIClient(FakeBackend(latency="fixed:1", image_latency_ms=0),
+                                                     usage=AIUsageRecorder(enabled=False)))
+    routing = []
+
+    async def run():
+        pages = await rasterizer.DocumentPages.from_bytes(b"%PDF-1.4", "scan.pdf", dpi=200)
+        try:
+            return await service._extract_fields("SUPERBILL", "1-3", pages, SCHEMAS[0], routing=routing)
+        finally:
+            pages.close()
+
+    fields = asyncio.run(run())
+    assert set(fields) == {"cpt_codes", "patient_name", "icd_codes"}
+    assert all(len(code) == 5 and code.isdigit() for code in fields["cpt_codes"] or [])
+    assert routing  # every model call is logged for the cascade summary
@@ -0,0 +1,48 @@
+import random
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.services.blank_page import page_ink_stats
+
+LETTER = (1700, 2200)  # 200 dpi
+
+
+def test_white_page_is_blank():
+    stats = page_ink_stats(Image.new("RGB", LETTER, "white"))
+    assert stats["blank"]
+    assert stats["components"] == 0
+
+
+def test_grey_paper_is_blank():
+    assert page_ink_stats(Image.new("L", LETTER, 205))["blank"]
+
+
+def test_scanner_specks_are_blank():
+    image = Image.new("L", LETTER, 250)
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(1)
+    for _ in range(3):
+        x, y = rng.randrange(200, 1500), rng.randrange(200, 2000)
+        draw.ellipse((x, y, x + 12, y + 12), fill=20)
+    # Edge shadow inside the margin is ignored
+    draw.rectangle((0, 0, 30, LETTER[1]), fill=40)
+    stats = page_ink_stats(image)
+    assert stats["blank"]
+    assert 0 < stats["ink"] <= 0.004
+
+
+def test_text_page_is_not_blank():
+    image = Image.new("RGB", LETTER, "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(200, 2000, 60):
+        draw.text((150, y), "Patient statement of account - balance due", fill="black")
+    assert not page_ink_stats(image)["blank"]
+
+
+def test_single_line_of_text_is_not_blank():
+    image = Image.new("RGB", LETTER, "white")
+    font = ImageFont.load_default(size=28)  # ~10 pt at 200 dpi
+    ImageDraw.Draw(image).text((300, 1000), "Signed: J. Smith, MD   Reviewed 01/02/2024", fill="black", font=font)
+    stats = page_ink_stats(image)
+    assert stats["ink"] <= 0.004  # too little ink to decide on coverage alone
+    assert not stats["blank"]
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+import app.services.classification_batcher as batching
+from app.services.ai_scheduler import LANE_BULK, LANE_INTERACTIVE, ai_request_context, current_ai_context
+from app.services.classification_batcher import ClassificationBatcher
+
+KEY = ("org-1", "prompt-v1")
+
+
+@pytest.fixture(autouse=True)
+def no_audits(monkeypatch):
+    monkeypatch.setattr(batching, "AI_BATCH_AUDIT_RATE", 0.0)
+
+
+class Recorder:
+    """``single`` / ``send_batch`` callables that log what they were asked and in which document."""
+
+    def __init__(self, batch_answer=None):
+        self.singles = []
+        self.batches = []
+        self.batch_answer = batch_answer
+
+    async def single(self, image):
+        self.singles.append((image, current_ai_context()["document_id"]))
+        return {"type": f"single:{image}"}
+
+    async def send_batch(self, images):
+        self.batches.append(list(images))
+        if self.batch_answer is not None:
+            return self.batch_answer(images)
+        return [{"type": f"batch:{image}"} for image in images]
+
+
+async def _classify(batcher, recorder, image, document_id=None, lane=LANE_INTERACTIVE):
+    with ai_request_context("org-1", lane, document_id=document_id):
+        return await batcher.classify(KEY, image, recorder.single, recorder.send_batch)
+
+
+def test_full_group_sent_as_one_batch():
+    batcher = ClassificationBatcher(start_pages=3, max_pages=8, max_wait=5)
+    recorder = Recorder()
+
+    async def run():
+        return await asyncio.gather(*(_classify(batcher, recorder, image) for image in "abc"))
+
+    assert asyncio.run(run()) == [{"type": "batch:a"}, {"type": "batch:b"}, {"type": "batch:c"}]
+    assert recorder.batches == [["a", "b", "c"]]
+    assert recorder.singles == []
+    assert batcher.size == 4  # clean batch grows the size
+
+
+def test_timer_flushes_partial_group():
+    batcher = ClassificationBatcher(start_pages=4, max_wait=0.01)
+    recorder = Recorder()
+
+    async def run():
+        return await asyncio.gather(_classify(batcher, recorder, "a"), _classify(batcher, recorder, "b"))
+
+    assert asyncio.run(run()) == [{"type": "batch:a"}, {"type": "batch:b"}]
+    assert recorder.batches == [["a", "b"]]
+
+
+def test_missing_results_retried_alone_in_their_own_context():
+    batcher = ClassificationBatcher(start_pages=3, max_pages=8, max_wait=5)
+    recorder = Recorder(lambda images: [{"type": "batch:a"}, None, {"type": "batch:c"}])
+
+    async def run():
+        return await asyncio.gather(*(
+            _classify(batcher, recorder, image, document_id=document_id)
+            for image, document_id in (("a", 1), ("b", 2), ("c", 3))
+        ))
+
+    assert asyncio.run(run()) == [{"type": "batch:a"}, {"type": "single:b"}, {"type": "batch:c"}]
+    assert recorder.singles == [("b", 2)]
+    assert batcher.stats["retried_pages"] == 1
+    assert batcher.size == 1.5  # incomplete batch halves the size
+
+
+def test_failed_batch_retries_every_page():
+    batcher = ClassificationBatcher(start_pages=2, max_wait=5)
+
+    def fail(images):
+        raise RuntimeError("malformed reply")
+
+    recorder = Recorder(fail)
+
+    async def run():
+        return await asyncio.gather(_classify(batcher, recorder, "a", 1), _classify(batcher, recorder, "b", 2))
+
+    assert asyncio.run(run()) == [{"type": "single:a"}, {"type": "single:b"}]
+    assert sorted(recorder.singles) == [("a", 1), ("b", 2)]
+
+
+def test_lanes_never_share_a_batch():
+    batcher = ClassificationBatcher(start_pages=2, max_wait=0.01)
+    recorder = Recorder()
+
+    async def run():
+        return await asyncio.gather(
+            _classify(batcher, recorder, "a", lane=LANE_INTERACTIVE),
+            _classify(batcher, recorder, "b", lane=LANE_BULK),
+            _classify(batcher, recorder, "c", lane=LANE_INTERACTIVE),
+        )
+
+    asyncio.run(run())
+    assert sorted(recorder.batches) == [["a", "c"]]
+    assert recorder.singles == [("b", None)]  # alone in its lane's group
+
+
+def test_disabled_classifies_one_by_one():
+    batcher = ClassificationBatcher(enabled=False)
+    recorder = Recorder()
+    assert asyncio.run(_classify(batcher, recorder, "a", 7)) == {"type": "single:a"}
+    assert recorder.batches == []
+    assert recorder.singles == [("a", 7)]
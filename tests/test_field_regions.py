@@ -0,0 +1,54 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from app.services.field_regions import crop_region, validate_regions
+
+FIELDS = [{"fieldName": "patient_name"}, {"fieldName": "cpt_codes"}, {"fieldName": "total"}]
+
+
+def test_validate_regions_normalises():
+    regions = validate_regions([
+        {"box": ["0.1", 0.1, 0.6, 0.3], "fields": [" patient_name "]},
+        {"name": "totals", "page": "2", "box": [0.5, 0.8, 1, 1], "fields": ["total"]},
+    ], FIELDS)
+    assert regions == [
+        {"name": "region_1", "page": "first", "box": [0.1, 0.1, 0.6, 0.3], "fields": ["patient_name"]},
+        {"name": "totals", "page": 2, "box": [0.5, 0.8, 1.0, 1.0], "fields": ["total"]},
+    ]
+
+
+def test_validate_regions_empty():
+    assert validate_regions(None) == []
+    assert validate_regions([]) == []
+
+
+@pytest.mark.parametrize("regions, message", [
+    ({"box": [0, 0, 1, 1]}, "must be a list"),
+    ([{"box": [0, 0, 1], "fields": ["total"]}], "box must be"),
+    ([{"box": [0.5, 0, 0.4, 1], "fields": ["total"]}], "left < right"),
+    ([{"box": [0, 0, 0.01, 1], "fields": ["total"]}], "too small"),
+    ([{"page": 0, "box": [0, 0, 1, 1], "fields": ["total"]}], "page must be"),
+    ([{"box": [0, 0, 1, 1], "fields": []}], "non-empty list"),
+    ([{"box": [0, 0, 1, 1], "fields": ["balance"]}], "unknown fields"),
+    ([{"box": [0, 0, 1, 0.5], "fields": ["total"]},
+      {"box": [0, 0.5, 1, 1], "fields": ["total"]}], "already in another region"),
+])
+def test_validate_regions_rejects(regions, message):
+    with pytest.raises(ValueError, match=message):
+        validate_regions(regions, FIELDS)
+
+
+def _encode(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_crop_region_maps_page_box_through_frame():
+    # The page image was trimmed to its right half: (0.5, 0, 1, 1) of the page
+    trimmed = Image.new("RGB", (500, 1000), "white")
+    cropped = crop_region(_encode(trimmed), [0.5, 0.0, 0.75, 0.5], padding=0.0, frame=(0.5, 0.0, 1.0, 1.0))
+    assert Image.open(io.BytesIO(base64.b64decode(cropped))).size == (250, 500)
@@ -0,0 +1,44 @@
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from app.services.image_preprocess import (
+    IMAGE_PROFILES, PROFILE_CLASSIFY, PROFILE_EXTRACT, _synthetic_scan, encode, prepare, vision_tokens,
+)
+
+
+@pytest.fixture(scope="module")
+def scan():
+    image = _synthetic_scan()
+    return image, prepare(image, 200)
+
+
+def _sent(encoded):
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as image:
+        return image.size, image.mode
+
+
+def test_vision_tokens():
+    assert vision_tokens(1700, 2200) == 765  # letter page at 200 dpi: 768x994, 2x2 tiles
+    assert vision_tokens(512, 860) == 425
+    assert vision_tokens(4000, 4000, "low") == 85
+
+
+def test_prepare_trims_border_and_margins(scan):
+    image, (prepared, dpi, frame) = scan
+    assert prepared.width < image.width and prepared.height < image.height
+    assert dpi == pytest.approx(200 * 1024 / 1760)
+    left, top, right, bottom = frame
+    assert 0 < left < right < 1 and 0 < top < bottom < 1
+
+
+@pytest.mark.parametrize("name", [PROFILE_CLASSIFY, PROFILE_EXTRACT])
+def test_profiles_cost_fewer_tokens_than_the_raw_page(scan, name):
+    image, (prepared, dpi, _) = scan
+    profile = IMAGE_PROFILES[name]
+    (width, height), mode = _sent(encode(prepared, profile, dpi))
+    assert vision_tokens(width, height) < vision_tokens(*image.size)
+    assert width * dpi / prepared.width >= profile["min_dpi"]
+    assert mode == ("L" if profile["grayscale"] else "RGB")
@@ -0,0 +1,57 @@
+from app.services.ai_service import InstanceAssembler
+
+
+def _page(number, doc_type, header_restart=True, **signals):
+    return {"page": number, "type": doc_type, "signals": {"header_restart": header_restart, **signals}}
+
+
+def test_instance_released_when_next_restart_arrives():
+    assembler = InstanceAssembler(total_pages=3)
+    assert assembler.add(_page(1, "SUPERBILL")) == []
+    assert assembler.add(_page(2, "SUPERBILL", False)) == []
+    assert assembler.add(_page(3, "LAB_REPORT")) == [{"type": "SUPERBILL", "page_range": "1-2"}]
+    assert assembler.finish() == [{"type": "LAB_REPORT", "page_range": "3-3"}]
+
+
+def test_pages_out_of_order_are_consumed_in_page_order():
+    assembler = InstanceAssembler(total_pages=3)
+    assert assembler.add(_page(3, "LAB_REPORT")) == []
+    assert assembler.add(_page(2, "SUPERBILL", False)) == []
+    assert assembler.add(_page(1, "SUPERBILL")) == [{"type": "SUPERBILL", "page_range": "1-2"}]
+    assert assembler.finish() == [{"type": "LAB_REPORT", "page_range": "3-3"}]
+
+
+def test_continuation_keeps_first_page_type():
+    assembler = InstanceAssembler()
+    assembler.add(_page(1, "DXA_SCAN"))
+    assembler.add(_page(2, "OTHER", False))
+    assert assembler.finish() == [{"type": "DXA_SCAN", "page_range": "1-2"}]
+
+
+def test_blank_pages():
+    assembler = InstanceAssembler()
+    assembler.add(_page(1, "BLANK_PAGE", False, blank=True))
+    assembler.add(_page(2, "SUPERBILL"))
+    assembler.add(_page(3, "BLANK_PAGE", False, blank=True))
+    assert assembler.finish() == [{"type": "SUPERBILL", "page_range": "2-3"}]
+
+
+def test_undecided_restart_follows_type():
+    assembler = InstanceAssembler()
+    closed = []
+    for page in (_page(1, "SUPERBILL"), _page(2, "SUPERBILL", None), _page(3, "LAB_REPORT", None)):
+        closed += assembler.add(page)
+    assert closed + assembler.finish() == [
+        {"type": "SUPERBILL", "page_range": "1-2"},
+        {"type": "LAB_REPORT", "page_range": "3-3"},
+    ]
+
+
+def test_missing_pages_padded_unknown():
+    assembler = InstanceAssembler(total_pages=3)
+    assembler.add(_page(1, "SUPERBILL"))
+    assert assembler.finish() == [
+        {"type": "SUPERBILL", "page_range": "1-1"},
+        {"type": "UNKNOWN", "page_range": "2-2"},
+        {"type": "UNKNOWN", "page_range": "3-3"},
+    ]
@@ -0,0 +1,210 @@
+"""
+Job queue: claim, lease, retry and dead letter.
+
+The worker tests swap the short-lived DB helpers in app.worker for in-memory
+ones and always run. The queue itself is Postgres SQL (SKIP LOCKED, now()),
+so its tests need a disposable database in TEST_DATABASE_URL and are skipped
+without one.
+"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+
+import app.services.job_queue_service as queue
+import app.worker as worker
+from app.models.processing_job import ProcessingJob
+from app.services.job_queue_service import JobQueueService, DEAD, PENDING, RUNNING, SUCCEEDED
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+# ── Worker ──────────────────────────────────────────────────────────────────
+
+def _job(status=RUNNING, attempts=1, job_type="test.job", last_error=None):
+    return {"id": "job-1", "job_type": job_type, "payload": {"document_id": 7}, "status": status,
+            "priority": 0, "organisation_id": None, "attempts": attempts, "last_error": last_error,
+            "queue_wait": 0.0}
+
+
+@pytest.fixture
+def outcomes(monkeypatch):
+    """Records what the worker reports back to the queue instead of writing it."""
+    calls = []
+    state = {"owned": True, "dead": False}
+    monkeypatch.setattr(worker, "_heartbeat", lambda job_id, worker_id: state["owned"])
+    monkeypatch.setattr(worker, "_complete", lambda job_id: calls.append(("complete", job_id)))
+    monkeypatch.setattr(worker, "_fail", lambda job_id, error: calls.append(("fail", error)) or state["dead"])
+    monkeypatch.setattr(worker, "JOB_VISIBILITY_TIMEOUT", 0.3)
+    monkeypatch.setattr(worker, "JOB_HANDLERS", {})
+    monkeypatch.setattr(worker, "DEAD_LETTER_HANDLERS", {})
+
+    async def dead_letter(payload, error):
+        calls.append(("dead_letter", error))
+
+    worker.DEAD_LETTER_HANDLERS["test.job"] = dead_letter
+    return calls, state
+
+
+def test_successful_job_is_completed(outcomes):
+    calls, _ = outcomes
+
+    async def handler(payload):
+        await asyncio.sleep(0.5)  # outlives a heartbeat
+
+    worker.JOB_HANDLERS["test.job"] = handler
+    asyncio.run(worker.JobWorker()._execute(_job()))
+    assert calls == [("complete", "job-1")]
+
+
+def test_failed_job_is_retried(outcomes):
+    calls, _ = outcomes
+
+    async def handler(payload):
+        raise ValueError("bad page")
+
+    worker.JOB_HANDLERS["test.job"] = handler
+    asyncio.run(worker.JobWorker()._execute(_job()))
+    assert calls == [("fail", "ValueError: bad page")]
+
+
+def test_last_failure_runs_dead_letter_handler(outcomes):
+    calls, state = outcomes
+    state["dead"] = True
+
+    async def handler(payload):
+        raise ValueError("bad page")
+
+    worker.JOB_HANDLERS["test.job"] = handler
+    asyncio.run(worker.JobWorker()._execute(_job(attempts=3)))
+    assert calls == [("fail", "ValueError: bad page"), ("dead_letter", "ValueError: bad page")]
+
+
+def test_expired_final_lease_goes_straight_to_dead_letter(outcomes):
+    calls, _ = outcomes
+    asyncio.run(worker.JobWorker()._execute(_job(status=DEAD, attempts=3, last_error="lease expired")))
+    assert calls == [("dead_letter", "lease expired")]
+
+
+def test_lost_lease_abandons_job_without_a_result(outcomes):
+    calls, state = outcomes
+    state["owned"] = False
+    cancelled = []
+
+    async def handler(payload):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    worker.JOB_HANDLERS["test.job"] = handler
+    asyncio.run(worker.JobWorker()._execute(_job()))
+    assert cancelled == [True]
+    assert calls == []
+
+
+# ── Queue (Postgres) ────────────────────────────────────────────────────────
+
+@pytest.fixture
+def db():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL)
+    table = ProcessingJob.__table__
+    with engine.begin() as conn:
+        conn.execute(text("CREATE SCHEMA IF NOT EXISTS docucr"))
+        conn.execute(text("DROP TABLE IF EXISTS docucr.processing_jobs"))
+        # Only the queue table: organisation and document rows are not needed
+        conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+        for index in table.indexes:
+            index.create(conn)
+    Session = sessionmaker(bind=engine)
+    sessions = []
+
+    def session():
+        sessions.append(Session())
+        return sessions[-1]
+
+    yield session
+    for s in sessions:
+        s.close()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS docucr.processing_jobs"))
+    engine.dispose()
+
+
+def test_claim_takes_highest_priority_and_leases_it(db):
+    JobQueueService.enqueue(db(), "test.job", {"n": 1}, priority=0)
+    JobQueueService.enqueue(db(), "test.job", {"n": 2}, priority=10)
+
+    job = JobQueueService.claim(db(), "worker-a")
+    assert job.payload == {"n": 2}
+    assert (job.status, job.attempts, job.locked_by) == (RUNNING, 1, "worker-a")
+    assert JobQueueService.claim(db(), "worker-b").payload == {"n": 1}
+    assert JobQueueService.claim(db(), "worker-c") is None
+
+
+def test_claim_filters_job_types(db):
+    JobQueueService.enqueue(db(), "sop.extract", {})
+    assert JobQueueService.claim(db(), "worker-a", ["document.analyze"]) is None
+    assert JobQueueService.claim(db(), "worker-a", ["sop.extract"]).job_type == "sop.extract"
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_loses_it(db):
+    JobQueueService.enqueue(db(), "test.job", {})
+    first = JobQueueService.claim(db(), "worker-a", visibility_timeout=0)
+
+    second = JobQueueService.claim(db(), "worker-b")
+    assert second.id == first.id
+    assert (second.attempts, second.locked_by) == (2, "worker-b")
+    assert JobQueueService.heartbeat(db(), first.id, "worker-a") is False
+    assert JobQueueService.heartbeat(db(), first.id, "worker-b") is True
+
+
+def test_failure_backs_off_then_retries(db):
+    job = JobQueueService.enqueue(db(), "test.job", {})
+    JobQueueService.claim(db(), "worker-a")
+
+    assert JobQueueService.fail(db(), job.id, "boom") is False
+    session = db()
+    retried = session.get(ProcessingJob, job.id)
+    assert (retried.status, retried.locked_by) == (PENDING, None)
+    assert (retried.run_after - retried.created_at).total_seconds() >= queue.JOB_RETRY_BASE_DELAY
+    assert JobQueueService.claim(db(), "worker-a") is None  # still backing off
+
+    retried.run_after = retried.created_at
+    session.commit()
+    again = JobQueueService.claim(db(), "worker-a")
+    assert (again.status, again.attempts, again.last_error) == (RUNNING, 2, "boom")
+
+
+def test_last_failure_is_dead_lettered(db):
+    job = JobQueueService.enqueue(db(), "test.job", {}, max_attempts=1)
+    JobQueueService.claim(db(), "worker-a")
+    assert JobQueueService.fail(db(), job.id, "boom") is True
+    dead = db().get(ProcessingJob, job.id)
+    assert (dead.status, dead.last_error) == (DEAD, "boom")
+    assert dead.finished_at is not None
+    assert JobQueueService.claim(db(), "worker-a") is None
+
+
+def test_expired_lease_on_last_attempt_is_returned_dead(db):
+    JobQueueService.enqueue(db(), "test.job", {}, max_attempts=1)
+    JobQueueService.claim(db(), "worker-a", visibility_timeout=0)
+
+    job = JobQueueService.claim(db(), "worker-b")
+    assert job.status == DEAD
+    assert "worker-a" in job.last_error
+    assert JobQueueService.claim(db(), "worker-b") is None
+
+
+def test_complete(db):
+    job = JobQueueService.enqueue(db(), "test.job", {})
+    JobQueueService.claim(db(), "worker-a")
+    JobQueueService.complete(db(), job.id)
+    done = db().get(ProcessingJob, job.id)
+    assert (done.status, done.locked_by) == (SUCCEEDED, None)
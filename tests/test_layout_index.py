@@ -0,0 +1,52 @@
+import numpy as np
+
+from app.services.layout_index_service import LayoutIndex
+from app.services.rasterizer import LAYOUT_DIM
+
+
+def _unit(seed, base=None, noise=0.0):
+    rng = np.random.default_rng(seed)
+    v = base.copy() if base is not None else rng.normal(size=LAYOUT_DIM)
+    v = v + rng.normal(scale=noise, size=LAYOUT_DIM)
+    return (v / np.linalg.norm(v)).astype(np.float32)
+
+
+SUPERBILL = _unit(1)
+LAB_REPORT = _unit(2)
+
+
+def _index():
+    index = LayoutIndex(capacity=2)  # grows while being filled
+    for i in range(3):
+        index.upsert(f"s{i}", _unit(10 + i, SUPERBILL, 0.01), "SUPERBILL", True)
+    index.upsert("l0", LAB_REPORT, "LAB_REPORT", False)
+    return index
+
+
+def test_match_agreeing_neighbours():
+    match = _index().match(_unit(99, SUPERBILL, 0.01))
+    assert (match["type"], match["header_restart"], match["support"]) == ("SUPERBILL", True, 3)
+    assert match["distance"] < 0.08
+
+
+def test_no_match_for_unknown_layout():
+    assert _index().match(_unit(3)) is None
+    assert _index().match(None) is None
+    assert LayoutIndex().match(SUPERBILL) is None
+
+
+def test_ambiguous_neighbours_are_left_to_the_model():
+    index = _index()
+    index.upsert("s-cont", _unit(20, SUPERBILL, 0.01), "SUPERBILL", False)
+    assert index.match(SUPERBILL) is None
+
+
+def test_renamed_type_is_not_returned():
+    assert _index().match(SUPERBILL, valid_types={"LAB_REPORT"}) is None
+
+
+def test_upsert_relabels_existing_row():
+    index = _index()
+    index.upsert("l0", LAB_REPORT, "REFERRAL_FORM", True)
+    assert len(index) == 4
+    assert index.match(LAB_REPORT)["type"] == "REFERRAL_FORM"
@@ -0,0 +1,54 @@
+import pytest
+
+from app.services.ocr_classifier import KeywordSignatures
+
+DOCUMENT_TYPES = [
+    {"name": "SUPERBILL", "description": "Itemised superbill listing CPT procedure codes and diagnosis codes for the visit"},
+    {"name": "LAB_REPORT", "description": "Laboratory results with specimen, reference ranges and collection date"},
+    {"name": "REFERRAL_FORM", "description": "Referral from a physician to a specialist with reason for referral"},
+]
+
+
+@pytest.fixture
+def signatures():
+    return KeywordSignatures(DOCUMENT_TYPES)
+
+
+def test_title_on_first_page_settles_restart(signatures):
+    match = signatures.match("SUPERBILL   Page 1 of 2\nCPT procedure and diagnosis codes")
+    assert match["type"] == "SUPERBILL"
+    assert match["settled"]
+    assert match["header_restart"] is True
+
+
+def test_page_number_settles_continuation(signatures):
+    match = signatures.match("SUPERBILL   Page 2 of 2\nCPT procedure and diagnosis codes")
+    assert match["settled"]
+    assert match["header_restart"] is False
+
+
+def test_patient_identity_is_not_a_restart_cue(signatures):
+    match = signatures.match("CPT procedure and diagnosis codes\nPatient Name: Jo Smith  DOB 01/02/1980  MRN 5521")
+    assert match["type"] == "SUPERBILL"
+    assert match["header_restart"] is None
+    assert not match["settled"]
+
+
+def test_close_runner_up_is_not_settled(signatures):
+    match = signatures.match("SUPERBILL laboratory specimen")
+    assert match["type"] == "SUPERBILL"
+    assert match["runner_up"] > 0
+    assert not match["settled"]
+
+
+def test_no_keywords(signatures):
+    match = signatures.match("Patient Name: Jo Smith  DOB 01/02/1980")
+    assert match["type"] is None
+    assert not match["settled"]
+
+
+def test_learned_headers_extend_signature():
+    learned = {"LAB_REPORT": ["Quest Diagnostics hematology panel", "Quest Diagnostics chemistry panel"]}
+    match = KeywordSignatures(DOCUMENT_TYPES, learned).match("QUEST DIAGNOSTICS  Page 1 of 3\nhematology panel")
+    assert match["type"] == "LAB_REPORT"
+    assert "quest" in match["hits"]
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from app.services.progress_aggregator import ProgressAggregator
+from app.services.websocket_manager import websocket_manager
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    messages = []
+
+    async def broadcast(document_id, status, user_id, progress=None, error_message=None):
+        await asyncio.sleep(0)
+        messages.append((document_id, status, progress))
+
+    monkeypatch.setattr(websocket_manager, "broadcast_document_status", broadcast)
+    return messages
+
+
+def test_ticks_are_coalesced_to_leading_and_latest(sent):
+    aggregator = ProgressAggregator(emit_interval=0.05)
+
+    async def run():
+        aggregator.persisted(7, "UPLOADING", "u1", progress=0)
+        await asyncio.sleep(0.06)
+        for progress in (10, 20, 30, 40):
+            aggregator.report(7, "UPLOADING", progress)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == [(7, "UPLOADING", 10), (7, "UPLOADING", 40)]
+    assert (aggregator.emitted, aggregator.coalesced) == (2, 2)
+
+
+def test_ticks_racing_a_transition_are_dropped(sent):
+    aggregator = ProgressAggregator(emit_interval=0.05)
+
+    async def run():
+        aggregator.persisted(7, "UPLOADING", "u1")
+        aggregator.report(7, "UPLOADING", 50)  # throttled: pending
+        aggregator.persisted(7, "QUEUED", "u1")  # transition sent by update_document_status
+        aggregator.report(7, "UPLOADING", 60)
+        aggregator.report(8, "ANALYZING", 10)  # never persisted by this process
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert sent == []
+    assert not aggregator.is_live(7, "UPLOADING")
+
+
+def test_persist_is_due_after_interval():
+    aggregator = ProgressAggregator(persist_interval=0.05)
+    assert aggregator.persist_due(7)
+    aggregator.persisted(7, "ANALYZING", "u1")
+    assert aggregator.is_live(7, "ANALYZING")
+    assert not aggregator.persist_due(7)
+    asyncio.run(asyncio.sleep(0.06))
+    assert aggregator.persist_due(7)
+    aggregator.checkpointed(7)
+    assert not aggregator.persist_due(7)
+
+
+def test_sends_are_held_until_done(sent):
+    aggregator = ProgressAggregator(emit_interval=0)
+
+    async def run():
+        aggregator.persisted(7, "ANALYZING", "u1")
+        aggregator.report(7, "ANALYZING", 25)
+        assert len(aggregator._tasks) == 1
+        await asyncio.gather(*aggregator._tasks)
+        await asyncio.sleep(0)
+        assert aggregator._tasks == set()
+
+    asyncio.run(run())
+    assert sent == [(7, "ANALYZING", 25)]
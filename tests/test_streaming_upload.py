@@ -0,0 +1,96 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+from starlette.datastructures import UploadFile
+
+from app.services.document_service import DocumentService
+from app.services.s3_service import S3_MIN_PART_SIZE, S3Service
+
+
+class FakeS3:
+    """The boto3 calls upload_stream makes, recorded in memory."""
+
+    def __init__(self, fail_part: int = None):
+        self.fail_part = fail_part
+        self.objects = {}
+        self.parts = {}
+        self.completed = []
+        self.aborted = []
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[Key] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.parts["upload-1"] = []
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise ClientError({"Error": {"Code": "InternalError", "Message": "boom"}}, "UploadPart")
+        self.parts[UploadId].append((PartNumber, bytes(Body)))
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed.append(MultipartUpload["Parts"])
+        self.objects[Key] = b"".join(body for _, body in self.parts.pop(UploadId))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.parts.pop(UploadId, None)
+
+
+def _service(fake):
+    service = S3Service.__new__(S3Service)
+    service.s3_client = fake
+    service.bucket_name = "bucket"
+    return service
+
+
+def test_small_file_is_a_single_put():
+    fake = FakeS3()
+    key, bucket = asyncio.run(_service(fake).upload_stream(io.BytesIO(b"%PDF small"), "k", "application/pdf"))
+    assert (key, bucket) == ("k", "bucket")
+    assert fake.objects == {"k": b"%PDF small"}
+    assert fake.completed == []
+
+
+def test_large_file_is_sent_part_by_part():
+    data = os.urandom(2 * S3_MIN_PART_SIZE + 123)
+    fake = FakeS3()
+    sent = []
+    asyncio.run(_service(fake).upload_stream(io.BytesIO(data), "k", "application/pdf",
+                                             progress_callback=sent.append, chunk_size=S3_MIN_PART_SIZE))
+    assert fake.objects["k"] == data
+    assert fake.completed == [[{"ETag": f"etag-{n}", "PartNumber": n} for n in (1, 2, 3)]]
+    assert sent == [S3_MIN_PART_SIZE, S3_MIN_PART_SIZE, 123]
+
+
+def test_failed_part_aborts_the_upload():
+    fake = FakeS3(fail_part=2)
+    data = os.urandom(2 * S3_MIN_PART_SIZE)
+    with pytest.raises(Exception, match="Failed to upload file to S3"):
+        asyncio.run(_service(fake).upload_stream(io.BytesIO(data), "k", "application/pdf",
+                                                 chunk_size=S3_MIN_PART_SIZE))
+    assert fake.aborted == ["upload-1"]
+    assert "k" not in fake.objects
+
+
+def test_spool_upload_copies_and_hashes(monkeypatch):
+    monkeypatch.setattr("app.services.document_service.SPOOL_CHUNK_SIZE", 1000)
+    data = os.urandom(4500)
+    upload = UploadFile(io.BytesIO(data), filename="scan.png")
+
+    entry = asyncio.run(DocumentService._spool_upload(upload))
+    try:
+        with open(entry["path"], "rb") as fp:
+            assert fp.read() == data
+        assert entry["size"] == len(data)
+        assert entry["sha256"] == hashlib.sha256(data).hexdigest()
+        assert entry["path"].endswith(".png")
+    finally:
+        DocumentService._discard_spool(entry)
+    assert not os.path.exists(entry["path"])
@@ -0,0 +1,74 @@
+import asyncio
+import contextlib
+import json
+
+import app.services.websocket_manager as ws
+from app.services.websocket_manager import WebSocketManager
+
+
+class Socket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+class NotifyEngine:
+    """Stands in for the engine: records pg_notify payloads instead of sending them."""
+
+    def __init__(self):
+        self.payloads = []
+
+    @contextlib.contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, statement, params):
+        self.payloads.append(params["payload"])
+
+
+def test_direct_send_without_relay():
+    manager = WebSocketManager()
+    socket = Socket()
+    manager.active_connections["u1"] = [socket]
+    asyncio.run(manager.broadcast_document_status(7, "AI_ANALYZING", "u1", progress=40))
+    assert socket.sent == [{"type": "document_status_update", "document_id": 7, "status": "AI_ANALYZING",
+                            "progress": 40, "error_message": None}]
+
+
+def test_relayed_message_reaches_the_api_process_socket(monkeypatch):
+    notify = NotifyEngine()
+    monkeypatch.setattr(ws, "engine", notify)
+    worker = WebSocketManager()
+    worker.relay = True
+    api = WebSocketManager()
+    socket = Socket()
+    api.active_connections["u1"] = [socket]
+
+    async def run():
+        await worker.broadcast_document_finding(7, "u1", "SUPERBILL", "1-2", {"cpt_codes": ["99213"]})
+        assert worker.active_connections == {}
+        loop = asyncio.get_running_loop()
+        # The listener thread hands each notification to _handle
+        await asyncio.to_thread(api._handle, loop, notify.payloads[0])
+        api._handle(loop, json.dumps({"user_id": "someone-else", "message": {}}))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert len(notify.payloads) == 1
+    assert socket.sent == [{"type": "document_finding", "document_id": 7, "document_type": "SUPERBILL",
+                            "page_range": "1-2", "fields": {"cpt_codes": ["99213"]}, "verified": True,
+                            "error": None}]
+
+
+def test_oversized_finding_is_relayed_without_fields(monkeypatch):
+    notify = NotifyEngine()
+    monkeypatch.setattr(ws, "engine", notify)
+    worker = WebSocketManager()
+    worker.relay = True
+    asyncio.run(worker.broadcast_document_finding(7, "u1", "SUPERBILL", "1-9", {"notes": "x" * 10000}))
+    relayed = json.loads(notify.payloads[0])
+    assert relayed["message"]["fields"] is None
+    assert relayed["message"]["truncated"] is True
+    assert len(notify.payloads[0]) < 8000